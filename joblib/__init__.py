@@ -118,6 +118,7 @@ from .numpy_pickle import load
 from .compressor import register_compressor
 from .parallel import Parallel
 from .parallel import delayed
+from .parallel import shared
 from .parallel import cpu_count
 from .parallel import register_parallel_backend
 from .parallel import parallel_backend
@@ -125,6 +126,6 @@ from .parallel import effective_n_jobs
 
 
 __all__ = ['Memory', 'MemorizedResult', 'PrintTime', 'Logger', 'hash', 'dump',
-           'load', 'Parallel', 'delayed', 'cpu_count', 'effective_n_jobs',
-           'register_parallel_backend', 'parallel_backend',
+           'load', 'Parallel', 'delayed', 'shared', 'cpu_count',
+           'effective_n_jobs', 'register_parallel_backend', 'parallel_backend',
            'register_store_backend', 'register_compressor']
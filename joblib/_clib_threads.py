@@ -0,0 +1,172 @@
+"""
+Runtime control of the thread pools of the C-libraries loaded in a process.
+
+Setting OMP_NUM_THREADS and similar environment variables only works before
+the libraries are loaded. This module finds the OpenBLAS, MKL and OpenMP
+libraries already loaded in the process with ctypes and calls their API to
+change the size of their thread pools, so that the reused workers of an
+executor can switch between thread budgets without being restarted.
+
+Only Linux and macOS are supported: elsewhere no library is found and
+``limit_threads`` does nothing.
+"""
+# License: BSD 3 clause
+
+import os
+import sys
+import ctypes
+import threading
+import contextlib
+
+
+# Name prefixes of the supported libraries with the functions to get and set
+# the size of their thread pool. The 64-bit integer builds of OpenBLAS
+# shipped with numpy and scipy suffix their symbols.
+_LIBRARIES = [
+    ('openblas', ('libopenblas',),
+     ('openblas_get_num_threads', 'openblas_get_num_threads64_'),
+     ('openblas_set_num_threads', 'openblas_set_num_threads64_')),
+    ('mkl', ('libmkl_rt',), ('MKL_Get_Max_Threads',),
+     ('MKL_Set_Num_Threads',)),
+    ('openmp', ('libgomp', 'libiomp', 'libomp'), ('omp_get_max_threads',),
+     ('omp_set_num_threads',)),
+]
+
+_RTLD_NOLOAD = getattr(os, 'RTLD_NOLOAD', 0)
+
+
+class _ThreadPoolLibrary(object):
+    """Loaded C-library managing a thread pool"""
+
+    def __init__(self, api, path, dll, get_func, set_func):
+        self.api = api
+        self.path = path
+        self._dll = dll
+        self._get = get_func
+        self._set = set_func
+
+    def get_num_threads(self):
+        return self._get()
+
+    def set_num_threads(self, n_threads):
+        self._set(n_threads)
+
+    def __repr__(self):
+        return '%s(api=%r, path=%r)' % (self.__class__.__name__, self.api,
+                                        self.path)
+
+
+def _decode_path(path):
+    if isinstance(path, bytes) and not isinstance(path, str):
+        return path.decode(sys.getfilesystemencoding())
+    return path
+
+
+def _linux_loaded_paths():
+    class _DlPhdrInfo(ctypes.Structure):
+        _fields_ = [('dlpi_addr', ctypes.c_void_p),
+                    ('dlpi_name', ctypes.c_char_p),
+                    ('dlpi_phdr', ctypes.c_void_p),
+                    ('dlpi_phnum', ctypes.c_uint16)]
+
+    paths = []
+
+    def collect(info, size, data):
+        name = info.contents.dlpi_name
+        if name:
+            paths.append(_decode_path(name))
+        return 0
+
+    callback_type = ctypes.CFUNCTYPE(ctypes.c_int,
+                                     ctypes.POINTER(_DlPhdrInfo),
+                                     ctypes.c_size_t, ctypes.c_char_p)
+    ctypes.CDLL(None).dl_iterate_phdr(callback_type(collect), None)
+    return paths
+
+
+def _darwin_loaded_paths():
+    libc = ctypes.CDLL(None)
+    libc._dyld_get_image_name.restype = ctypes.c_char_p
+    return [_decode_path(libc._dyld_get_image_name(i))
+            for i in range(libc._dyld_image_count())]
+
+
+def _loaded_paths():
+    """Paths of the shared libraries loaded in the process"""
+    try:
+        if sys.platform.startswith('linux'):
+            return _linux_loaded_paths()
+        elif sys.platform == 'darwin':
+            return _darwin_loaded_paths()
+    except (AttributeError, OSError):
+        # The dynamic loader API is not available.
+        pass
+    return []
+
+
+def _load_library(path):
+    filename = os.path.basename(path)
+    for api, prefixes, get_names, set_names in _LIBRARIES:
+        if not filename.startswith(prefixes):
+            continue
+        try:
+            dll = ctypes.CDLL(path, mode=_RTLD_NOLOAD)
+        except OSError:
+            return None
+        for get_name, set_name in zip(get_names, set_names):
+            get_func = getattr(dll, get_name, None)
+            set_func = getattr(dll, set_name, None)
+            if get_func is not None and set_func is not None:
+                get_func.restype = ctypes.c_int
+                set_func.argtypes = [ctypes.c_int]
+                return _ThreadPoolLibrary(api, path, dll, get_func, set_func)
+    return None
+
+
+_libraries = []
+_n_modules_scanned = None
+_scan_lock = threading.Lock()
+
+
+def get_libraries():
+    """The supported C-libraries loaded in the process.
+
+    The loaded libraries are listed again only when new Python modules were
+    imported since the last call, as C-libraries are loaded by extension
+    modules.
+    """
+    global _libraries, _n_modules_scanned
+    with _scan_lock:
+        if _n_modules_scanned != len(sys.modules):
+            _n_modules_scanned = len(sys.modules)
+            libraries = [_load_library(path) for path in _loaded_paths()]
+            _libraries = [lib for lib in libraries if lib is not None]
+        return list(_libraries)
+
+
+def get_thread_limits():
+    """Size of the thread pool of each supported loaded library, by path"""
+    return dict((lib.path, lib.get_num_threads()) for lib in get_libraries())
+
+
+@contextlib.contextmanager
+def limit_threads(n_threads):
+    """Limit the thread pools of the loaded C-libraries to n_threads.
+
+    The previous sizes are restored when exiting the context. Does nothing if
+    n_threads is None. As the thread pools of OpenMP are specific to each
+    thread and the ones of the BLAS libraries are global to the process,
+    concurrent threads should not use this context with different limits.
+    """
+    restore = []
+    if n_threads is not None:
+        for lib in get_libraries():
+            previous = lib.get_num_threads()
+            if previous != n_threads:
+                lib.set_num_threads(n_threads)
+                restore.append((lib, previous))
+    try:
+        yield
+    finally:
+        for lib, previous in reversed(restore):
+            lib.set_num_threads(previous)
@@ -0,0 +1,170 @@
+"""
+Sharing of the CPU cores between the levels of nested Parallel calls.
+
+Each Parallel call splits the cores it was granted, all the cores of the
+machine at the top level, between its running tasks. The nested calls started
+by these tasks size their pool of workers after this share so that all the
+levels together fill the machine without oversubscribing it.
+"""
+# License: BSD 3 clause
+
+from __future__ import division
+
+import os
+import mmap
+import atexit
+import struct
+import tempfile
+import threading
+
+from ._multiprocessing_helpers import mp
+
+
+_COUNTER = struct.Struct('q')
+# Number of counters held by each counter file
+_N_SLOTS = mmap.PAGESIZE // _COUNTER.size
+
+
+class _CounterFile(object):
+    """Memory mapped file holding the counters of several CoreBudgets.
+
+    The files are created once per process and their counters are reused by
+    the successive Parallel calls, so that starting a call does not create a
+    file.
+    """
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix='joblib_core_budget_')
+        try:
+            os.write(fd, _COUNTER.pack(-1) * _N_SLOTS)
+            self.counters = mmap.mmap(fd, _COUNTER.size * _N_SLOTS)
+        finally:
+            os.close(fd)
+        self.free_offsets = list(range(0, _COUNTER.size * _N_SLOTS,
+                                       _COUNTER.size))
+        atexit.register(self.close)
+
+    def close(self):
+        self.counters.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+_counter_files = []
+_counter_files_pid = None
+_counter_files_lock = threading.Lock()
+
+
+def _acquire_counter():
+    """Return a free counter as a (counter file, offset) pair"""
+    global _counter_files, _counter_files_pid
+    with _counter_files_lock:
+        if _counter_files_pid != os.getpid():
+            # The files of the parent of a forked process are not ours.
+            _counter_files = []
+            _counter_files_pid = os.getpid()
+        for counter_file in _counter_files:
+            if counter_file.free_offsets:
+                break
+        else:
+            counter_file = _CounterFile()
+            _counter_files.append(counter_file)
+        offset = counter_file.free_offsets.pop()
+    _COUNTER.pack_into(counter_file.counters, offset, 0)
+    return counter_file, offset
+
+
+def _release_counter(counter_file, offset):
+    # A negative count tells the workers that the call is over.
+    _COUNTER.pack_into(counter_file.counters, offset, -1)
+    with _counter_files_lock:
+        counter_file.free_offsets.append(offset)
+
+
+def _cpu_count():
+    if mp is None:
+        return 1
+    from .externals.loky import cpu_count
+    return cpu_count()
+
+
+class CoreBudget(object):
+    """Cores shared by the running tasks of a Parallel call.
+
+    At most ``n_workers`` tasks of the call run at the same time and share
+    ``n_cores`` cores. If ``shared`` is True, the number of running tasks is
+    also written to a memory mapped file so that the share seen from the
+    worker processes grows as the tasks of the call complete. The counters
+    of the successive calls are taken from the same file.
+    """
+
+    def __init__(self, n_cores, n_workers, shared=False):
+        self.n_cores = n_cores
+        self.n_workers = n_workers
+        self._n_running = 0
+        self._lock = threading.Lock()
+        self._path = None
+        self._offset = 0
+        self._counter = None
+        if shared:
+            self._counter, self._offset = _acquire_counter()
+            self._path = self._counter.path
+
+    def task_started(self):
+        self._add_running(1)
+
+    def task_completed(self):
+        self._add_running(-1)
+
+    def _add_running(self, n_tasks):
+        with self._lock:
+            self._n_running += n_tasks
+            if self._counter is not None:
+                _COUNTER.pack_into(self._counter.counters, self._offset,
+                                   self._n_running)
+
+    def n_running(self):
+        """Number of tasks of the call that are currently running"""
+        if self._path is None or self._counter is not None:
+            return self._n_running
+        # Unpickled in a worker: read the count of the parent process.
+        try:
+            with open(self._path, 'rb') as f:
+                f.seek(self._offset)
+                n_running = _COUNTER.unpack(f.read(_COUNTER.size))[0]
+        except (IOError, OSError, struct.error):
+            n_running = -1
+        if n_running < 0:
+            # The call is over.
+            return self.n_workers
+        return n_running
+
+    def share(self):
+        """Number of cores available to each running task"""
+        n_running = min(max(self.n_running(), 1), self.n_workers)
+        return max(self.n_cores // n_running, 1)
+
+    def close(self):
+        """Release the counter holding the number of running tasks"""
+        with self._lock:
+            if self._counter is None:
+                return
+            _release_counter(self._counter, self._offset)
+            self._counter = None
+            self._path = None
+
+    def __getstate__(self):
+        return dict(n_cores=self.n_cores, n_workers=self.n_workers,
+                    _path=self._path, _offset=self._offset)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._n_running = self.n_workers
+        self._lock = threading.Lock()
+        self._counter = None
+
+    def __repr__(self):
+        return '%s(n_cores=%d, n_workers=%d)' % (
+            self.__class__.__name__, self.n_cores, self.n_workers)
@@ -6,7 +6,8 @@ from uuid import uuid4
 import weakref
 
 from .parallel import AutoBatchingMixin, ParallelBackendBase, BatchedCalls
-from .parallel import parallel_backend
+from .parallel import (parallel_backend, _unwrap_shared_arguments,
+                       _call_collecting_failure)
 
 try:
     import distributed
@@ -84,22 +85,28 @@ def _funcname(x):
 
 
 class Batch(object):
-    def __init__(self, tasks):
+    def __init__(self, tasks, collect_errors=False):
         self.tasks = tasks
+        self.collect_errors = collect_errors
 
     def __call__(self, *data):
         results = []
         with parallel_backend('dask'):
-            for func, args, kwargs in self.tasks:
+            for task in self.tasks:
+                func, args, kwargs = _unwrap_shared_arguments(*task)
                 args = [a(data) if isinstance(a, itemgetter) else a
                         for a in args]
                 kwargs = {k: v(data) if isinstance(v, itemgetter) else v
                           for (k, v) in kwargs.items()}
-                results.append(func(*args, **kwargs))
+                if self.collect_errors:
+                    results.append(
+                        _call_collecting_failure(func, args, kwargs))
+                else:
+                    results.append(func(*args, **kwargs))
         return results
 
     def __reduce__(self):
-        return Batch, (self.tasks,)
+        return Batch, (self.tasks, self.collect_errors)
 
 
 class DaskDistributedBackend(ParallelBackendBase, AutoBatchingMixin):
@@ -162,6 +169,9 @@ class DaskDistributedBackend(ParallelBackendBase, AutoBatchingMixin):
         return sum(self.client.ncores().values())
 
     def _to_func_args(self, func):
+        if getattr(func, '_vectorize', None) is not None:
+            # Vectorized batches cannot be split into individual tasks.
+            return func, ()
         collected_futures = []
         itemgetters = dict()
 
@@ -206,7 +216,8 @@ class DaskDistributedBackend(ParallelBackendBase, AutoBatchingMixin):
 
         if not collected_futures:
             return func, ()
-        return (Batch(tasks), collected_futures)
+        return (Batch(tasks, getattr(func, '_collect_errors', False)),
+                collected_futures)
 
     def apply_async(self, func, callback=None):
         key = '%s-batch-%s' % (_funcname(func), uuid4().hex)
@@ -7,9 +7,13 @@ Reducer using memory mapping for numpy arrays
 
 from mmap import mmap
 import errno
+import hashlib
 import os
+import sys
+import select
 import stat
 import threading
+import time
 import atexit
 import tempfile
 import warnings
@@ -42,6 +46,8 @@ from .numpy_pickle import load
 from .numpy_pickle import dump
 from .backports import make_memmap
 from .disk import delete_folder
+from ._profiling import add_memmap_time
+from ._multiprocessing_helpers import mp
 
 # Some system have a ramdisk mounted by default, we can use it instead of /tmp
 # as the default folder to dump big arrays to share with subprocesses.
@@ -57,6 +63,19 @@ SYSTEM_SHARED_MEM_FS_MIN_SIZE = int(2e9)
 FOLDER_PERMISSIONS = stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR
 FILE_PERMISSIONS = stat.S_IRUSR | stat.S_IWUSR
 
+# Minimal number of bytes copied by each of the threads dumping a large array
+# to a temporary memmap file.
+DUMP_CHUNK_NBYTES = int(64e6)
+
+# Number and length, in items, of the evenly spaced blocks of a registered
+# array hashed to detect its in place modifications.
+FINGERPRINT_N_BLOCKS = 1024
+FINGERPRINT_BLOCK_SIZE = 64
+
+# Name of the named pipe used by the processes to release their references
+# to the temporary memmap files of a pool folder.
+REFCOUNTS_FIFO_NAME = '.refcounts'
+
 
 class _WeakArrayKeyMap:
     """A variant of weakref.WeakKeyDictionary for unhashable numpy arrays.
@@ -98,6 +117,176 @@ class _WeakArrayKeyMap:
         raise PicklingError("_WeakArrayKeyMap is not pickleable")
 
 
+###############################################################################
+# Reference counting of the temporary memmap files
+
+
+class _TemporaryMemmapTracker(object):
+    """Reference counts of the temporary memmap files of a pool folder.
+
+    The parent process counts a reference each time it pickles a temporary
+    memmap file, and the processes that unpickle it release this reference
+    when the rebuilt memmap is garbage collected, by writing to a named pipe
+    of the folder read by a thread of the parent process. A file is deleted
+    as soon as it is not referenced anymore instead of when the pool folder
+    is deleted.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.address = os.path.join(folder, REFCOUNTS_FIFO_NAME)
+        self.pid = os.getpid()
+        self._counts = {}
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._started = False
+        _local_trackers[self.address] = self
+
+    def _ensure_started(self):
+        if self._started and os.path.exists(self.address):
+            return
+        # The folder, with the pipe and the files it counted, was deleted at
+        # the end of a Parallel call and is now reused by a new one.
+        self._counts.clear()
+        self._generation += 1
+        try:
+            os.mkfifo(self.address, FILE_PERMISSIONS)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd_read = os.open(self.address, os.O_RDONLY | os.O_NONBLOCK)
+        # Keep a writing end open so that the pipe is not closed when the
+        # workers close theirs.
+        fd_write = os.open(self.address, os.O_WRONLY)
+        thread = threading.Thread(target=self._read_messages,
+                                  args=(fd_read, fd_write, self._generation))
+        thread.daemon = True
+        thread.start()
+        self._started = True
+
+    def _read_messages(self, fd_read, fd_write, generation):
+        pending = b''
+        try:
+            # Stop once the folder is deleted, checking every second.
+            while (generation == self._generation and
+                   os.path.exists(self.address)):
+                if not select.select([fd_read], [], [], 1)[0]:
+                    continue
+                try:
+                    data = os.read(fd_read, 65536)
+                except OSError as e:
+                    if e.errno == errno.EAGAIN:
+                        continue
+                    raise
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                with self._lock:
+                    if generation != self._generation:
+                        break
+                    for line in filter(None, lines):
+                        self.update(line[:1].decode('ascii'),
+                                    line[1:].decode('utf-8'))
+        finally:
+            os.close(fd_read)
+            os.close(fd_write)
+
+    def update(self, sign, basename):
+        """Count a new reference to basename if sign is '+' or release one
+        if it is '-'."""
+        with self._lock:
+            if sign == '+':
+                self._ensure_started()
+                self._counts[basename] = self._counts.get(basename, 0) + 1
+                return
+            count = self._counts.get(basename)
+            if count is None:
+                # The file was already deleted along with the folder.
+                return
+            if count > 1:
+                self._counts[basename] = count - 1
+                return
+            del self._counts[basename]
+            try:
+                os.unlink(os.path.join(self.folder, basename))
+            except OSError:
+                pass
+
+
+def _get_tracker(folder):
+    """Reference counts of the temporary memmaps of folder if named pipes are
+    supported."""
+    if not hasattr(os, 'mkfifo'):
+        return None
+    return _TemporaryMemmapTracker(folder)
+
+
+# Trackers of the current process, by address.
+_local_trackers = weakref.WeakValueDictionary()
+
+# Address of the tracker of the temporary memmap files rebuilt in this
+# process along with their number of live memmaps, by filename.
+_tracked_memmaps = {}
+_finalizers = {}
+_fifo_fds = {}
+_refcounts_lock = threading.RLock()
+
+
+def _send_refcount_message(address, sign, filename):
+    """Count or release a reference to a temporary memmap file."""
+    basename = os.path.basename(filename)
+    tracker = _local_trackers.get(address)
+    if tracker is not None and tracker.pid == os.getpid():
+        tracker.update(sign, basename)
+        return
+    message = (sign + basename + '\n').encode('utf-8')
+    with _refcounts_lock:
+        # Open the pipe again once if the tracker it was opened for is gone.
+        for _ in range(2):
+            fd = _fifo_fds.pop(address, None)
+            try:
+                if fd is None:
+                    fd = os.open(address, os.O_WRONLY | os.O_NONBLOCK)
+                    _set_blocking(fd)
+                os.write(fd, message)
+                _fifo_fds[address] = fd
+                return
+            except OSError:
+                if fd is not None:
+                    os.close(fd)
+        # The pool folder was deleted: there is nothing left to release.
+
+
+def _set_blocking(fd):
+    import fcntl
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+
+
+def _track_memmap(m, address):
+    """Release the reference to the file of m when m is garbage collected."""
+    filename = m.filename
+
+    def release(ref):
+        try:
+            _finalizers.pop(id(ref), None)
+            with _refcounts_lock:
+                n_live = _tracked_memmaps[filename][1] - 1
+                if n_live == 0:
+                    del _tracked_memmaps[filename]
+                else:
+                    _tracked_memmaps[filename][1] = n_live
+            _send_refcount_message(address, '-', filename)
+        except Exception:
+            # The interpreter is shutting down: the folder is deleted anyway.
+            pass
+
+    with _refcounts_lock:
+        _tracked_memmaps.setdefault(filename, [address, 0])[1] += 1
+        # The weak references to the memmaps are not hashable.
+        ref = weakref.ref(m, release)
+        _finalizers[id(ref)] = ref
+
+
 ###############################################################################
 # Support for efficient transient pickling of numpy data structures
 
@@ -202,6 +391,210 @@ def _strided_from_memmap(filename, dtype, mode, offset, order, shape, strides,
         return as_strided(base, shape=shape, strides=strides)
 
 
+def _strided_from_tracked_memmap(address, filename, *args):
+    """Reconstruct an array view on a temporary memmap file, releasing the
+    reference to the file when it is garbage collected."""
+    a = _strided_from_memmap(filename, *args)
+    _track_memmap(_get_backing_memmap(a), address)
+    return a
+
+
+def _strided_from_returned_memmap(filename, *args):
+    """Reconstruct in the parent process an array returned by a worker in a
+    temporary memmap file, deleting the file when it is garbage collected."""
+    a = _strided_from_memmap(filename, *args)
+    address = os.path.join(os.path.dirname(filename), REFCOUNTS_FIFO_NAME)
+    tracker = _local_trackers.get(address)
+    if tracker is not None and tracker.pid == os.getpid():
+        # The worker did not keep any reference to the file.
+        tracker.update('+', os.path.basename(filename))
+        _track_memmap(_get_backing_memmap(a), address)
+    return a
+
+
+def _get_n_dump_threads():
+    """Number of threads copying the chunks of a large array"""
+    try:
+        return min(mp.cpu_count(), 8)
+    except (AttributeError, NotImplementedError):
+        return 1
+
+
+def _copy_in_chunks(m, a, order):
+    """Copy a to m in chunks along the outermost axis of the order of m.
+
+    numpy releases the GIL when copying arrays without objects, so that the
+    chunks of the arrays larger than DUMP_CHUNK_NBYTES are copied concurrently
+    by several threads, which also share the cost of the page faults.
+    """
+    axis = 0 if order == 'C' else a.ndim - 1
+    n_chunks = 1
+    if a.ndim > 0:
+        n_chunks = min(_get_n_dump_threads(), a.shape[axis],
+                       a.nbytes // DUMP_CHUNK_NBYTES)
+    if n_chunks <= 1:
+        m[...] = a
+        return
+    bounds = np.linspace(0, a.shape[axis], n_chunks + 1).astype(int)
+    errors = []
+
+    def copy_chunk(start, stop):
+        index = (slice(None),) * axis + (slice(start, stop),)
+        try:
+            m[index] = a[index]
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=copy_chunk, args=(start, stop))
+               for start, stop in zip(bounds[:-2], bounds[1:-1])]
+    for thread in threads:
+        thread.start()
+    # The last chunk is copied by the current thread.
+    copy_chunk(bounds[-2], bounds[-1])
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def _dump_raw_array(a, filename, order):
+    """Copy the data of a to a file holding nothing but its raw buffer.
+
+    Unlike ``numpy_pickle.dump``, no header is written: the file can be
+    memory mapped by the workers with ``_strided_from_memmap`` without
+    parsing it. In the /dev/shm folder, such a file is a named block of the
+    POSIX shared memory.
+
+    ``multiprocessing.shared_memory``, available on Python 3.8+ only, is not
+    used even there: it creates the same /dev/shm blocks, but registers them
+    with the resource tracker of every process attaching to them, which may
+    unlink them while other processes still use them (bpo-39959), and it
+    does not support the 'c' mmap_mode. The files are removed with the pool
+    folder instead.
+    """
+    m = make_memmap(filename, dtype=a.dtype, shape=a.shape, mode='w+',
+                    order=order)
+    _copy_in_chunks(m, a, order)
+    m.flush()
+    os.chmod(filename, FILE_PERMISSIONS)
+
+
+def _prewarm_file(filename, nbytes):
+    """Load the content of a file in the page cache of the OS.
+
+    When possible, the OS is only advised to read the file ahead in the
+    background, else the file is read with a memmap.
+    """
+    fadvise = getattr(os, 'posix_fadvise', None)
+    if fadvise is not None:
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            fadvise(fd, 0, nbytes, os.POSIX_FADV_WILLNEED)
+            return
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    make_memmap(filename, dtype=np.uint8, shape=nbytes, mode='r').max()
+
+
+def _fingerprint(a, order):
+    """Hash of evenly spaced blocks of items of a, taken in the given order.
+
+    Only the sampled items are read, whatever the size and layout of a: the
+    whole array is hashed when it holds fewer items than the blocks.
+    """
+    n_items = FINGERPRINT_N_BLOCKS * FINGERPRINT_BLOCK_SIZE
+    if a.size <= n_items:
+        indices = np.arange(a.size)
+    else:
+        starts = np.linspace(0, a.size - FINGERPRINT_BLOCK_SIZE,
+                             FINGERPRINT_N_BLOCKS).astype(np.intp)
+        indices = (starts[:, np.newaxis] +
+                   np.arange(FINGERPRINT_BLOCK_SIZE)).ravel()
+    if a.ndim == 0:
+        sample = a.reshape(1)
+    else:
+        sample = a[np.unravel_index(indices, a.shape, order=order)]
+    return hashlib.md5(np.ascontiguousarray(sample).view(np.uint8)).digest()
+
+
+def _unlink_quietly(filename):
+    try:
+        os.unlink(filename)
+    except OSError:
+        # Already deleted, or still mapped by a process under Windows: the
+        # file is deleted along with its folder at exit.
+        pass
+
+
+class _MemmapRegistry(object):
+    """Memmap files of the arrays reused by the Parallel calls of a process.
+
+    Unlike the _WeakArrayKeyMap of an ArrayMemmapReducer, the registry
+    outlives the executors and their temporary folders: an array is dumped
+    once per registry folder, and its file is reused as long as the array
+    keeps its shape, dtype, layout and the fingerprint computed when it was
+    dumped. The file is deleted as soon as the array is garbage collected.
+    Only used in the parent process.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        # Reentrant as the weakref callbacks can be called by the garbage
+        # collector while the lock is held by the same thread.
+        self.lock = threading.RLock()
+
+    def get(self, a, folder, order):
+        """Filename of the up to date dump of a in folder, or None"""
+        with self.lock:
+            ref, files = self._entries.get(id(a), (None, {}))
+            if ref is None or ref() is not a:
+                return None
+            filename, shape, dtype, file_order, fingerprint = files.get(
+                folder, (None, None, None, None, None))
+        if (filename is None or (shape, dtype, file_order) !=
+                (a.shape, a.dtype, order) or not os.path.exists(filename)):
+            return None
+        if _fingerprint(a, order) != fingerprint:
+            # a was modified in place since it was dumped.
+            return None
+        return filename
+
+    def set(self, a, folder, order, filename):
+        """Register filename as the dump of a in folder"""
+        key = id(a)
+        fingerprint = _fingerprint(a, order)
+        with self.lock:
+            ref, files = self._entries.get(key, (None, {}))
+            if ref is None or ref() is not a:
+                files = {}
+
+                def on_destroy(ref):
+                    with self.lock:
+                        if self._entries.get(key, (None,))[0] is not ref:
+                            return
+                        _, files = self._entries.pop(key)
+                    for filename, _, _, _, _ in files.values():
+                        _unlink_quietly(filename)
+
+                ref = weakref.ref(a, on_destroy)
+                self._entries[key] = ref, files
+            previous = files.get(folder)
+            files[folder] = filename, a.shape, a.dtype, order, fingerprint
+        if previous is not None and previous[0] != filename:
+            _unlink_quietly(previous[0])
+
+    def __getstate__(self):
+        raise PicklingError("_MemmapRegistry is not pickleable")
+
+
+_memmap_registry = _MemmapRegistry()
+
+# Folders of the registry, deleted when the process exits.
+_registry_folders = set()
+
+
 def _reduce_memmap_backed(a, m):
     """Pickling reduction for memmap backed arrays.
 
@@ -233,9 +626,14 @@ def _reduce_memmap_backed(a, m):
         # view will be extracted.
         strides = a.strides
         total_buffer_len = (a_end - a_start) // a.itemsize
-    return (_strided_from_memmap,
-            (m.filename, a.dtype, m.mode, offset, order, a.shape, strides,
-             total_buffer_len))
+    args = (m.filename, a.dtype, m.mode, offset, order, a.shape, strides,
+            total_buffer_len)
+    address = _tracked_memmaps.get(m.filename, (None,))[0]
+    if address is not None:
+        # A temporary memmap file of a pool sent to another process.
+        _send_refcount_message(address, '+', m.filename)
+        return (_strided_from_tracked_memmap, (address,) + args)
+    return (_strided_from_memmap, args)
 
 
 def reduce_memmap(a):
@@ -271,33 +669,131 @@ class ArrayMemmapReducer(object):
         If verbose > 1, both memmap creations, reuse and array pickling are
         logged.
     prewarm: bool, optional, False by default.
-        Force a read on newly memmapped array to make sure that OS pre-cache it
-        memory. This can be useful to avoid concurrent disk access when the
-        same data array is passed to different worker processes.
+        Make the OS pre-cache newly memmapped array in memory, with a read
+        ahead in the background where posix_fadvise is available. This can be
+        useful to avoid concurrent disk access when the same data array is
+        passed to different worker processes.
+    tracker: _TemporaryMemmapTracker, optional
+        If set, the memmap files are deleted as soon as the tasks and the
+        arrays of the workers referring to them are gone. Only used in the
+        parent process.
+    backward: bool, optional, False by default.
+        If True, the arrays are results returned by the workers to the parent
+        process, which becomes the owner of their memmap files.
+    registry_folder: str, optional
+        If set, the arrays are dumped to this folder, which outlives
+        temp_folder, and their files are reused by the next reducers with the
+        same registry folder until the arrays are modified or garbage
+        collected. Only used in the parent process.
     """
 
     def __init__(self, max_nbytes, temp_folder, mmap_mode, verbose=0,
-                 prewarm=True):
+                 prewarm=True, tracker=None, backward=False,
+                 registry_folder=None):
         self._max_nbytes = max_nbytes
         self._temp_folder = temp_folder
         self._mmap_mode = mmap_mode
         self.verbose = int(verbose)
         self._prewarm = prewarm
+        self._tracker = tracker
+        self._backward = backward
+        self._registry_folder = registry_folder
+        # Only one thread looks up or dumps an array in the registry, while
+        # the registry lock is only held to access its entries.
+        self._registry_lock = threading.Lock()
         self._memmaped_arrays = _WeakArrayKeyMap()
 
     def __reduce__(self):
         # The ArrayMemmapReducer is passed to the children processes: it needs
         # to be pickled but the _WeakArrayKeyMap need to be skipped as it's
         # only guaranteed to be consistent with the parent process memory
-        # garbage collection.
-        args = (self._max_nbytes, self._temp_folder, self._mmap_mode)
-        kwargs = {
-            'verbose': self.verbose,
-            'prewarm': self._prewarm,
-        }
-        return ArrayMemmapReducer, args, kwargs
-
-    def __call__(self, a):
+        # garbage collection. The options are passed to the constructor: a
+        # state dict would set attributes without their leading underscore.
+        args = (self._max_nbytes, self._temp_folder, self._mmap_mode,
+                self.verbose, self._prewarm, None, self._backward)
+        return ArrayMemmapReducer, args
+
+    def _ensure_temp_folder(self):
+        # check that the folder exists (lazily create the pool temp folder
+        # if required)
+        try:
+            os.makedirs(self._temp_folder)
+            os.chmod(self._temp_folder, FOLDER_PERMISSIONS)
+            # Use new filenames when the folder is reused after its
+            # deletion, not to mix up the files with the deleted ones.
+            self._memmaped_arrays = _WeakArrayKeyMap()
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+
+    def _dump(self, a, filename, order):
+        dump_start = time.time()
+        if self.verbose > 0:
+            print("Memmapping (shape={}, dtype={}) to new file {}"
+                  .format(a.shape, a.dtype, filename))
+        _dump_raw_array(a, filename, order)
+
+        if self._prewarm:
+            # Warm up the data by accessing it. This operation ensures
+            # that the disk access required to create the memmapping
+            # file are performed in the reducing process and avoids
+            # concurrent memmap creation in multiple children
+            # processes.
+            _prewarm_file(filename, a.nbytes)
+        add_memmap_time(time.time() - dump_start)
+
+    def _get_registered_filename(self, a, folder, order):
+        filename = _memmap_registry.get(a, folder, order)
+        if filename is not None:
+            if self.verbose > 1:
+                print("Memmapping (shape={}, dtype={}) to registered file {}"
+                      .format(a.shape, a.dtype, filename))
+            return filename
+        try:
+            os.makedirs(folder)
+            os.chmod(folder, FOLDER_PERMISSIONS)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+        # Changed arrays get a new file, as the workers of a previous call
+        # might still map the old one.
+        basename = "{}-{}-{}.mmap".format(
+            os.getpid(), id(threading.current_thread()), uuid4().hex)
+        filename = os.path.join(folder, basename)
+        self._dump(a, filename, order)
+        _memmap_registry.set(a, folder, order, filename)
+        return filename
+
+    def _get_cached_filename(self, a, key):
+        try:
+            filename, cached_key = self._memmaped_arrays.get(a)
+        except KeyError:
+            return None
+        return filename if cached_key == key else None
+
+    def _reduce_registered(self, a):
+        folder = self._registry_folder
+        order = 'F' if np.isfortran(a) else 'C'
+        key = (a.shape, a.dtype, order)
+        # The fingerprint of a is only compared with the registered one the
+        # first time a is pickled during a call: the next batches use the
+        # filename cached along with the ones of the temp folder.
+        filename = self._get_cached_filename(a, key)
+        if filename is None:
+            with self._registry_lock:
+                filename = self._get_cached_filename(a, key)
+                if filename is None:
+                    filename = self._get_registered_filename(a, folder, order)
+                    self._memmaped_arrays.set(a, (filename, key))
+        elif self.verbose > 1:
+            print("Memmapping (shape={}, dtype={}) to registered file {}"
+                  .format(a.shape, a.dtype, filename))
+        # The file belongs to the registry: the workers do not track it.
+        return (_strided_from_memmap,
+                (filename, a.dtype, self._mmap_mode, 0, order, a.shape, None,
+                 None))
+
+    def __call__(self, a, out_of_band=False):
         m = _get_backing_memmap(a)
         if m is not None:
             # a is already backed by a memmap file, let's reuse it directly
@@ -305,71 +801,270 @@ class ArrayMemmapReducer(object):
 
         if (not a.dtype.hasobject and self._max_nbytes is not None and
                 a.nbytes > self._max_nbytes):
-            # check that the folder exists (lazily create the pool temp folder
-            # if required)
-            try:
-                os.makedirs(self._temp_folder)
-                os.chmod(self._temp_folder, FOLDER_PERMISSIONS)
-            except OSError as e:
-                if e.errno != errno.EEXIST:
-                    raise e
+            self._ensure_temp_folder()
+            if self._registry_folder is not None:
+                return self._reduce_registered(a)
 
-            try:
-                basename = self._memmaped_arrays.get(a)
-            except KeyError:
-                # Generate a new unique random filename. The process and thread
-                # ids are only useful for debugging purpose and to make it
-                # easier to cleanup orphaned files in case of hard process
-                # kill (e.g. by "kill -9" or segfault).
-                basename = "{}-{}-{}.pkl".format(
-                    os.getpid(), id(threading.current_thread()), uuid4().hex)
-                self._memmaped_arrays.set(a, basename)
+            # Generate a new unique random filename. The process and thread
+            # ids are only useful for debugging purpose and to make it easier
+            # to cleanup orphaned files in case of hard process kill (e.g. by
+            # "kill -9" or segfault).
+            new_basename = "{}-{}-{}.mmap".format(
+                os.getpid(), id(threading.current_thread()), uuid4().hex)
+            if self._backward:
+                # A worker can return the same array, modified in place, for
+                # several tasks: each result is dumped to its own file.
+                basename = new_basename
+            else:
+                try:
+                    basename = self._memmaped_arrays.get(a)
+                except KeyError:
+                    basename = new_basename
+                    self._memmaped_arrays.set(a, basename)
             filename = os.path.join(self._temp_folder, basename)
+            # Keep the layout of Fortran arrays to copy them efficiently.
+            order = 'F' if np.isfortran(a) else 'C'
+            args = (filename, a.dtype, self._mmap_mode, 0, order, a.shape,
+                    None, None)
+
+            if self._tracker is not None:
+                # Count the reference to the file first so that it cannot be
+                # deleted anymore once it was found below.
+                self._tracker.update('+', basename)
 
             # In case the same array with the same content is passed several
             # times to the pool subprocess children, serialize it only once
-
-            # XXX: implement an explicit reference counting scheme to make it
-            # possible to delete temporary files as soon as the workers are
-            # done processing this data.
-            if not os.path.exists(filename):
-                if self.verbose > 0:
-                    print("Memmapping (shape={}, dtype={}) to new file {}"
-                          .format(a.shape, a.dtype, filename))
-                for dumped_filename in dump(a, filename):
-                    os.chmod(dumped_filename, FILE_PERMISSIONS)
-
-                if self._prewarm:
-                    # Warm up the data by accessing it. This operation ensures
-                    # that the disk access required to create the memmapping
-                    # file are performed in the reducing process and avoids
-                    # concurrent memmap creation in multiple children
-                    # processes.
-                    load(filename, mmap_mode=self._mmap_mode).max()
+            if self._backward or not os.path.exists(filename):
+                self._dump(a, filename, order)
             elif self.verbose > 1:
                 print("Memmapping (shape={}, dtype={}) to old file {}"
                       .format(a.shape, a.dtype, filename))
 
-            # The worker process will use joblib.load to memmap the data
-            return (load, (filename, self._mmap_mode))
+            # The worker process maps the raw buffer of the file directly
+            if self._backward:
+                return (_strided_from_returned_memmap, args)
+            if self._tracker is not None:
+                return (_strided_from_tracked_memmap,
+                        (self._tracker.address,) + args)
+            return (_strided_from_memmap, args)
         else:
             # do not convert a into memmap, let pickler do its usual copy with
             # the default system pickler
             if self.verbose > 1:
                 print("Pickling array (shape={}, dtype={})."
                       .format(a.shape, a.dtype))
+            if out_of_band:
+                # Let a pickler using the protocol 5 send the buffer of the
+                # array out-of-band instead of pickling it twice.
+                return a.__reduce_ex__(5)
             return (loads, (dumps(a, protocol=HIGHEST_PROTOCOL),))
 
 
+def _buffer_from_array(func, args):
+    """Rebuild an Arrow buffer on top of the array rebuilt by func"""
+    import pyarrow
+    return pyarrow.py_buffer(func(*args))
+
+
+class ArrowBufferReducer(object):
+    """Reducer callable to memmap the large buffers of Arrow data.
+
+    pyarrow pickles the buffers of the arrays, record batches and tables as
+    bytes. Instead, the buffers are reduced as uint8 arrays by array_reducer,
+    so that the ones larger than its threshold are dumped once to its temp
+    folder and rebuilt by the workers as zero-copy buffers on top of the
+    memmaps.
+
+    Parameters
+    ----------
+    array_reducer: ArrayMemmapReducer
+        Reducer of the content of the buffers.
+    """
+
+    def __init__(self, array_reducer):
+        self._array_reducer = array_reducer
+        # A new buffer object is created each time an Arrow array is pickled:
+        # the views passed to array_reducer are kept by address and size to
+        # dump the data only once per call. They are released, along with the
+        # buffers, by delete_temp_folder at the end of the call.
+        self._views = {}
+
+    def __reduce__(self):
+        # As for ArrayMemmapReducer, the views are only meaningful in the
+        # parent process.
+        return ArrowBufferReducer, (self._array_reducer,)
+
+    def clear(self):
+        """Release the buffers pickled since the temp folder was created"""
+        self._views.clear()
+
+    def __call__(self, buf):
+        array_reducer = self._array_reducer
+        max_nbytes = array_reducer._max_nbytes
+        if max_nbytes is None or buf.size <= max_nbytes:
+            return (_buffer_from_array, array_reducer(
+                np.frombuffer(buf, dtype=np.uint8)))
+
+        key = (buf.address, buf.size)
+        view = self._views.get(key)
+        if view is None:
+            # The view keeps the buffer alive, so that its address cannot
+            # be reused by another one.
+            view = np.frombuffer(buf, dtype=np.uint8)
+            self._views[key] = view
+        return (_buffer_from_array, array_reducer(view))
+
+
+# Reducers of the Arrow buffers of the current process, by temp folder.
+_arrow_buffer_reducers = weakref.WeakValueDictionary()
+
+
+def delete_temp_folder(folder):
+    """Delete the temp folder of a pool at the end of a call.
+
+    The reducers of the pool outlive the call when its workers are reused:
+    the objects they keep to dump the data of the call only once are
+    released along with the folder.
+    """
+    reducer = _arrow_buffer_reducers.get(folder)
+    if reducer is not None:
+        reducer.clear()
+    delete_folder(folder)
+
+
+class SharedArgument(object):
+    """Wrapper for an argument passed to many tasks of a Parallel call.
+
+    See ``joblib.shared``.
+    """
+
+    # Set to True as soon as an instance is created so that the batches of
+    # tasks can skip looking for wrapped arguments when there are none.
+    in_use = False
+
+    def __init__(self, obj):
+        self.obj = obj
+        SharedArgument.in_use = True
+
+
+# Objects loaded by the worker processes for shared arguments, by filename.
+_shared_arguments_cache = {}
+_shared_arguments_lock = threading.Lock()
+
+
+def _load_shared_argument(filename, mmap_mode):
+    """Load a shared argument in a worker, at most once per worker process."""
+    with _shared_arguments_lock:
+        try:
+            return _shared_arguments_cache[filename]
+        except KeyError:
+            pass
+        # Forget about the arguments whose file were deleted by the parent
+        # process at the end of their Parallel call.
+        for old_filename in list(_shared_arguments_cache):
+            if not os.path.exists(old_filename):
+                del _shared_arguments_cache[old_filename]
+        obj = load(filename, mmap_mode=mmap_mode)
+        _shared_arguments_cache[filename] = obj
+        return obj
+
+
+class SharedArgumentReducer(object):
+    """Reducer callable to send shared arguments once per worker.
+
+    The wrapped object is dumped only once to a file in ``temp_folder`` and
+    the workers only receive the name of this file. Each worker loads it
+    at most once and reuses the loaded object for all the subsequent tasks.
+
+    Parameters
+    ----------
+    temp_folder: str
+        Path of a folder where the files of the shared arguments are created.
+    mmap_mode: 'r', 'r+' or 'c'
+        Mode used to memmap the numpy arrays of the shared arguments when
+        loading them in the workers.
+    verbose: int, optional, 0 by default
+        If verbose > 0, dumps of shared arguments are logged.
+    """
+
+    def __init__(self, temp_folder, mmap_mode, verbose=0):
+        self._temp_folder = temp_folder
+        self._mmap_mode = mmap_mode
+        self.verbose = int(verbose)
+        self._dumped_arguments = _WeakArrayKeyMap()
+
+    def __reduce__(self):
+        # As for ArrayMemmapReducer, the _WeakArrayKeyMap is only meaningful
+        # in the parent process.
+        args = (self._temp_folder, self._mmap_mode)
+        return SharedArgumentReducer, args, {'verbose': self.verbose}
+
+    def __call__(self, shared_argument):
+        try:
+            filename = self._dumped_arguments.get(shared_argument)
+        except KeyError:
+            filename = None
+        if filename is None or not os.path.exists(filename):
+            # The file is missing if the temporary folder was deleted at the
+            # end of a previous Parallel call: use a new filename to make sure
+            # workers do not reuse an outdated version of the object.
+            try:
+                os.makedirs(self._temp_folder)
+                os.chmod(self._temp_folder, FOLDER_PERMISSIONS)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise e
+            basename = "{}-{}-{}-shared.pkl".format(
+                os.getpid(), id(threading.current_thread()), uuid4().hex)
+            filename = os.path.join(self._temp_folder, basename)
+            if self.verbose > 0:
+                print("Dumping shared argument of type {} to new file {}"
+                      .format(type(shared_argument.obj).__name__, filename))
+            for dumped_filename in dump(shared_argument.obj, filename):
+                os.chmod(dumped_filename, FILE_PERMISSIONS)
+            self._dumped_arguments.set(shared_argument, filename)
+        return (_load_shared_argument, (filename, self._mmap_mode))
+
+
+def _delete_folder_at_exit(folder):
+    # In some cases the Python runtime seems to set delete_folder to None
+    # just before exiting when accessing the delete_folder function from the
+    # module namespace. So instead we reimport the delete_folder function
+    # explicitly.
+    # https://github.com/joblib/joblib/issues/328
+    # We cannot just use from 'joblib.pool import delete_folder' because
+    # joblib should only use relative imports to allow easy vendoring.
+    delete_folder = __import__(
+        _delete_folder_module, fromlist=['delete_folder']).delete_folder
+    try:
+        delete_folder(folder)
+    except WindowsError:
+        warnings.warn("Failed to clean temporary folder: {}".format(folder))
+
+
+_delete_folder_module = whichmodule(delete_folder, 'delete_folder')
+
+
 def get_memmapping_reducers(
         pool_id, forward_reducers=None, backward_reducers=None,
         temp_folder=None, max_nbytes=1e6, mmap_mode='r', verbose=0,
-        prewarm=False, **kwargs):
+        prewarm=False, results_max_nbytes=None, reuse_memmaps=False,
+        **kwargs):
     """Construct a pair of memmapping reducer linked to a tmpdir.
 
     This function manage the creation and the clean up of the temporary folders
     underlying the memory maps and should be use to get the reducers necessary
     to construct joblib pool or executor.
+
+    If results_max_nbytes is not None, the results arrays larger than it are
+    written to the tmpdir by the workers and memory mapped by the parent
+    process. This is not supported under Windows, where the tmpdir cannot be
+    deleted while the results are still mapped.
+
+    If reuse_memmaps is True, the large arrays are dumped to a folder shared
+    by all the reducers of the process instead of the tmpdir, so that the
+    next pools and executors reuse their files as long as the arrays are not
+    modified or garbage collected.
     """
     if forward_reducers is None:
         forward_reducers = dict()
@@ -389,26 +1084,20 @@ def get_memmapping_reducers(
     # self to ensure that this callback won't prevent garbage collection of
     # the pool instance and related file handler resources such as POSIX
     # semaphores and pipes
-    pool_module_name = whichmodule(delete_folder, 'delete_folder')
-
-    def _cleanup():
-        # In some cases the Python runtime seems to set delete_folder to
-        # None just before exiting when accessing the delete_folder
-        # function from the closure namespace. So instead we reimport
-        # the delete_folder function explicitly.
-        # https://github.com/joblib/joblib/issues/328
-        # We cannot just use from 'joblib.pool import delete_folder'
-        # because joblib should only use relative imports to allow
-        # easy vendoring.
-        delete_folder = __import__(
-            pool_module_name, fromlist=['delete_folder']).delete_folder
-        try:
-            delete_folder(pool_folder)
-        except WindowsError:
-            warnings.warn("Failed to clean temporary folder: {}"
-                          .format(pool_folder))
+    atexit.register(_delete_folder_at_exit, pool_folder)
 
-    atexit.register(_cleanup)
+    registry_folder = None
+    if reuse_memmaps:
+        registry_folder = os.path.join(
+            os.path.dirname(pool_folder),
+            "joblib_memmapping_registry_{}".format(os.getpid()))
+        with _memmap_registry.lock:
+            if registry_folder not in _registry_folders:
+                _registry_folders.add(registry_folder)
+                atexit.register(_delete_folder_at_exit, registry_folder)
+
+    forward_reducers[SharedArgument] = SharedArgumentReducer(
+        pool_folder, mmap_mode, verbose)
 
     if np is not None:
         # Register smart numpy.ndarray reducers that detects memmap backed
@@ -418,16 +1107,32 @@ def get_memmapping_reducers(
             prewarm = not use_shared_mem
         forward_reduce_ndarray = ArrayMemmapReducer(
             max_nbytes, pool_folder, mmap_mode, verbose,
-            prewarm=prewarm)
+            prewarm=prewarm, tracker=_get_tracker(pool_folder),
+            registry_folder=registry_folder)
         forward_reducers[np.ndarray] = forward_reduce_ndarray
         forward_reducers[np.memmap] = reduce_memmap
 
-        # Communication from child process to the parent process always
-        # pickles in-memory numpy.ndarray without dumping them as memmap
-        # to avoid confusing the caller and make it tricky to collect the
-        # temporary folder
+        # The buffers of scipy.sparse matrices and pandas DataFrames are numpy
+        # arrays, handled by the ndarray reducer. The ones of Arrow data
+        # can only be passed by processes which already imported pyarrow.
+        if 'pyarrow' in sys.modules:
+            import pyarrow
+            reduce_arrow_buffer = ArrowBufferReducer(forward_reduce_ndarray)
+            _arrow_buffer_reducers[pool_folder] = reduce_arrow_buffer
+            for buffer_type in (pyarrow.Buffer,
+                                getattr(pyarrow, 'ResizableBuffer', None)):
+                if buffer_type is not None:
+                    forward_reducers[buffer_type] = reduce_arrow_buffer
+
+        # Communication from child process to the parent process pickles
+        # in-memory numpy.ndarray without dumping them as memmap by default
+        # to avoid confusing the caller. Otherwise, the parent process maps
+        # the large results in a writable mode and owns their files.
+        if os.name == 'nt':
+            results_max_nbytes = None
         backward_reduce_ndarray = ArrayMemmapReducer(
-            None, pool_folder, mmap_mode, verbose)
+            results_max_nbytes, pool_folder, 'r+', verbose, prewarm=False,
+            backward=True)
         backward_reducers[np.ndarray] = backward_reduce_ndarray
         backward_reducers[np.memmap] = reduce_memmap
 
@@ -13,18 +13,20 @@ from abc import ABCMeta, abstractmethod
 
 from .format_stack import format_exc
 from .my_exceptions import WorkerInterrupt, TransportableException
+from ._core_budget import _cpu_count
+from ._clib_threads import get_libraries
 from ._multiprocessing_helpers import mp
-from ._compat import with_metaclass, PY27
+from ._compat import with_metaclass, PY27, PY3_OR_LATER
 if mp is not None:
-    from .disk import delete_folder
     from .pool import MemmappingPool
+    from ._memmapping_reducer import delete_temp_folder
     from multiprocessing.pool import ThreadPool
     from .executor import get_memmapping_executor
 
     # Compat between concurrent.futures and multiprocessing TimeoutError
     from multiprocessing import TimeoutError
     from .externals.loky._base import TimeoutError as LokyTimeoutError
-    from .externals.loky import process_executor, cpu_count
+    from .externals.loky import process_executor
 
 
 class ParallelBackendBase(with_metaclass(ABCMeta)):
@@ -32,6 +34,10 @@ class ParallelBackendBase(with_metaclass(ABCMeta)):
 
     supports_timeout = False
     nesting_level = 0
+    # CoreBudget of the Parallel call running the tasks of this backend and,
+    # for nested backends, of the call that started them.
+    core_budget = None
+    parent_budget = None
 
     def __init__(self, nesting_level=0):
         self.nesting_level = nesting_level
@@ -126,9 +132,29 @@ class ParallelBackendBase(with_metaclass(ABCMeta)):
         """
         nesting_level = getattr(self, 'nesting_level', 0) + 1
         if nesting_level > 1:
-            return SequentialBackend(nesting_level=nesting_level)
+            backend = SequentialBackend(nesting_level=nesting_level)
         else:
-            return ThreadingBackend(nesting_level=nesting_level)
+            backend = ThreadingBackend(nesting_level=nesting_level)
+        backend.parent_budget = self.core_budget
+        return backend
+
+    def available_cores(self):
+        """Number of CPU cores that the workers of this backend can use.
+
+        This is the share of the cores granted to each task of the outer
+        Parallel call for nested backends and all the cores otherwise.
+        """
+        if self.parent_budget is None:
+            return _cpu_count()
+        return self.parent_budget.share()
+
+    def _limit_nested_n_jobs(self, n_jobs):
+        """Resolve negative n_jobs and bound nested ones by the core share"""
+        if n_jobs < 0:
+            n_jobs = max(self.available_cores() + 1 + n_jobs, 1)
+        if self.parent_budget is not None:
+            n_jobs = min(n_jobs, self.available_cores())
+        return n_jobs
 
     @contextlib.contextmanager
     def retrieval_context(self):
@@ -147,6 +173,10 @@ class ParallelBackendBase(with_metaclass(ABCMeta)):
         """
         yield
 
+    def _clib_threads(self, n_jobs):
+        """Threads of the C-libraries of each of n_jobs worker processes"""
+        return max(self.available_cores() // n_jobs, 1)
+
     @classmethod
     def limit_clib_threads(cls, n_threads=1):
         """Initializer to limit the number of threads used by some C-libraries.
@@ -155,10 +185,18 @@ class ParallelBackendBase(with_metaclass(ABCMeta)):
         Accelerated and OpenBLAS libraries, that can be used with scientific
         computing tools like numpy.
         """
+        limited = False
         for var in cls.SUPPORTED_CLIB_VARS:
             var_value = os.environ.get(var, None)
             if var_value is None:
                 os.environ[var] = str(n_threads)
+                limited = True
+        if limited:
+            # The libraries loaded before, for instance by the process the
+            # worker was forked from, ignore the variables.
+            for lib in get_libraries():
+                if lib.get_num_threads() > n_threads:
+                    lib.set_num_threads(n_threads)
 
 
 class SequentialBackend(ParallelBackendBase):
@@ -186,7 +224,9 @@ class SequentialBackend(ParallelBackendBase):
 
     def get_nested_backend(self):
         nested_level = getattr(self, 'nesting_level', 0) + 1
-        return SequentialBackend(nesting_level=nested_level)
+        backend = SequentialBackend(nesting_level=nested_level)
+        backend.parent_budget = self.core_budget
+        return backend
 
 
 class PoolManagerMixin(object):
@@ -202,9 +242,7 @@ class PoolManagerMixin(object):
             # multiprocessing is not available or disabled, fallback
             # to sequential mode
             return 1
-        elif n_jobs < 0:
-            n_jobs = max(cpu_count() + 1 + n_jobs, 1)
-        return n_jobs
+        return self._limit_nested_n_jobs(n_jobs)
 
     def terminate(self):
         """Shutdown the process or thread pool"""
@@ -219,6 +257,11 @@ class PoolManagerMixin(object):
 
     def apply_async(self, func, callback=None):
         """Schedule a func to be run"""
+        if PY3_OR_LATER:
+            # Also call the callback when the batch fails so that
+            # Parallel.acall is notified of the error.
+            return self._get_pool().apply_async(
+                SafeFunction(func), callback=callback, error_callback=callback)
         return self._get_pool().apply_async(
             SafeFunction(func), callback=callback)
 
@@ -371,6 +414,10 @@ class MultiprocessingBackend(PoolManagerMixin, AutoBatchingMixin,
     Will introduce some communication and memory overhead when exchanging
     input and output data with the with the worker Python processes.
     However, does not suffer from the Python Global Interpreter Lock.
+
+    If ring_buffer_nbytes is not None, the small batches of tasks and their
+    results are sent through ring buffers of about this size in shared
+    memory instead of pipes.
     """
 
     # Environment variables to protect against bad situations when nesting
@@ -378,6 +425,11 @@ class MultiprocessingBackend(PoolManagerMixin, AutoBatchingMixin,
 
     supports_timeout = True
 
+    def __init__(self, nesting_level=0, ring_buffer_nbytes=None):
+        AutoBatchingMixin.__init__(self)
+        ParallelBackendBase.__init__(self, nesting_level=nesting_level)
+        self.ring_buffer_nbytes = ring_buffer_nbytes
+
     def effective_n_jobs(self, n_jobs):
         """Determine the number of jobs which are going to run in parallel.
 
@@ -440,7 +492,9 @@ class MultiprocessingBackend(PoolManagerMixin, AutoBatchingMixin,
         # Make sure to free as much memory as possible before forking
         gc.collect()
         self._pool = MemmappingPool(
-            n_jobs, initializer=self.limit_clib_threads, **memmappingpool_args)
+            n_jobs, initializer=self.limit_clib_threads,
+            initargs=(self._clib_threads(n_jobs),),
+            ring_buffer_nbytes=self.ring_buffer_nbytes, **memmappingpool_args)
         self.parallel = parallel
         return n_jobs
 
@@ -454,10 +508,19 @@ class MultiprocessingBackend(PoolManagerMixin, AutoBatchingMixin,
 
 
 class LokyBackend(AutoBatchingMixin, ParallelBackendBase):
-    """Managing pool of workers with loky instead of multiprocessing."""
+    """Managing pool of workers with loky instead of multiprocessing.
+
+    If preload is a list of module names, the workers are forked from a
+    process which imported these modules, when the platform supports it.
+    """
 
     supports_timeout = True
 
+    def __init__(self, nesting_level=0, preload=None):
+        AutoBatchingMixin.__init__(self)
+        ParallelBackendBase.__init__(self, nesting_level=nesting_level)
+        self.preload = preload
+
     def configure(self, n_jobs=1, parallel=None, prefer=None, require=None,
                   idle_worker_timeout=300, **memmappingexecutor_args):
         """Build a process executor and return the number of workers"""
@@ -469,6 +532,7 @@ class LokyBackend(AutoBatchingMixin, ParallelBackendBase):
         self._workers = get_memmapping_executor(
             n_jobs, timeout=idle_worker_timeout,
             initializer=self.limit_clib_threads,
+            initargs=(self._clib_threads(n_jobs),), preload=self.preload,
             **memmappingexecutor_args)
         self.parallel = parallel
         return n_jobs
@@ -497,9 +561,7 @@ class LokyBackend(AutoBatchingMixin, ParallelBackendBase):
                     'threads, setting n_jobs=1',
                     stacklevel=3)
             return 1
-        elif n_jobs < 0:
-            n_jobs = max(cpu_count() + 1 + n_jobs, 1)
-        return n_jobs
+        return self._limit_nested_n_jobs(n_jobs)
 
     def apply_async(self, func, callback=None):
         """Schedule a func to be run"""
@@ -523,7 +585,7 @@ class LokyBackend(AutoBatchingMixin, ParallelBackendBase):
             # Terminate does not shutdown the workers as we want to reuse them
             # in latter calls but we free as much memory as we can by deleting
             # the shared memory
-            delete_folder(self._workers._temp_folder)
+            delete_temp_folder(self._workers._temp_folder)
             self._workers = None
 
         self.reset_batch_stats()
@@ -532,7 +594,7 @@ class LokyBackend(AutoBatchingMixin, ParallelBackendBase):
         """Shutdown the workers and restart a new one with the same parameters
         """
         self._workers.shutdown(kill_workers=True)
-        delete_folder(self._workers._temp_folder)
+        delete_temp_folder(self._workers._temp_folder)
         self._workers = None
         if ensure_ready:
             self.configure(n_jobs=self.parallel.n_jobs, parallel=self.parallel)
@@ -0,0 +1,199 @@
+"""
+Per-phase timing of the execution of Parallel calls.
+
+The timestamps of the serialization phases are collected with ``ProfileMark``
+instances that are pickled at the beginning and at the end of the tasks and
+results messages: each mark records when the sending process reached it while
+pickling and when the receiving process reached it while unpickling.
+"""
+# License: BSD 3 clause
+
+from __future__ import division
+
+import os
+import json
+import time
+import threading
+
+
+# Phases of the life of a batch in the order in which they happen.
+PHASES = ('dispatch', 'queue', 'pickle', 'memmap', 'transfer', 'unpickle',
+          'compute', 'result_pickle', 'result_transfer', 'result_unpickle')
+
+_memmap_clock = threading.local()
+
+
+def add_memmap_time(duration):
+    """Account for time spent dumping arrays to memmap in the current thread"""
+    _memmap_clock.value = get_memmap_time() + duration
+
+
+def get_memmap_time():
+    """Cumulative time spent dumping arrays to memmap in the current thread"""
+    return getattr(_memmap_clock, 'value', 0.)
+
+
+class ProfileMark(object):
+    """Timestamp marker embedded in a message exchanged with the workers.
+
+    ``sent`` is set when the sending process pickles the mark and
+    ``received`` when the receiving process unpickles it.
+    """
+    def __init__(self, sent=None, received=None, memmap_clock=None):
+        self.sent = sent
+        self.received = received
+        self.memmap_clock = memmap_clock
+
+    def stamp(self):
+        self.sent = time.time()
+        self.memmap_clock = get_memmap_time()
+
+    def __reduce__(self):
+        if self.received is not None:
+            # This mark was already delivered: send it back unchanged, for
+            # instance as part of the report of a batch.
+            return ProfileMark, (self.sent, self.received, self.memmap_clock)
+        if self.sent is None:
+            self.stamp()
+        return _rebuild_profile_mark, (self.sent, self.memmap_clock)
+
+
+def _rebuild_profile_mark(sent, memmap_clock):
+    return ProfileMark(sent=sent, received=time.time(),
+                       memmap_clock=memmap_clock)
+
+
+def _percentile(sorted_values, q):
+    """Nearest-rank percentile of a sorted list"""
+    index = int(round(q / 100. * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class ParallelProfile(object):
+    """Timing breakdown of the batches of a Parallel call.
+
+    An instance is available as ``Parallel.last_profile`` after a call with
+    ``profile=True``. Each batch is decomposed into the phases listed in
+    ``PHASES``, timed on the parent side (dispatch, queue, pickle, memmap,
+    result_unpickle) or on the worker side (unpickle, compute,
+    result_pickle). Phases that do not apply to the backend, such as
+    pickling with thread-based backends, are not reported.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.end_time = None
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def add_batch(self, batch_index, batch_size, dispatch_start, dispatch_end,
+                  completion_time, task_marks=None, report=None):
+        """Record the timings of a completed batch"""
+        intervals = [('dispatch', dispatch_start, dispatch_end, None)]
+        worker_id = getattr(report, 'worker_id', None)
+        if task_marks is not None and task_marks[0].sent is not None:
+            start, end = task_marks
+            intervals.append(('queue', dispatch_end, start.sent, None))
+            intervals.append(('pickle', start.sent, end.sent, None))
+            intervals.append(('memmap', start.sent, start.sent +
+                              end.memmap_clock - start.memmap_clock, None))
+        if report is not None:
+            received = report.task_marks
+            if received is not None and task_marks is not None:
+                start, end = received
+                intervals.append(('transfer', task_marks[1].sent,
+                                  start.received, worker_id))
+                intervals.append(('unpickle', start.received, end.received,
+                                  worker_id))
+            intervals.append(('compute', report.start_time, report.end_time,
+                              worker_id))
+            if report.result_marks is not None:
+                start, end = report.result_marks
+                if start.received is not None:
+                    intervals.append(('result_pickle', start.sent, end.sent,
+                                      worker_id))
+                    intervals.append(('result_transfer', end.sent,
+                                      start.received, None))
+                    intervals.append(('result_unpickle', start.received,
+                                      end.received, None))
+        with self._lock:
+            self.batches.append(dict(
+                batch_index=batch_index, batch_size=batch_size,
+                worker_id=worker_id, start=dispatch_start,
+                end=completion_time, intervals=intervals))
+
+    def _durations(self):
+        durations = dict()
+        for batch in self.batches:
+            for phase, start, end, _ in batch['intervals']:
+                # Clocks of different processes are not perfectly in sync:
+                # clip the inter-process phases at zero.
+                durations.setdefault(phase, []).append(max(end - start, 0.))
+        return durations
+
+    def summary(self):
+        """Aggregate the timings of all the batches.
+
+        Returns a dict with the number of batches and tasks, the wall time of
+        the call, the total, mean and 50th, 90th and 99th percentiles of the
+        duration of each phase and the overhead ratio: the fraction of the
+        cumulated batch durations (from dispatch to completion) that is not
+        spent computing in the workers.
+        """
+        with self._lock:
+            durations = self._durations()
+            batch_durations = [b['end'] - b['start'] for b in self.batches]
+            n_tasks = sum(b['batch_size'] for b in self.batches)
+        phases = dict()
+        for phase in PHASES:
+            values = sorted(durations.get(phase, []))
+            if not values:
+                continue
+            phases[phase] = dict(
+                count=len(values), total=sum(values),
+                mean=sum(values) / len(values),
+                p50=_percentile(values, 50), p90=_percentile(values, 90),
+                p99=_percentile(values, 99), max=values[-1])
+        total_batch_duration = sum(batch_durations)
+        compute = sum(durations.get('compute', []))
+        if total_batch_duration > 0:
+            overhead_ratio = max(1 - compute / total_batch_duration, 0.)
+        else:
+            overhead_ratio = 0.
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return dict(n_batches=len(batch_durations), n_tasks=n_tasks,
+                    wall_time=end_time - self.start_time, phases=phases,
+                    overhead_ratio=overhead_ratio)
+
+    def to_chrome_trace(self, filename=None):
+        """Export the timeline in the Chrome trace-event format.
+
+        The result can be loaded in chrome://tracing or
+        https://ui.perfetto.dev. If ``filename`` is given, the trace is also
+        written to this file as JSON.
+        """
+        parent_pid = os.getpid()
+        tids = dict()
+        events = []
+        with self._lock:
+            batches = list(self.batches)
+        for batch in batches:
+            for phase, start, end, worker_id in batch['intervals']:
+                if worker_id is None:
+                    pid, tid = parent_pid, 0
+                else:
+                    pid = int(worker_id.split('-', 1)[0])
+                    tid = tids.setdefault(worker_id, len(tids) + 1)
+                events.append({
+                    'name': phase, 'cat': 'joblib', 'ph': 'X',
+                    'ts': (start - self.start_time) * 1e6,
+                    'dur': max(end - start, 0.) * 1e6,
+                    'pid': pid, 'tid': tid,
+                    'args': {'batch_index': batch['batch_index'],
+                             'batch_size': batch['batch_size']},
+                })
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if filename is not None:
+            with open(filename, 'w') as f:
+                json.dump(trace, f)
+        return trace
@@ -9,22 +9,61 @@ copy between the parent and child processes.
 # License: BSD 3 clause
 
 import random
-from .disk import delete_folder
+from ._memmapping_reducer import delete_temp_folder
 from ._memmapping_reducer import get_memmapping_reducers
 from .externals.loky.reusable_executor import get_reusable_executor
+from .externals.loky.backend.context import get_context
 
 
 _backend_args = None
 
 
+def _import_and_initialize(modules, initializer, initargs):
+    """Initializer of the workers importing the preloaded modules.
+
+    The modules are already imported in the workers forked from the
+    forkserver. This only imports them on the platforms without forkserver
+    and for modules that were not preloaded when the forkserver started.
+    """
+    for module in modules:
+        __import__(module)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _get_preload_context(preload):
+    """Context forking the workers from a forkserver process which imported
+    the preloaded modules, or None if forkserver is not available."""
+    try:
+        context = get_context('forkserver')
+    except ValueError:
+        return None
+    # Only effective if the forkserver process is not started yet.
+    context.set_forkserver_preload(list(preload))
+    return context
+
+
 def get_memmapping_executor(n_jobs, timeout=300, initializer=None, initargs=(),
-                            **backend_args):
+                            preload=None, **backend_args):
     """Factory for ReusableExecutor with automatic memmapping for large numpy
     arrays.
+
+    If preload is a list of module names, the workers are forked from a
+    forkserver process which imported these modules once, instead of being
+    spawned and importing them again.
     """
     global _backend_args
-    reuse = _backend_args is None or _backend_args == backend_args
-    _backend_args = backend_args
+    preload = tuple(preload or ())
+    # Changing the preloaded modules requires new workers.
+    executor_args = dict(backend_args, preload=preload)
+    reuse = _backend_args is None or _backend_args == executor_args
+    _backend_args = executor_args
+
+    context = None
+    if preload:
+        context = _get_preload_context(preload)
+        initializer, initargs = (_import_and_initialize,
+                                 (preload, initializer, initargs))
 
     id_executor = random.randint(0, int(1e10))
     job_reducers, result_reducers, temp_folder = get_memmapping_reducers(
@@ -33,14 +72,14 @@ def get_memmapping_executor(n_jobs, timeout=300, initializer=None, initargs=(),
                                       result_reducers=result_reducers,
                                       reuse=reuse, timeout=timeout,
                                       initializer=initializer,
-                                      initargs=initargs)
+                                      initargs=initargs, context=context)
     # If executor doesn't have a _temp_folder, it means it is a new executor
     # and the reducers have been used. Else, the previous reducers are used
     # and we should not change this attibute.
     if not hasattr(_executor, "_temp_folder"):
         _executor._temp_folder = temp_folder
     else:
-        delete_folder(temp_folder)
+        delete_temp_folder(temp_folder)
     return _executor
 
 
@@ -60,7 +99,7 @@ class _TestingMemmappingExecutor():
 
     def terminate(self):
         self._executor.shutdown()
-        delete_folder(self._temp_folder)
+        delete_temp_folder(self._temp_folder)
 
     def map(self, f, *args):
         res = self._executor.map(f, *args)
@@ -147,6 +147,28 @@ def _build_func_identifier(func):
     return os.path.join(*parts)
 
 
+def _check_cached_func_code(store_backend, func):
+    """Clear the results of func in the store if its code has changed.
+
+    Return True if the results stored for func are still valid. This is the
+    check of MemorizedFunc, without the collision warnings.
+    """
+    func_id = _build_func_identifier(func)
+    func_code, _, first_line = get_func_code(func)
+    try:
+        old_func_code, _ = extract_first_line(
+            store_backend.get_cached_func_code([func_id]))
+    except (IOError, OSError):
+        old_func_code = None
+    else:
+        if old_func_code == func_code:
+            return True
+        store_backend.clear_path([func_id])
+    store_backend.store_cached_func_code(
+        [func_id], u'%s %i\n%s' % (FIRST_LINE_TEXT, first_line, func_code))
+    return False
+
+
 def _format_load_msg(func_id, args_id, timestamp=None, metadata=None):
     """ Helper function to format the message when loading the results.
     """
@@ -15,23 +15,45 @@ import time
 import inspect
 import threading
 import itertools
-from numbers import Integral
+import types
+import uuid
+import collections
+import heapq
+from numbers import Integral, Number
+from multiprocessing import TimeoutError
 import warnings
+import traceback
 from functools import partial
 
 from ._multiprocessing_helpers import mp
 
 from .format_stack import format_outer_frames
 from .logger import Logger, short_format_time
-from .my_exceptions import TransportableException
+from .my_exceptions import TransportableException, WorkerInterrupt
 from .disk import memstr_to_bytes
+from .memory import Memory, _check_cached_func_code
+from ._profiling import ParallelProfile, ProfileMark
+from ._core_budget import CoreBudget
+from ._clib_threads import limit_threads
+from ._memmapping_reducer import SharedArgument
 from ._parallel_backends import (FallbackToBackend, MultiprocessingBackend,
                                  ThreadingBackend, SequentialBackend,
                                  LokyBackend)
-from ._compat import _basestring
+from ._compat import _basestring, _bytes_or_unicode
 from .externals.cloudpickle import dumps, loads
 from .externals import loky
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    # Python 2 compat
+    from itertools import izip as _zip
+except ImportError:
+    _zip = zip
+
 # Make sure that those two classes are part of the public joblib.parallel API
 # so that 3rd party backend implementers can import them from here.
 from ._parallel_backends import AutoBatchingMixin  # noqa
@@ -70,8 +92,16 @@ def _register_dask():
         raise ImportError(msg)
 
 
+def _register_pool_server():
+    """ Register the backend of joblib.pool_server if called with
+    parallel_backend("pool_server") """
+    from .pool_server import PoolServerBackend
+    register_parallel_backend('pool_server', PoolServerBackend)
+
+
 EXTERNAL_BACKENDS = {
     'dask': _register_dask,
+    'pool_server': _register_pool_server,
 }
 
 
@@ -204,14 +234,215 @@ if hasattr(mp, 'get_context'):
 
 
 class CloudpickledObjectWrapper(object):
-    def __init__(self, obj):
+    def __init__(self, obj, key=None):
         self.pickled_obj = dumps(obj)
+        # Set for the functions whose payload is reused across calls.
+        self.key = key
 
     def __reduce__(self):
         return loads, (self.pickled_obj,)
 
 
+class _FunctionPayload(object):
+    """Cached payload of a function, as sent by one Parallel call.
+
+    The workers unpickle it once per call: the state that the function keeps,
+    for instance in the globals it assigns, does not outlive the call.
+    """
+
+    def __init__(self, wrapper, call_key):
+        self.wrapper = wrapper
+        self.call_key = call_key
+
+    def __reduce__(self):
+        return _load_cached_function, (self.call_key, self.wrapper.key,
+                                       self.wrapper.pickled_obj)
+
+
+class _BoundedCache(object):
+    """Least recently used cache holding at most max_nbytes bytes"""
+
+    def __init__(self, max_nbytes):
+        self.max_nbytes = max_nbytes
+        self._entries = collections.OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self._entries[key] = entry
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        if nbytes > self.max_nbytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._nbytes -= previous[1]
+            self._entries[key] = (value, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_nbytes:
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self._nbytes -= evicted_nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+
+# The payloads of the cloudpickled functions are kept across Parallel calls,
+# so that dispatching the same lambda or interactively defined function again
+# only costs a lookup. The workers keep the functions they unpickled until
+# they receive a function from another call.
+_FUNCTION_PAYLOAD_CACHE_NBYTES = 16 * 1024 ** 2
+_function_payloads = _BoundedCache(_FUNCTION_PAYLOAD_CACHE_NBYTES)
+_unpickled_functions = _BoundedCache(_FUNCTION_PAYLOAD_CACHE_NBYTES)
+_unpickled_functions_call_key = None
+# Key of the pickle cache of a call under which the key of the call is kept
+_CALL_KEY = object()
+
+_IMMUTABLE_TYPES = (type(None), Number, _bytes_or_unicode, type,
+                    types.ModuleType, types.BuiltinFunctionType)
+
+
+def _code_names(code):
+    """Global names used by a code object and the code objects it defines"""
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.extend(_code_names(const))
+    return names
+
+
+def _collect_function_references(func, references, depth=0):
+    """Append to references the objects pickled by value along with func.
+
+    Return False if some of them may be mutated in place, which would not
+    be visible in a cached payload.
+    """
+    if depth > 2:
+        return False
+    values = list(func.__defaults__ or ())
+    values.extend((getattr(func, '__kwdefaults__', None) or {}).values())
+    for cell in func.__closure__ or ():
+        try:
+            values.append(cell.cell_contents)
+        except ValueError:
+            # Empty cell
+            return False
+    func_globals = func.__globals__
+    values.extend(func_globals[name] for name in _code_names(func.__code__)
+                  if name in func_globals)
+    for value in values:
+        references.append(value)
+        if value is func:
+            # Recursive function
+            continue
+        if not _need_pickle_wrapping(value):
+            if isinstance(value, _IMMUTABLE_TYPES + (types.FunctionType,)):
+                continue
+            return False
+        if not (isinstance(value, types.FunctionType) and
+                _collect_function_references(value, references, depth + 1)):
+            return False
+    return True
+
+
+def _get_function_payload(func, pickle_cache):
+    """Cloudpickled payload of func, reused across Parallel calls.
+
+    The payload is only reused for the same function object referencing the
+    same objects through its default arguments, closure and globals. The
+    functions referencing mutable objects are pickled again at each call.
+    """
+    if not isinstance(func, types.FunctionType):
+        return CloudpickledObjectWrapper(func)
+    references = []
+    if not _collect_function_references(func, references):
+        return CloudpickledObjectWrapper(func)
+    cache_key = (id(func),) + tuple(id(obj) for obj in references)
+    wrapper = _function_payloads.get(cache_key)
+    if wrapper is None:
+        wrapper = CloudpickledObjectWrapper(func, key=uuid.uuid4().hex)
+        # Keep references to the function and the objects it references so
+        # that their ids are not reused while the payload is cached.
+        wrapper._references = (func, references)
+        _function_payloads.put(cache_key, wrapper, len(wrapper.pickled_obj))
+    call_key = pickle_cache.get(_CALL_KEY)
+    if call_key is None:
+        call_key = pickle_cache[_CALL_KEY] = uuid.uuid4().hex
+    return _FunctionPayload(wrapper, call_key)
+
+
+def _load_cached_function(call_key, key, pickled_obj):
+    """Unpickle a function in a worker, once per payload and Parallel call"""
+    global _unpickled_functions_call_key
+    if call_key != _unpickled_functions_call_key:
+        # The functions of the previous call are dropped with their state.
+        _unpickled_functions.clear()
+        _unpickled_functions_call_key = call_key
+    func = _unpickled_functions.get(key)
+    if func is None:
+        func = loads(pickled_obj)
+        _unpickled_functions.put(key, func, len(pickled_obj))
+    return func
+
+
+# Types whose instances are never wrapped, checked before anything else.
+_NO_WRAPPING_TYPES = set((type(None), bool, int, float, complex) +
+                         _bytes_or_unicode)
+if sys.version_info[0] == 2:
+    _NO_WRAPPING_TYPES.add(long)  # noqa: F821
+if np is not None:
+    _NO_WRAPPING_TYPES.add(np.ndarray)
+    _NO_WRAPPING_TYPES.add(np.memmap)
+    _NO_WRAPPING_TYPES.update(t for t in np.sctypeDict.values()
+                              if isinstance(t, type))
+
+# Wrapping decisions cached for the types of non-callable objects and for
+# the code objects of functions. The caches are reset when full to bound
+# the number of types and code objects that they keep alive.
+_MAX_CACHED_DECISIONS = 1024
+_type_decisions = dict()
+_function_decisions = dict()
+
+
+def _cache_decision(cache, key, value):
+    if len(cache) >= _MAX_CACHED_DECISIONS:
+        cache.clear()
+    cache[key] = value
+
+
 def _need_pickle_wrapping(obj):
+    obj_type = type(obj)
+    if obj_type in _NO_WRAPPING_TYPES:
+        return False
+    if isinstance(obj, types.FunctionType):
+        # Functions created from the same code object get the same decision,
+        # unless their module was changed.
+        code, module = obj.__code__, obj.__module__
+        decision = _function_decisions.get(id(code))
+        if (decision is None or decision[0] is not code or
+                decision[1] != module):
+            decision = (code, module, _compute_pickle_wrapping(obj))
+            _cache_decision(_function_decisions, id(code), decision)
+        return decision[2]
+    need_wrap = _type_decisions.get(obj_type)
+    if need_wrap is not None:
+        return need_wrap
+    need_wrap = _compute_pickle_wrapping(obj)
+    if not (isinstance(obj, (list, dict, partial)) or callable(obj)):
+        # The decision only depends on the module of the type.
+        _cache_decision(_type_decisions, obj_type, need_wrap)
+    return need_wrap
+
+
+def _compute_pickle_wrapping(obj):
     if isinstance(obj, list) and len(obj) >= 1:
         # Make the assumption that the content of the list is homogeneously
         # typed.
@@ -246,25 +477,209 @@ def _need_pickle_wrapping(obj):
     return need_wrap
 
 
+def _unwrap_shared_arguments(func, args, kwargs):
+    """Replace the SharedArgument instances of a task by the wrapped objects.
+
+    Shared arguments are unwrapped when unpickled in worker processes, this
+    is only needed for tasks that were not sent through a pickle stream.
+    """
+    args = [a.obj if isinstance(a, SharedArgument) else a for a in args]
+    kwargs = dict((k, v.obj if isinstance(v, SharedArgument) else v)
+                  for k, v in kwargs.items())
+    return func, args, kwargs
+
+
+def _get_worker_id():
+    """Identifier of the process and thread executing the current batch"""
+    return '%d-%s' % (os.getpid(), threading.current_thread().name)
+
+
+class TaskFailure(object):
+    """Placeholder for the result of a task that raised an exception.
+
+    Returned in place of the results of the failed tasks by
+    ``Parallel(on_error='collect')``. ``exception`` is the exception raised
+    by the task, ``traceback`` its formatted traceback and ``index`` the
+    position of the task in the iterable.
+    """
+    def __init__(self, exception, traceback=None, index=None):
+        self.exception = exception
+        self.traceback = traceback
+        self.index = index
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.exception)
+
+
+def _call_collecting_failure(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception as exception:
+        return TaskFailure(exception, traceback.format_exc())
+
+
+class _FailedBatch(object):
+    """Stand-in for the async result of a batch that could not be submitted"""
+    def __init__(self, exception):
+        self.exception = exception
+
+    def get(self, timeout=None):
+        raise self.exception
+
+
+class BatchReport(object):
+    """Results of a batch along with information on its execution.
+
+    Instances are returned by BatchedCalls when ``report=True`` so that the
+    parent process can tell which worker ran the batch and when.
+
+    When profiling, ``task_marks`` holds the ProfileMark pair received with
+    the batch and ``result_marks`` the pair timing the transfer of the
+    results back to the parent process.
+    """
+    def __init__(self, results, worker_id, start_time, end_time,
+                 task_marks=None, result_marks=None):
+        self.results = results
+        self.worker_id = worker_id
+        self.start_time = start_time
+        self.end_time = end_time
+        self.task_marks = task_marks
+        self.result_marks = result_marks
+
+    @property
+    def duration(self):
+        return self.end_time - self.start_time
+
+    def __reduce__(self):
+        args = (self.results, self.worker_id, self.start_time, self.end_time,
+                self.task_marks)
+        if self.result_marks is None:
+            return BatchReport, args
+        # Surround the results with the marks so that their unpickling times
+        # bracket the deserialization of the results in the parent process.
+        start, end = self.result_marks
+        start.stamp()
+        return _rebuild_batch_report, (start,) + args + (end,)
+
+
+def _rebuild_batch_report(start_mark, results, worker_id, start_time,
+                          end_time, task_marks, end_mark):
+    return BatchReport(results, worker_id, start_time, end_time,
+                       task_marks=task_marks,
+                       result_marks=(start_mark, end_mark))
+
+
+def _estimate_nbytes(obj, depth=2):
+    """Cheap estimate of the memory held by obj, used by max_inflight_bytes
+
+    The size of numpy arrays and byte strings is exact. The items of lists,
+    tuples and dicts are inspected up to the given depth.
+    """
+    if np is not None and isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (bytes, bytearray, _basestring)):
+        return len(obj)
+    nbytes = sys.getsizeof(obj, 0)
+    if depth > 0:
+        if isinstance(obj, (list, tuple)):
+            nbytes += sum(_estimate_nbytes(item, depth - 1) for item in obj)
+        elif isinstance(obj, dict):
+            nbytes += sum(_estimate_nbytes(item, depth - 1)
+                          for item in obj.values())
+    return nbytes
+
+
+def _unpack_batch_output(output):
+    """Return the list of results and the optional BatchReport of a batch"""
+    if isinstance(output, BatchReport):
+        return output.results, output
+    return output, None
+
+
 class BatchedCalls(object):
     """Wrap a sequence of (func, args, kwargs) tuples as a single callable"""
 
-    def __init__(self, iterator_slice, backend, pickle_cache=None):
+    def __init__(self, iterator_slice, backend, pickle_cache=None,
+                 report=False, profile=False, collect_errors=False,
+                 inner_max_num_threads=None):
         self.items = list(iterator_slice)
         self._size = len(self.items)
         self._backend = backend
         self._pickle_cache = pickle_cache if pickle_cache is not None else {}
+        self._report = report or profile
+        self._collect_errors = collect_errors
+        self._inner_max_num_threads = inner_max_num_threads
+        if profile:
+            self._task_marks = (ProfileMark(), ProfileMark())
+        else:
+            self._task_marks = None
 
     def __call__(self):
-        with parallel_backend(self._backend):
-            return [func(*args, **kwargs)
-                    for func, args, kwargs in self.items]
+        start_time = time.time()
+        items = self.items
+        if SharedArgument.in_use:
+            items = [_unwrap_shared_arguments(*item) for item in items]
+        with parallel_backend(self._backend), self._limit_threads():
+            if self._collect_errors:
+                results = [_call_collecting_failure(func, args, kwargs)
+                           for func, args, kwargs in items]
+            else:
+                results = [func(*args, **kwargs)
+                           for func, args, kwargs in items]
+        return self._make_output(results, start_time)
+
+    def _limit_threads(self):
+        """Limit the thread pools of the C-libraries while running the batch"""
+        n_threads = self._inner_max_num_threads
+        if n_threads == 'auto':
+            # Share of the cores of the task, computed when it starts.
+            n_threads = self._backend.available_cores()
+        return limit_threads(n_threads)
+
+    def _make_output(self, results, start_time):
+        """Attach a BatchReport to the results if requested"""
+        if not self._report:
+            return results
+        task_marks = result_marks = None
+        if self._task_marks is not None:
+            result_marks = (ProfileMark(), ProfileMark())
+            if self._task_marks[0].received is not None:
+                # The batch was sent to this worker through a pickle stream.
+                task_marks = self._task_marks
+        return BatchReport(results, _get_worker_id(), start_time, time.time(),
+                           task_marks=task_marks, result_marks=result_marks)
 
     def __len__(self):
         return self._size
 
+    @staticmethod
+    def _get_canonical_shared_argument(shared_arg, pickle_cache):
+        """Use a single wrapper per object shared by the tasks of a call.
+
+        The reducer dumps each SharedArgument instance once: this makes sure
+        that an object wrapped again for each task is dumped only once.
+        """
+        key = (SharedArgument, id(shared_arg.obj))
+        try:
+            # Keep a reference to the wrapped object to make sure its id is
+            # not reused during the call.
+            _, canonical_arg = pickle_cache[key]
+        except KeyError:
+            obj = shared_arg.obj
+            if _need_pickle_wrapping(obj):
+                canonical_arg = SharedArgument(CloudpickledObjectWrapper(obj))
+            else:
+                canonical_arg = shared_arg
+            pickle_cache[key] = obj, canonical_arg
+        return canonical_arg
+
     @staticmethod
     def _wrap_non_picklable_objects(obj, pickle_cache):
+        if type(obj) in _NO_WRAPPING_TYPES:
+            return obj
+        if isinstance(obj, SharedArgument):
+            return BatchedCalls._get_canonical_shared_argument(obj,
+                                                               pickle_cache)
         if not _need_pickle_wrapping(obj):
             return obj
         try:
@@ -275,12 +690,15 @@ class BatchedCalls(object):
             wrapped_obj = None
             hashable = False
         if wrapped_obj is None:
-            wrapped_obj = CloudpickledObjectWrapper(obj)
+            wrapped_obj = _get_function_payload(obj, pickle_cache)
             if hashable:
                 pickle_cache[obj] = wrapped_obj
         return wrapped_obj
 
     def __getstate__(self):
+        start_mark, end_mark = self._task_marks or (None, None)
+        if start_mark is not None:
+            start_mark.stamp()
         items = [(self._wrap_non_picklable_objects(func, self._pickle_cache),
                   [self._wrap_non_picklable_objects(a, self._pickle_cache)
                    for a in args],
@@ -288,10 +706,138 @@ class BatchedCalls(object):
                    for k, a in kwargs.items()}
                   )
                  for func, args, kwargs in self.items]
-        return (items, self._size, self._backend)
+        # The marks surround the items so that their unpickling times bracket
+        # the deserialization of the batch in the worker.
+        return (start_mark, items, self._size, self._backend, self._report,
+                self._collect_errors, self._inner_max_num_threads, end_mark)
 
     def __setstate__(self, state):
-        self.items, self._size, self._backend = state
+        (start_mark, self.items, self._size, self._backend, self._report,
+         self._collect_errors, self._inner_max_num_threads, end_mark) = state
+        if start_mark is not None:
+            self._task_marks = (start_mark, end_mark)
+        else:
+            self._task_marks = None
+
+
+class MappedCalls(BatchedCalls):
+    """Batch of calls to the same function, as scheduled by Parallel.map
+
+    The function is pickled once for the whole batch and the arguments are
+    stored as one column per positional argument instead of one
+    (function, args, kwargs) tuple per task.
+
+    With ``vectorize='list'`` the function is called once for the whole
+    batch with the columns of arguments as lists, and with
+    ``vectorize='stack'`` with the columns stacked as numpy arrays. It must
+    return a sequence with one result per task of the batch.
+    """
+
+    def __init__(self, func, iterator_slice, backend, pickle_cache=None,
+                 report=False, profile=False, collect_errors=False,
+                 inner_max_num_threads=None, vectorize=None):
+        super(MappedCalls, self).__init__(
+            (), backend, pickle_cache=pickle_cache, report=report,
+            profile=profile, collect_errors=collect_errors,
+            inner_max_num_threads=inner_max_num_threads)
+        self._func = func
+        self._vectorize = vectorize
+        self._set_columns(list(iterator_slice))
+        if vectorize is not None and self._columns is None and self._size:
+            raise ValueError("All the tasks of a vectorized batch must have "
+                             "the same non-zero number of arguments.")
+
+    def _set_columns(self, args_list):
+        self._size = len(args_list)
+        arities = set(len(args) for args in args_list)
+        if len(arities) == 1 and 0 not in arities:
+            self._columns = [list(column) for column in _zip(*args_list)]
+            self._rows = None
+        else:
+            # Calls with no argument or with different numbers of arguments
+            # cannot be stored as columns.
+            self._columns = None
+            self._rows = args_list
+
+    def _iter_args(self):
+        if self._columns is None:
+            return iter(self._rows)
+        return _zip(*self._columns)
+
+    @property
+    def items(self):
+        return [(self._func, args, {}) for args in self._iter_args()]
+
+    @items.setter
+    def items(self, items):
+        self._set_columns([args for _, args, _ in items])
+
+    def __call__(self):
+        start_time = time.time()
+        func = self._func
+        args_iterator = self._iter_args()
+        if SharedArgument.in_use:
+            args_iterator = (_unwrap_shared_arguments(func, args, {})[1]
+                             for args in args_iterator)
+        with parallel_backend(self._backend), self._limit_threads():
+            if self._vectorize is None and self._collect_errors:
+                results = [_call_collecting_failure(func, args, {})
+                           for args in args_iterator]
+            elif self._vectorize is None:
+                results = [func(*args) for args in args_iterator]
+            else:
+                results = self._call_vectorized()
+        return self._make_output(results, start_time)
+
+    def _call_vectorized(self):
+        if not self._size:
+            return []
+        columns = self._columns
+        if SharedArgument.in_use:
+            columns = [[a.obj if isinstance(a, SharedArgument) else a
+                        for a in column] for column in columns]
+        if self._vectorize == 'stack':
+            columns = [np.asarray(column) for column in columns]
+        results = self._func(*columns)
+        if len(results) != self._size:
+            raise ValueError(
+                "Vectorized function %r returned %d results for a batch of "
+                "%d tasks." % (self._func, len(results), self._size))
+        return list(results)
+
+    def _wrap_column(self, column):
+        # Assume the columns are homogeneously typed, as _need_pickle_wrapping
+        # does for lists, to only inspect their first element.
+        first = column[0]
+        if not (isinstance(first, SharedArgument) or
+                _need_pickle_wrapping(first)):
+            return column
+        return [self._wrap_non_picklable_objects(a, self._pickle_cache)
+                for a in column]
+
+    def __getstate__(self):
+        start_mark, end_mark = self._task_marks or (None, None)
+        if start_mark is not None:
+            start_mark.stamp()
+        func = self._wrap_non_picklable_objects(self._func, self._pickle_cache)
+        columns, rows = self._columns, self._rows
+        if columns is not None:
+            columns = [self._wrap_column(column) for column in columns]
+        else:
+            rows = [[self._wrap_non_picklable_objects(a, self._pickle_cache)
+                     for a in args] for args in rows]
+        return (start_mark, func, columns, rows, self._size, self._backend,
+                self._report, self._collect_errors,
+                self._inner_max_num_threads, self._vectorize, end_mark)
+
+    def __setstate__(self, state):
+        (start_mark, self._func, self._columns, self._rows, self._size,
+         self._backend, self._report, self._collect_errors,
+         self._inner_max_num_threads, self._vectorize, end_mark) = state
+        if start_mark is not None:
+            self._task_marks = (start_mark, end_mark)
+        else:
+            self._task_marks = None
 
 
 ###############################################################################
@@ -327,8 +873,25 @@ def _verbosity_filter(index, verbose):
 
 
 ###############################################################################
-def delayed(function, check_pickle=None):
-    """Decorator used to capture the arguments of a function."""
+class _PrioritizedTask(tuple):
+    """(function, args, kwargs) tuple carrying the priority given to delayed"""
+    def __new__(cls, task, priority):
+        self = tuple.__new__(cls, task)
+        self.priority = priority
+        return self
+
+    def __reduce__(self):
+        # The priority is only used by the parent process.
+        return tuple, (tuple(self),)
+
+
+def delayed(function, check_pickle=None, priority=None):
+    """Decorator used to capture the arguments of a function.
+
+    ``priority`` is an optional scheduling hint, for instance the expected
+    cost of the task: when Parallel is given a ``lookahead`` window, the
+    tasks of highest priority in the window are dispatched first.
+    """
     if check_pickle is not None:
         warnings.warn('check_pickle is deprecated in joblib 0.12 and will be'
                       ' removed in 0.13', DeprecationWarning)
@@ -338,7 +901,9 @@ def delayed(function, check_pickle=None):
         dumps(function)
 
     def delayed_function(*args, **kwargs):
-        return function, args, kwargs
+        if priority is None:
+            return function, args, kwargs
+        return _PrioritizedTask((function, args, kwargs), priority)
     try:
         delayed_function = functools.wraps(function)(delayed_function)
     except AttributeError:
@@ -346,6 +911,37 @@ def delayed(function, check_pickle=None):
     return delayed_function
 
 
+def shared(obj):
+    """Mark an argument passed to many tasks to be sent once per worker.
+
+    By default, the arguments of the tasks are pickled again in each batch
+    sent to the workers. Arguments wrapped with ``shared`` are instead dumped
+    once per Parallel call to the temporary folder used for memmapping and
+    loaded at most once by each worker process, which then reuses the same
+    object for all the tasks it runs. The numpy arrays of the object are
+    memory mapped according to the ``mmap_mode`` of Parallel.
+
+    The task functions receive the object itself, not the wrapper. They should
+    not mutate it as the modifications would be visible to the next tasks run
+    by the same worker. Wrapping has no effect with thread-based backends.
+
+    >>> from joblib import Parallel, delayed, shared
+    >>> weights = shared(dict(a=1, b=2))
+    >>> Parallel(n_jobs=2)(delayed(sorted)(weights) for _ in range(3))
+    [['a', 'b'], ['a', 'b'], ['a', 'b']]
+
+    """
+    if isinstance(obj, SharedArgument):
+        return obj
+    return SharedArgument(obj)
+
+
+# Arguments that are never shared automatically: scalars are cheap to pickle
+# and numpy arrays are already handled by the memmapping reducers.
+_NOT_SHAREABLE_TYPES = (Integral, float, complex, _basestring, bytes,
+                        type(None), SharedArgument)
+
+
 ###############################################################################
 class BatchCompletionCallBack(object):
     """Callback used by joblib.Parallel's multiprocessing backend.
@@ -358,21 +954,285 @@ class BatchCompletionCallBack(object):
     processed.
 
     """
-    def __init__(self, dispatch_timestamp, batch_size, parallel):
+    def __init__(self, dispatch_timestamp, batch_size, parallel,
+                 batch_index=None, task_marks=None):
         self.dispatch_timestamp = dispatch_timestamp
         self.batch_size = batch_size
         self.parallel = parallel
+        self.batch_index = batch_index
+        self.task_marks = task_marks
+        # Set by Parallel._dispatch once the batch has been submitted.
+        self.dispatch_end = None
+        self._completed = False
 
     def __call__(self, out):
+        parallel = self.parallel
+        if (parallel.retries and parallel._async_call is None and
+                self._failed(out)):
+            # The batch is resubmitted by Parallel.retrieve, which completes
+            # it once the last attempt is over.
+            return
+        self.complete(out)
+
+    def complete(self, out):
+        """Account for the output of the first attempt that is over.
+
+        The attempts at running a batch that are over later, e.g. the
+        speculative copies of a batch, are ignored.
+        """
+        with self.parallel._lock:
+            if self._completed:
+                return
+            self._completed = True
         self.parallel.n_completed_tasks += self.batch_size
-        this_batch_duration = time.time() - self.dispatch_timestamp
+        self.parallel.n_completed_batches += 1
+        self.parallel._core_budget.task_completed()
+        completion_time = time.time()
+        this_batch_duration = completion_time - self.dispatch_timestamp
 
         self.parallel._backend.batch_completed(self.batch_size,
                                                this_batch_duration)
+        if self.parallel.speculative:
+            self.parallel._batch_durations.append(this_batch_duration)
         self.parallel.print_progress()
+        report = None
+        if self.parallel.callback is not None or self.task_marks is not None:
+            report = self._get_report(out)
+        if self.parallel.max_inflight_bytes is not None:
+            output = self._get_output(out)
+            if output is not None:
+                # The arguments are released, the results are now held.
+                self.parallel._complete_inflight_batch(self.batch_index, sum(
+                    _estimate_nbytes(result)
+                    for result in _unpack_batch_output(output)[0]))
+        if self.parallel.checkpoint is not None:
+            output = self._get_output(out)
+            indices = self.parallel._batch_task_indices.get(self.batch_index)
+            if output is not None and indices is not None:
+                self.parallel._save_checkpoint(
+                    indices, _unpack_batch_output(output)[0])
+        profile = self.parallel.last_profile
+        if self.task_marks is not None and profile is not None:
+            dispatch_end = self.dispatch_end
+            if dispatch_end is None:
+                # The batch completed before apply_async returned, e.g. with
+                # the sequential backend.
+                dispatch_end = getattr(report, 'start_time', completion_time)
+            profile.add_batch(self.batch_index, self.batch_size,
+                              self.dispatch_timestamp, dispatch_end,
+                              completion_time, task_marks=self.task_marks,
+                              report=report)
+        if self.parallel.callback is not None:
+            self.parallel._notify(
+                'batch_completed', batch_index=self.batch_index,
+                batch_size=self.batch_size, duration=this_batch_duration,
+                worker_id=getattr(report, 'worker_id', None),
+                compute_duration=getattr(report, 'duration', None))
         with self.parallel._lock:
-            if self.parallel._original_iterator is not None:
+            # The failures are handled by Parallel.retrieve, which dispatches
+            # the next batch itself.
+            if (self.parallel._original_iterator is not None and
+                    not (self.parallel._handles_failures() and
+                         self._failed(out))):
                 self.parallel.dispatch_next()
+        # The job of this batch is registered in parallel._jobs once the lock
+        # has been acquired above.
+        async_call = self.parallel._async_call
+        if async_call is not None:
+            async_call.batch_completed(self.batch_index)
+
+    @staticmethod
+    def _get_report(out):
+        """Extract the BatchReport from the object passed to the callback.
+
+        Depending on the backend, ``out`` is either the output of the batch
+        itself or an async result / future object wrapping it.
+        """
+        out = BatchCompletionCallBack._get_output(out)
+        return out if isinstance(out, BatchReport) else None
+
+    @staticmethod
+    def _failed(out):
+        """Whether the object passed to the callback reports a failure"""
+        if isinstance(out, BaseException):
+            # Error callback of the multiprocessing pools
+            return True
+        if hasattr(out, 'exception') and hasattr(out, 'done'):
+            # concurrent.futures style future
+            try:
+                return out.exception(timeout=0) is not None
+            except BaseException:
+                return True
+        return False
+
+    @staticmethod
+    def _get_output(out):
+        """Extract the output of the batch from the object passed to the
+        callback, or return None if it is not available.
+        """
+        if isinstance(out, (list, BatchReport)):
+            return out
+        try:
+            return out.get()
+        except BaseException:
+            # The batch failed or out is not an async result.
+            return None
+
+
+class _AsyncParallelCall(object):
+    """State of a Parallel call whose results are retrieved by an event loop.
+
+    The completion callbacks of the batches, executed in the threads of the
+    backend, schedule the retrieval of the results in the event loop with
+    ``call_soon_threadsafe``. The results are then made available in order,
+    either all at once with ``gather`` or one by one through the
+    asynchronous iterator protocol.
+    """
+    def __init__(self, parallel, iterable):
+        import asyncio
+        self.parallel = parallel
+        self.loop = asyncio.get_event_loop()
+        self._results = collections.deque()
+        self._completed = set()
+        # (number of results not consumed yet, batch index) of the batches
+        # whose size is accounted for in max_inflight_bytes
+        self._unconsumed_batches = collections.deque()
+        self._exception = None
+        self._done = False
+        self._waiter = None
+        self._gather_future = None
+
+        iterator = parallel._start_call(iterable)
+        parallel._async_call = self
+        try:
+            parallel._dispatch_first_batches(iterator)
+        except BaseException:
+            self._finish()
+            raise
+        self._collect()
+
+    def batch_completed(self, batch_index):
+        """Notify the event loop that a batch completed, from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self._on_batch_completed,
+                                           batch_index)
+        except RuntimeError:
+            # The event loop was closed: nobody waits for the results anymore.
+            pass
+
+    def _on_batch_completed(self, batch_index):
+        self._completed.add(batch_index)
+        self._collect()
+
+    def _collect(self):
+        parallel = self.parallel
+        if self._done:
+            return
+        try:
+            while parallel._n_retrieved_batches in self._completed:
+                with parallel._lock:
+                    job = parallel._jobs.pop(0)
+                    batch_index = parallel._n_retrieved_batches
+                    parallel._n_retrieved_batches += 1
+                # Failed batches are not resubmitted by asynchronous calls.
+                parallel._resubmittable_batches.pop(batch_index, None)
+                self._completed.remove(batch_index)
+                # The batch is completed: get does not block.
+                results = parallel._in_order(
+                    batch_index, parallel._get_batch_results(job, batch_index))
+                self._results.extend(results)
+                if parallel.max_inflight_bytes is not None:
+                    if self._gather_future is None and results:
+                        self._unconsumed_batches.append(
+                            (len(results), batch_index))
+                    else:
+                        parallel._release_inflight_nbytes(batch_index)
+        except BaseException as exception:
+            parallel._abort()
+            self._exception = exception
+            self._finish()
+        else:
+            if not parallel._iterating and not parallel._jobs:
+                self._results.extend(parallel._ready_results())
+                self._finish()
+        self._wake_up()
+
+    def _finish(self):
+        self._done = True
+        self.parallel._async_call = None
+        self.parallel._stop_call()
+
+    def cancel(self):
+        """Abort the remaining tasks of the call"""
+        if not self._done:
+            self.parallel._abort()
+            self._finish()
+
+    def _wake_up(self):
+        future = self._gather_future
+        if future is not None and self._done and not future.done():
+            if self._exception is not None:
+                future.set_exception(self._exception)
+            else:
+                results = list(self._results)
+                if self.parallel.on_error == 'collect':
+                    self.parallel._record_failures(results)
+                future.set_result(results)
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            if self._set_next(waiter):
+                self._waiter = None
+
+    def _result_consumed(self):
+        # Release the budget of a batch once all its results were consumed.
+        if not self._unconsumed_batches:
+            return
+        n_left, batch_index = self._unconsumed_batches.popleft()
+        if n_left > 1:
+            self._unconsumed_batches.appendleft((n_left - 1, batch_index))
+        elif not self._done:
+            self.parallel._release_inflight_nbytes(batch_index)
+            # Resuming the dispatch may reveal that the iterable is exhausted
+            # once all the batches were already collected.
+            self._collect()
+
+    def _set_next(self, future):
+        if self._results:
+            future.set_result(self._results.popleft())
+            self._result_consumed()
+        elif self._exception is not None:
+            exception, self._exception = self._exception, None
+            future.set_exception(exception)
+        elif self._done:
+            future.set_exception(StopAsyncIteration())
+        else:
+            return False
+        return True
+
+    def gather(self):
+        future = self._gather_future = self.loop.create_future()
+        future.add_done_callback(self._on_gather_done)
+        self._wake_up()
+        return future
+
+    def _on_gather_done(self, future):
+        if future.cancelled():
+            self.cancel()
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = self.loop.create_future()
+        if not self._set_next(future):
+            self._waiter = future
+        return future
+
+    def aclose(self):
+        self.cancel()
+        future = self.loop.create_future()
+        future.set_result(None)
+        return future
 
 
 ###############################################################################
@@ -529,6 +1389,126 @@ class Parallel(Logger):
         mmap_mode: {None, 'r+', 'r', 'w+', 'c'}
             Memmapping mode for numpy arrays passed to workers.
             See 'max_nbytes' parameter documentation for more details.
+        results_max_nbytes: int, str, or None, optional, None by default
+            Threshold on the size of the arrays returned by the tasks above
+            which the workers write them to temp_folder and the results are
+            memory mapped in a writable mode instead of being sent through
+            pipes and copied. Can be an int in Bytes, or a human-readable
+            string, e.g., '100M'. The files are deleted once the results are
+            garbage collected. Use None to always copy the results.
+            Only active when backend="loky" or "multiprocessing", and not
+            supported under Windows.
+        reuse_memmaps: bool, optional, False by default
+            If True, the memmap files of the large arrays are kept after the
+            call and reused by the next calls passing the same arrays, for
+            instance the training data of a cross-validation loop, instead of
+            being dumped again. Before being reused, a file is checked
+            against a hash of sampled blocks of its array, so that arrays
+            modified in place are dumped again: changes of a few isolated
+            items can go unnoticed. The files are deleted once the arrays are
+            garbage collected.
+            Only active when backend="loky" or "multiprocessing".
+        callback: callable, optional
+            Function called with a single dict argument describing each
+            scheduling event, for instance to export throughput and ETA
+            metrics. The ``'event'`` key is either ``'batch_dispatched'`` or
+            ``'batch_completed'``. All events also report ``batch_index``,
+            ``batch_size``, ``n_dispatched_tasks``, ``n_completed_tasks``,
+            ``n_total_tasks`` (None until the input iterable is exhausted),
+            ``queue_depth`` (number of dispatched batches that are not
+            completed yet) and ``elapsed`` (seconds since the start of the
+            call). Completion events additionally report the ``duration``
+            of the batch as seen by the parent process and, when the backend
+            runs the batches in its own workers, the ``worker_id`` and the
+            ``compute_duration`` measured in the worker.
+            Completion events are usually emitted from a backend thread: the
+            callback should be fast and thread-safe.
+        profile: bool, default: False
+            If True, record the time spent by each batch in the successive
+            phases of its execution: dispatch, queueing, pickling and
+            memmapping in the parent process, transfer, unpickling, compute
+            and result pickling in the worker, and transfer and unpickling of
+            the results back in the parent process. After each call, the
+            timings are available as a ``ParallelProfile`` instance in the
+            ``last_profile`` attribute: its ``summary()`` method returns the
+            totals, percentiles and overhead ratio of the call and its
+            ``to_chrome_trace()`` method exports a trace-event timeline.
+        auto_share: bool, default: False
+            If True, arguments that are passed again to the tasks of a batch
+            after having been passed to the previous batch (same object, for
+            instance a large model used by all the tasks) are automatically
+            wrapped with ``joblib.shared`` so that they are sent only once to
+            each worker. Scalars, strings, callables and numpy arrays are
+            never wrapped. See ``joblib.shared`` for the consequences.
+        max_inflight_bytes: int, str, or None, optional
+            Memory budget for the arguments of the dispatched tasks and the
+            results that were not retrieved yet. Can be an int in Bytes, or a
+            human-readable string, e.g., '1G'. When the estimated size of the
+            tasks in flight exceeds this budget, no new batch is dispatched
+            until results are retrieved. The results of the running tasks
+            are expected to be as large as the ones already received. The
+            sizes are estimated cheaply: exactly for numpy arrays and bytes,
+            shallowly for containers.
+            Only active when pre_dispatch is not 'all' and n_jobs > 1.
+        lookahead: int or None, default: None
+            Number of tasks read ahead from the iterable among which the tasks
+            to dispatch next are chosen by decreasing priority, as given with
+            ``delayed(func, priority=...)``. For instance, using the expected
+            cost of the tasks as priority dispatches the longest tasks first,
+            which reduces the total duration of the call. Tasks without
+            priority have priority 0 and tasks of equal priority are
+            dispatched in order. The results are returned in the order of the
+            iterable. If None, the tasks are dispatched in the order of the
+            iterable. Not used by ``Parallel.map`` and its variants.
+        task_timeout: float or None, default: None
+            Time limit in seconds for each task, measured from the dispatch of
+            its batch: a batch of n tasks that is not completed after
+            n * task_timeout seconds fails with a TimeoutError, or is
+            resubmitted if ``retries`` allows it. The late batch cannot be
+            interrupted but its result is used if it completes first.
+        retries: int, default: 0
+            Number of times a failed batch of tasks, for instance because its
+            worker crashed or because of ``task_timeout``, is resubmitted
+            before the error is raised. The tasks must therefore be
+            idempotent. If the workers of the backend are broken, they are
+            restarted first, which also resubmits the other running batches.
+            Not applied when n_jobs=1 or by ``Parallel.acall``.
+        retry_backoff: float, default: 0.1
+            Delay in seconds before the first resubmission of a failed batch,
+            doubled for each following resubmission of the same batch.
+        on_error: {'raise', 'collect'}, default: 'raise'
+            With 'raise', the first exception raised by a task aborts the
+            remaining tasks and is raised again. With 'collect', the call runs
+            until all the tasks are completed and the results of the failed
+            tasks are replaced by ``TaskFailure`` instances holding the
+            exception and its traceback. They are also listed, with their
+            ``index`` in the iterable, in the ``last_failures`` attribute
+            after the call.
+        speculative: bool, default: False
+            If True, once all the tasks are dispatched, a batch that runs for
+            more than twice the median batch duration while some workers are
+            idle is submitted again and the first result is used.
+        checkpoint: joblib.Memory, str or None, default: None
+            Store in which the result of each completed task is saved, under
+            the same key as ``checkpoint.cache(func)(*args, **kwargs)`` would
+            use. If a str is given, it is used as the location of a Memory.
+            The tasks whose result is already in the store are not
+            dispatched and their result is loaded instead: an interrupted or
+            partially failed call can be resumed by running it again. As
+            with Memory, the results are invalidated when the code of the
+            function changes. Failures collected with ``on_error='collect'``
+            are not saved.
+        inner_max_num_threads: int, 'auto' or None, default: None
+            Maximum size of the thread pools of the OpenBLAS, MKL and OpenMP
+            libraries loaded in the workers. It is set with the API of these
+            libraries before each batch of tasks and restored after it, which
+            also works in reused workers where the libraries are already
+            loaded. With 'auto', the share of the CPU cores of each running
+            task is used: it grows as the tasks of the call complete. If
+            None, the thread pools are only limited when the workers start,
+            with environment variables. Not used by thread-based backends, as
+            the thread pools of these libraries are shared by all the threads
+            of a process.
 
         Notes
         -----
@@ -650,7 +1630,12 @@ class Parallel(Logger):
     def __init__(self, n_jobs=None, backend=None, verbose=0, timeout=None,
                  pre_dispatch='2 * n_jobs', batch_size='auto',
                  temp_folder=None, max_nbytes='1M', mmap_mode='r',
-                 prefer=None, require=None):
+                 prefer=None, require=None, callback=None, profile=False,
+                 auto_share=False, max_inflight_bytes=None, lookahead=None,
+                 task_timeout=None, retries=0, retry_backoff=0.1,
+                 speculative=False, on_error='raise', checkpoint=None,
+                 inner_max_num_threads=None, results_max_nbytes=None,
+                 reuse_memmaps=False):
         active_backend, context_n_jobs = get_active_backend(
             prefer=prefer, require=require, verbose=verbose)
         if backend is None and n_jobs is None:
@@ -665,14 +1650,63 @@ class Parallel(Logger):
         self.verbose = verbose
         self.timeout = timeout
         self.pre_dispatch = pre_dispatch
+        if callback is not None and not callable(callback):
+            raise ValueError("callback must be callable, got: %r" % callback)
+        self.callback = callback
+        self.profile = profile
+        self.last_profile = None
+        self.auto_share = auto_share
+        if isinstance(max_inflight_bytes, _basestring):
+            max_inflight_bytes = memstr_to_bytes(max_inflight_bytes)
+        self.max_inflight_bytes = max_inflight_bytes
+        if lookahead is not None and (not isinstance(lookahead, Integral) or
+                                      lookahead < 1):
+            raise ValueError("lookahead must be a positive integer or None, "
+                             "got: %r" % lookahead)
+        self.lookahead = lookahead
+        if not isinstance(retries, Integral) or retries < 0:
+            raise ValueError("retries must be a non-negative integer, got: "
+                             "%r" % retries)
+        self.task_timeout = task_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.speculative = speculative
+        if on_error not in ('raise', 'collect'):
+            raise ValueError("on_error must be 'raise' or 'collect', got: %r"
+                             % (on_error,))
+        self.on_error = on_error
+        self.last_failures = None
+        if isinstance(checkpoint, _basestring):
+            checkpoint = Memory(checkpoint, verbose=0)
+        if checkpoint is not None and getattr(checkpoint, 'store_backend',
+                                              None) is None:
+            raise ValueError("checkpoint must be a Memory with a location or "
+                             "a path, got: %r" % (checkpoint,))
+        self.checkpoint = checkpoint
+        if inner_max_num_threads not in (None, 'auto') and (
+                not isinstance(inner_max_num_threads, Integral) or
+                inner_max_num_threads < 1):
+            raise ValueError("inner_max_num_threads must be a positive "
+                             "integer, 'auto' or None, got: %r"
+                             % (inner_max_num_threads,))
+        self.inner_max_num_threads = inner_max_num_threads
+        # Function applied to the items of the iterable by map and starmap
+        self._map_func = None
+        self._map_vectorize = None
+        # Set while the results are retrieved by an asyncio event loop
+        self._async_call = None
 
         if isinstance(max_nbytes, _basestring):
             max_nbytes = memstr_to_bytes(max_nbytes)
+        if isinstance(results_max_nbytes, _basestring):
+            results_max_nbytes = memstr_to_bytes(results_max_nbytes)
 
         self._backend_args = dict(
             max_nbytes=max_nbytes,
             mmap_mode=mmap_mode,
             temp_folder=temp_folder,
+            results_max_nbytes=results_max_nbytes,
+            reuse_memmaps=reuse_memmaps,
             prefer=prefer,
             require=require,
             verbose=max(0, self.verbose - 50),
@@ -737,16 +1771,21 @@ class Parallel(Logger):
         try:
             n_jobs = self._backend.configure(n_jobs=self.n_jobs, parallel=self,
                                              **self._backend_args)
-            if self.timeout is not None and not self._backend.supports_timeout:
-                warnings.warn(
-                    'The backend class {!r} does not support timeout. '
-                    "You have set 'timeout={}' in Parallel but "
-                    "the 'timeout' parameter will not be used.".format(
-                        self._backend.__class__.__name__,
-                        self.timeout))
+            if not self._backend.supports_timeout:
+                for name in ('timeout', 'task_timeout', 'speculative'):
+                    value = getattr(self, name)
+                    if value is None or value is False:
+                        continue
+                    warnings.warn(
+                        'The backend class {!r} does not support timeout. '
+                        "You have set '{}={}' in Parallel but "
+                        "the '{}' parameter will not be used.".format(
+                            self._backend.__class__.__name__,
+                            name, value, name))
 
         except FallbackToBackend as e:
             # Recursively initialize the backend in case of requested fallback.
+            e.backend.parent_budget = self._backend.parent_budget
             self._backend = e.backend
             n_jobs = self._initialize_backend()
 
@@ -774,18 +1813,79 @@ class Parallel(Logger):
 
         self.n_dispatched_tasks += len(batch)
         self.n_dispatched_batches += 1
+        batch_index = self.n_dispatched_batches - 1
+        if self.callback is not None:
+            self._notify('batch_dispatched', batch_index=batch_index,
+                         batch_size=len(batch))
 
         dispatch_timestamp = time.time()
-        cb = BatchCompletionCallBack(dispatch_timestamp, len(batch), self)
+        cb = BatchCompletionCallBack(dispatch_timestamp, len(batch), self,
+                                     batch_index=batch_index,
+                                     task_marks=batch._task_marks)
+        if self._resubmits_batches():
+            self._resubmittable_batches[batch_index] = (
+                batch, dispatch_timestamp, cb)
+        if self.on_error == 'collect':
+            self._batch_sizes[batch_index] = len(batch)
+        if self.max_inflight_bytes is not None:
+            self._add_inflight_batch(batch_index, sum(
+                _estimate_nbytes(task) for task in batch.items), len(batch))
+        self._core_budget.task_started()
         with self._lock:
             job_idx = len(self._jobs)
-            job = self._backend.apply_async(batch, callback=cb)
+            job = self._submit(batch, callback=cb)
+            cb.dispatch_end = time.time()
             # A job can complete so quickly than its callback is
             # called before we get here, causing self._jobs to
             # grow. To ensure correct results ordering, .insert is
             # used (rather than .append) in the following line
             self._jobs.insert(job_idx, job)
 
+    def _over_inflight_budget(self):
+        if (self.max_inflight_bytes is None or
+                self._original_iterator is None):
+            return False
+        # Only the batches that were not retrieved yet are accounted for:
+        # dispatching always resumes once they are all retrieved. The
+        # results of the running tasks are expected to be as large as the
+        # ones received so far.
+        nbytes = self._total_inflight_nbytes
+        if self._n_output_tasks:
+            nbytes += (self._n_running_tasks * self._output_nbytes /
+                       self._n_output_tasks)
+        return nbytes > self.max_inflight_bytes
+
+    def _add_inflight_batch(self, batch_index, nbytes, n_tasks):
+        with self._lock:
+            self._inflight_nbytes[batch_index] = nbytes
+            self._inflight_running[batch_index] = n_tasks
+            self._total_inflight_nbytes += nbytes
+            self._n_running_tasks += n_tasks
+
+    def _complete_inflight_batch(self, batch_index, nbytes):
+        """Account for the results of a batch instead of its arguments"""
+        with self._lock:
+            n_tasks = self._inflight_running.pop(batch_index, None)
+            if n_tasks is None:
+                # The batch was already retrieved.
+                return
+            self._n_running_tasks -= n_tasks
+            self._output_nbytes += nbytes
+            self._n_output_tasks += n_tasks
+            self._total_inflight_nbytes += (
+                nbytes - self._inflight_nbytes[batch_index])
+            self._inflight_nbytes[batch_index] = nbytes
+
+    def _release_inflight_nbytes(self, batch_index):
+        """Forget the size of a retrieved batch and resume dispatching"""
+        with self._lock:
+            self._total_inflight_nbytes -= self._inflight_nbytes.pop(
+                batch_index, 0)
+            self._n_running_tasks -= self._inflight_running.pop(
+                batch_index, 0)
+            if self._dispatch_paused and self._original_iterator is not None:
+                self.dispatch_next()
+
     def dispatch_next(self):
         """Dispatch more data for parallel processing
 
@@ -794,9 +1894,15 @@ class Parallel(Logger):
         against concurrent consumption of the unprotected iterator.
 
         """
+        if self._over_inflight_budget():
+            # Resumed by _release_inflight_nbytes when results are retrieved.
+            self._dispatch_paused = True
+            return
+        self._dispatch_paused = False
         if not self.dispatch_one_batch(self._original_iterator):
             self._iterating = False
             self._original_iterator = None
+            self.n_total_tasks = self.n_dispatched_tasks
 
     def dispatch_one_batch(self, iterator):
         """Prefetch the tasks for the next batch and dispatch them.
@@ -815,16 +1921,179 @@ class Parallel(Logger):
             batch_size = self.batch_size
 
         with self._lock:
-            tasks = BatchedCalls(itertools.islice(iterator, batch_size),
-                                 self._backend.get_nested_backend(),
-                                 self._pickle_cache)
+            batch_kwargs = dict(pickle_cache=self._pickle_cache,
+                                report=self.callback is not None,
+                                profile=self.profile,
+                                collect_errors=self.on_error == 'collect')
+            if not getattr(self._backend, 'uses_threads', False):
+                batch_kwargs['inner_max_num_threads'] = (
+                    self.inner_max_num_threads)
+            if self._reorder_tasks:
+                iterator_slice = self._next_tasks(iterator, batch_size)
+            else:
+                iterator_slice = itertools.islice(iterator, batch_size)
+            nested_backend = self._backend.get_nested_backend()
+            if self._map_func is None:
+                tasks = BatchedCalls(iterator_slice, nested_backend,
+                                     **batch_kwargs)
+            else:
+                tasks = MappedCalls(self._map_func, iterator_slice,
+                                    nested_backend,
+                                    vectorize=self._map_vectorize,
+                                    **batch_kwargs)
             if len(tasks) == 0:
                 # No more tasks available in the iterator: tell caller to stop.
                 return False
             else:
+                if self.auto_share:
+                    self._share_common_arguments(tasks)
                 self._dispatch(tasks)
                 return True
 
+    def _next_tasks(self, iterator, batch_size):
+        """Pop the tasks of highest priority of the lookahead window.
+
+        The original indices of the tasks are recorded for the batch that is
+        about to be dispatched so that the results can be put back in order.
+        """
+        heap = self._lookahead_heap
+        n_missing = max(self.lookahead or 0, batch_size) - len(heap)
+        use_priority = self.lookahead is not None and self._map_func is None
+        for index, task in itertools.islice(iterator, max(n_missing, 0)):
+            priority = 0
+            if use_priority:
+                priority = getattr(task, 'priority', None) or 0
+            heapq.heappush(heap, (-priority, index, task))
+        tasks, indices = [], []
+        while heap and len(tasks) < batch_size:
+            _, index, task = heapq.heappop(heap)
+            tasks.append(task)
+            indices.append(index)
+        if tasks:
+            self._batch_task_indices[self.n_dispatched_batches] = indices
+        return tasks
+
+    def _indexed_tasks(self, iterator):
+        """Number the tasks of the iterator, skipping the checkpointed ones.
+
+        The skipping happens before the pre-dispatch limit is applied, so
+        that the tasks loaded from the checkpoint do not count in it.
+        """
+        for index, task in enumerate(iterator):
+            if self.checkpoint is None or not self._load_checkpoint(index,
+                                                                    task):
+                yield index, task
+
+    def _in_order(self, batch_index, results):
+        """Return the results that follow the ones already returned"""
+        indices = self._batch_task_indices.pop(batch_index, None)
+        if indices is None:
+            return results
+        if self.checkpoint is not None:
+            self._save_checkpoint(indices, results)
+        self._pending_results.update(_zip(indices, results))
+        return self._ready_results()
+
+    def _ready_results(self):
+        """Pop the pending results that follow the ones already returned"""
+        pending = self._pending_results
+        ready = []
+        while self._next_result_index in pending:
+            ready.append(pending.pop(self._next_result_index))
+            self._next_result_index += 1
+        return ready
+
+    def _checkpointed_func(self, func):
+        """Return the memorized version of func used to key its results"""
+        try:
+            return self._checkpointed_funcs[id(func)][1]
+        except KeyError:
+            pass
+        memorized = self.checkpoint.cache(func)
+        # Invalidate the results of the previous versions of the function,
+        # once per call. Keep a reference to func so that its id is not
+        # reused.
+        _check_cached_func_code(memorized.store_backend, func)
+        self._checkpointed_funcs[id(func)] = (func, memorized)
+        return memorized
+
+    def _load_checkpoint(self, index, task):
+        """Look up the result of a task in the checkpoint.
+
+        If it is found, it is added to the pending results and True is
+        returned. Otherwise the key of its result is recorded for
+        ``_save_checkpoint``.
+        """
+        if self._map_func is None:
+            func, args, kwargs = task
+        else:
+            func, args, kwargs = self._map_func, task, {}
+        memorized = self._checkpointed_func(func)
+        path = list(memorized._get_output_identifiers(*args, **kwargs))
+        store_backend = memorized.store_backend
+        if store_backend.contains_item(path):
+            try:
+                result = store_backend.load_item(path, verbose=0)
+            except Exception:
+                warnings.warn('Exception while loading the checkpointed '
+                              'result of task %d, computing it again:\n%s'
+                              % (index, traceback.format_exc()))
+            else:
+                self._pending_results[index] = result
+                self.n_checkpointed_tasks += 1
+                return True
+        self._checkpoint_paths[index] = (store_backend, path)
+        return False
+
+    def _save_checkpoint(self, indices, results):
+        """Save the results of the tasks of a batch.
+
+        This is done as soon as the batch completes and, if the completion
+        callback did not run yet, when it is retrieved: each result is saved
+        only once. The lock makes the retrieval wait for the results being
+        saved by the callback, so that they are all saved when the call
+        returns.
+        """
+        paths = self._checkpoint_paths
+        with self._checkpoint_lock:
+            for index, result in _zip(indices, results):
+                key = paths.pop(index, None)
+                if key is not None and not isinstance(result, TaskFailure):
+                    store_backend, path = key
+                    store_backend.dump_item(path, result, verbose=0)
+
+    def _share_common_arguments(self, batch):
+        """Wrap the arguments already passed to the previous batch in shared
+
+        Only the arguments of the previous batch are remembered: keeping a
+        reference to them makes it safe to compare objects by id.
+        """
+        previous_args = self._previous_batch_args
+        shared_args = self._shared_args
+        current_args = dict()
+        not_shareable = _NOT_SHAREABLE_TYPES
+        if np is not None:
+            not_shareable += (np.ndarray,)
+
+        def share(arg):
+            if isinstance(arg, not_shareable) or callable(arg):
+                return arg
+            arg_id = id(arg)
+            shared_arg = shared_args.get(arg_id)
+            if shared_arg is None:
+                current_args[arg_id] = arg
+                if previous_args.get(arg_id) is not arg:
+                    return arg
+                # The wrapper keeps a reference to arg so its id cannot be
+                # reused until the end of the call.
+                shared_arg = shared_args[arg_id] = SharedArgument(arg)
+            return shared_arg
+
+        batch.items = [(func, tuple(share(a) for a in args),
+                        dict((k, share(v)) for k, v in kwargs.items()))
+                       for func, args, kwargs in batch.items]
+        self._previous_batch_args = current_args
+
     def _print(self, msg, msg_args):
         """Display the message on stout or stderr depending on verbosity"""
         # XXX: Not using the logger framework: need to
@@ -838,6 +2107,18 @@ class Parallel(Logger):
         msg = msg % msg_args
         writer('[%s]: %s\n' % (self, msg))
 
+    def _notify(self, event, **info):
+        """Send a structured progress event to the user callback"""
+        info.update(
+            event=event,
+            n_dispatched_tasks=self.n_dispatched_tasks,
+            n_completed_tasks=self.n_completed_tasks,
+            n_total_tasks=self.n_total_tasks,
+            queue_depth=self.n_dispatched_batches - self.n_completed_batches,
+            elapsed=time.time() - self._start_time,
+        )
+        self.callback(info)
+
     def print_progress(self):
         """Display the process of the parallel execution only a fraction
            of time, controlled by self.verbose.
@@ -881,6 +2162,170 @@ class Parallel(Logger):
                          short_format_time(remaining_time),
                          ))
 
+    def _resubmits_batches(self):
+        return bool(self.retries or self.task_timeout is not None or
+                    self.speculative)
+
+    def _handles_failures(self):
+        """Whether failed batches are resubmitted or collected"""
+        return bool(self.retries) or self.on_error == 'collect'
+
+    def _submit(self, batch, callback=None):
+        try:
+            return self._backend.apply_async(batch, callback=callback)
+        except Exception as exception:
+            if not self._handles_failures():
+                raise
+            if threading.current_thread() is not self._calling_thread:
+                # This is a callback of the workers: restarting them from
+                # here could deadlock. Let the calling thread handle it.
+                return _FailedBatch(exception)
+        # The workers are broken, for instance because one of them was
+        # killed: restart them and try again.
+        self._print('Restarting the workers of %s',
+                    (self._backend.__class__.__name__,))
+        try:
+            if hasattr(self._backend, 'abort_everything'):
+                self._backend.abort_everything(ensure_ready=True)
+            return self._backend.apply_async(batch, callback=callback)
+        except Exception as exception:
+            return _FailedBatch(exception)
+
+    def _resubmit(self, batch, cb):
+        """Submit a new attempt to run a batch that failed or is late"""
+        def callback(out):
+            if not BatchCompletionCallBack._failed(out):
+                cb.complete(out)
+        return self._submit(batch, callback=callback)
+
+    def _collect_batch_failure(self, batch_index, exception):
+        """Return the placeholders of the tasks of a failed batch.
+
+        Also dispatch the next batch in place of the completion callback.
+        """
+        text = traceback.format_exc()
+        failures = [TaskFailure(exception, text)
+                    for _ in range(self._batch_sizes.pop(batch_index))]
+        with self._lock:
+            if self._original_iterator is not None:
+                self.dispatch_next()
+        return failures
+
+    def _is_straggling(self, start_time):
+        durations = self._batch_durations
+        if self._iterating or not durations:
+            return False
+        n_running = self.n_dispatched_batches - self.n_completed_batches
+        if n_running >= self._call_n_jobs:
+            # No worker is idle.
+            return False
+        median = sorted(durations)[len(durations) // 2]
+        return time.time() - start_time > 2 * median
+
+    def _get_with_retries(self, job, batch_index):
+        """Wait for the output of a batch, resubmitting it when it fails.
+
+        All the attempts at running the batch are polled in turn and the
+        first output is returned. Attempts that exceed task_timeout are kept
+        as their output can still arrive first, but no longer time out.
+        """
+        batch, dispatch_time, cb = self._resubmittable_batches.pop(
+            batch_index)
+        if not getattr(self._backend, 'supports_timeout', False):
+            # Only retries are possible.
+            return self._get_with_retries_blocking(job, batch, cb)
+        # Each attempt is a [job, start_time, may_time_out] list.
+        attempts = [[job, dispatch_time, self.task_timeout is not None]]
+        if self.task_timeout is not None:
+            time_limit = self.task_timeout * len(batch)
+        n_failures = 0
+        speculated = False
+        while True:
+            error = None
+            for attempt in list(attempts):
+                attempt_job, start_time, may_time_out = attempt
+                try:
+                    # Poll more often when several attempts are raced.
+                    return attempt_job.get(
+                        timeout=0.1 if len(attempts) == 1 else 0.01)
+                except TimeoutError:
+                    if (not may_time_out or
+                            time.time() - start_time < time_limit):
+                        continue
+                    attempt[2] = False
+                    error = TimeoutError(
+                        'Batch of %d tasks not completed within %.3fs' %
+                        (len(batch), time_limit))
+                except (KeyboardInterrupt, WorkerInterrupt):
+                    raise
+                except Exception as e:
+                    attempts.remove(attempt)
+                    error = e
+                break
+            if error is not None:
+                n_failures += 1
+                if n_failures > self.retries:
+                    cb.complete(error)
+                    raise error
+                time.sleep(self.retry_backoff * 2 ** (n_failures - 1))
+                attempts.append([self._resubmit(batch, cb), time.time(),
+                                 self.task_timeout is not None])
+            elif (self.speculative and not speculated and
+                    self._is_straggling(attempts[0][1])):
+                speculated = True
+                attempts.append([self._resubmit(batch, cb), time.time(),
+                                 self.task_timeout is not None])
+
+    def _get_with_retries_blocking(self, job, batch, cb):
+        n_failures = 0
+        while True:
+            try:
+                return job.get()
+            except (KeyboardInterrupt, WorkerInterrupt):
+                raise
+            except Exception as error:
+                n_failures += 1
+                if n_failures > self.retries:
+                    cb.complete(error)
+                    raise
+                time.sleep(self.retry_backoff * 2 ** (n_failures - 1))
+                job = self._resubmit(batch, cb)
+
+    def _get_batch_results(self, job, batch_index):
+        """Wait for the results of a batch.
+
+        With on_error='collect', the failure of the whole batch is returned
+        as one TaskFailure per task instead of being raised.
+        """
+        try:
+            if batch_index in self._resubmittable_batches:
+                output = self._get_with_retries(job, batch_index)
+            elif getattr(self._backend, 'supports_timeout', False):
+                output = job.get(timeout=self.timeout)
+            else:
+                output = job.get()
+        except Exception as exception:
+            if (self.on_error != 'collect' or
+                    isinstance(exception, WorkerInterrupt)):
+                raise
+            return self._collect_batch_failure(batch_index, exception)
+        self._batch_sizes.pop(batch_index, None)
+        return _unpack_batch_output(output)[0]
+
+    def _record_failures(self, output):
+        self.last_failures = []
+        for index, result in enumerate(output):
+            if isinstance(result, TaskFailure):
+                result.index = index
+                self.last_failures.append(result)
+        if self.last_failures:
+            counts = collections.Counter(type(failure.exception).__name__
+                                         for failure in self.last_failures)
+            self._print('%d out of %d tasks failed: %s',
+                        (len(self.last_failures), len(output),
+                         ', '.join('%d %s' % (count, name) for name, count
+                                   in sorted(counts.items()))))
+
     def retrieve(self):
         self._output = list()
         while self._iterating or len(self._jobs) > 0:
@@ -893,32 +2338,20 @@ class Parallel(Logger):
             # the use of the lock
             with self._lock:
                 job = self._jobs.pop(0)
+                batch_index = self._n_retrieved_batches
+                self._n_retrieved_batches += 1
 
             try:
-                if getattr(self._backend, 'supports_timeout', False):
-                    self._output.extend(job.get(timeout=self.timeout))
-                else:
-                    self._output.extend(job.get())
+                self._output.extend(self._in_order(
+                    batch_index, self._get_batch_results(job, batch_index)))
+                if self.max_inflight_bytes is not None:
+                    self._release_inflight_nbytes(batch_index)
 
             except BaseException as exception:
                 # Note: we catch any BaseException instead of just Exception
                 # instances to also include KeyboardInterrupt.
 
-                # Stop dispatching any new job in the async callback thread
-                self._aborting = True
-
-                # If the backend allows it, cancel or kill remaining running
-                # tasks without waiting for the results as we will raise
-                # the exception we got back to the caller instead of returning
-                # any result.
-                backend = self._backend
-                if (backend is not None and
-                        hasattr(backend, 'abort_everything')):
-                    # If the backend is managed externally we need to make sure
-                    # to leave it in a working state to allow for future jobs
-                    # scheduling.
-                    ensure_ready = self._managed_backend
-                    backend.abort_everything(ensure_ready=ensure_ready)
+                self._abort()
 
                 if isinstance(exception, TransportableException):
                     # Capture exception to add information on the local
@@ -928,8 +2361,15 @@ class Parallel(Logger):
                     raise exception.unwrap(this_report)
                 else:
                     raise
+        # The results of the last tasks may all come from the checkpoint.
+        self._output.extend(self._ready_results())
 
-    def __call__(self, iterable):
+    def _start_call(self, iterable):
+        """Initialize the backend and the state of a call.
+
+        Return the iterator of the tasks to dispatch before the first results
+        are retrieved.
+        """
         if self._jobs:
             raise ValueError('This Parallel instance is already running')
         # A flag used to abort the dispatching of jobs in case an
@@ -944,7 +2384,21 @@ class Parallel(Logger):
                     (self._backend.__class__.__name__, n_jobs))
         if hasattr(self._backend, 'start_call'):
             self._backend.start_call()
+        # The cores granted to this call are shared by its running tasks and
+        # passed on to the nested calls they start. The number of running
+        # tasks is shared with the workers of process-based backends.
+        self._core_budget = CoreBudget(
+            self._backend.available_cores(), n_jobs,
+            shared=n_jobs > 1 and not getattr(self._backend, 'uses_threads',
+                                              False))
+        self._backend.core_budget = self._core_budget
         iterator = iter(iterable)
+        # The tasks are numbered to return their results in order when they
+        # are not dispatched in order or when some of them are checkpointed.
+        self._reorder_tasks = self.checkpoint is not None or (
+            self.lookahead is not None and self._map_func is None)
+        if self._reorder_tasks:
+            iterator = self._indexed_tasks(iterator)
         pre_dispatch = self.pre_dispatch
 
         if pre_dispatch == 'all' or n_jobs == 1:
@@ -966,31 +2420,112 @@ class Parallel(Logger):
         self.n_dispatched_batches = 0
         self.n_dispatched_tasks = 0
         self.n_completed_tasks = 0
+        self.n_completed_batches = 0
+        self.n_total_tasks = None
+        if self.profile:
+            self.last_profile = ParallelProfile()
         # Use a caching dict for callables that are pickled with cloudpickle to
         # improve performances. This cache is used only in the case of
         # functions that are defined in the __main__ module, functions that are
         # defined locally (inside another function) and lambda expressions.
         self._pickle_cache = dict()
-        try:
-            # Only set self._iterating to True if at least a batch
-            # was dispatched. In particular this covers the edge
-            # case of Parallel used with an exhausted iterator. If
-            # self._original_iterator is None, then this means either
-            # that pre_dispatch == "all", n_jobs == 1 or that the first batch
-            # was very quick and its callback already dispatched all the
-            # remaining jobs.
+        self._previous_batch_args = dict()
+        self._shared_args = dict()
+        # Estimated sizes of the batches that were not retrieved yet and
+        # number of tasks of the ones still running, by batch index, when
+        # max_inflight_bytes is set
+        self._inflight_nbytes = dict()
+        self._inflight_running = dict()
+        self._total_inflight_nbytes = 0
+        self._n_running_tasks = 0
+        self._output_nbytes = 0
+        self._n_output_tasks = 0
+        self._dispatch_paused = False
+        self._n_retrieved_batches = 0
+        # State of the reordering of the tasks when lookahead is set: tasks
+        # read ahead from the iterable, original indices of the tasks of each
+        # dispatched batch and results waiting for the preceding ones.
+        self._lookahead_heap = []
+        self._batch_task_indices = dict()
+        self._pending_results = dict()
+        self._next_result_index = 0
+        # Memorized functions and paths of the results of the tasks that are
+        # not retrieved yet, when checkpoint is set
+        self._checkpointed_funcs = dict()
+        self._checkpoint_paths = dict()
+        self._checkpoint_lock = threading.Lock()
+        self.n_checkpointed_tasks = 0
+        # Batches that may be resubmitted, by batch index, with their
+        # dispatch time, and durations of the completed batches.
+        self._resubmittable_batches = dict()
+        self._batch_durations = []
+        self._call_n_jobs = n_jobs
+        self._calling_thread = threading.current_thread()
+        # Number of tasks of the batches that were not retrieved yet, when
+        # on_error='collect'
+        self._batch_sizes = dict()
+        return iterator
+
+    def _dispatch_first_batches(self, iterator):
+        # Only set self._iterating to True if at least a batch
+        # was dispatched. In particular this covers the edge
+        # case of Parallel used with an exhausted iterator. If
+        # self._original_iterator is None, then this means either
+        # that pre_dispatch == "all", n_jobs == 1 or that the first batch
+        # was very quick and its callback already dispatched all the
+        # remaining jobs.
+        self._iterating = False
+        if self.dispatch_one_batch(iterator):
+            self._iterating = self._original_iterator is not None
+
+        while True:
+            if self._over_inflight_budget():
+                self._dispatch_paused = True
+                break
+            if not self.dispatch_one_batch(iterator):
+                break
+
+        if self._original_iterator is None:
+            self.n_total_tasks = self.n_dispatched_tasks
+            # The iterable was consumed all at once by the above for loop.
+            # No need to wait for async callbacks to trigger to
+            # consumption.
             self._iterating = False
-            if self.dispatch_one_batch(iterator):
-                self._iterating = self._original_iterator is not None
 
-            while self.dispatch_one_batch(iterator):
-                pass
+    def _stop_call(self):
+        if hasattr(self._backend, 'stop_call'):
+            self._backend.stop_call()
+        self._core_budget.close()
+        self._backend.core_budget = None
+        if not self._managed_backend:
+            self._terminate_backend()
+        self._jobs = list()
+        self._pickle_cache = None
+        self._previous_batch_args = self._shared_args = None
+        if self.profile:
+            self.last_profile.end_time = time.time()
+
+    def _abort(self):
+        # Stop dispatching any new job in the async callback thread
+        self._aborting = True
+
+        # If the backend allows it, cancel or kill remaining running
+        # tasks without waiting for the results as we will raise
+        # the exception we got back to the caller instead of returning
+        # any result.
+        backend = self._backend
+        if (backend is not None and
+                hasattr(backend, 'abort_everything')):
+            # If the backend is managed externally we need to make sure
+            # to leave it in a working state to allow for future jobs
+            # scheduling.
+            ensure_ready = self._managed_backend
+            backend.abort_everything(ensure_ready=ensure_ready)
 
-            if pre_dispatch == "all" or n_jobs == 1:
-                # The iterable was consumed all at once by the above for loop.
-                # No need to wait for async callbacks to trigger to
-                # consumption.
-                self._iterating = False
+    def __call__(self, iterable):
+        iterator = self._start_call(iterable)
+        try:
+            self._dispatch_first_batches(iterator)
 
             with self._backend.retrieval_context():
                 self.retrieve()
@@ -999,16 +2534,113 @@ class Parallel(Logger):
             self._print('Done %3i out of %3i | elapsed: %s finished',
                         (len(self._output), len(self._output),
                          short_format_time(elapsed_time)))
+            if self.on_error == 'collect':
+                self._record_failures(self._output)
         finally:
-            if hasattr(self._backend, 'stop_call'):
-                self._backend.stop_call()
-            if not self._managed_backend:
-                self._terminate_backend()
-            self._jobs = list()
-            self._pickle_cache = None
+            self._stop_call()
         output = self._output
         self._output = None
         return output
 
+    def acall(self, iterable):
+        """Asynchronous version of ``Parallel.__call__`` for asyncio.
+
+        Return an asyncio future that resolves to the list of results:
+        ``results = await parallel.acall(delayed(f)(x) for x in data)``.
+
+        This method must be called from the thread running the event loop.
+        The first batches are dispatched when it is called but the event loop
+        is not blocked while waiting for the results: completed batches are
+        handed back to the loop with ``loop.call_soon_threadsafe`` by the
+        callbacks of the backend. Cancelling the future aborts the remaining
+        tasks. The ``timeout`` parameter is not supported by this method:
+        use ``asyncio.wait_for`` instead.
+        """
+        return _AsyncParallelCall(self, iterable).gather()
+
+    def aiter(self, iterable):
+        """Return an asynchronous iterator of the results, in order.
+
+        Results are made available as soon as all the batches preceding them
+        have completed::
+
+            async for result in parallel.aiter(delayed(f)(x) for x in data):
+                ...
+
+        See ``Parallel.acall`` for details. The remaining tasks are aborted
+        if the ``aclose`` coroutine of the iterator is awaited before the end
+        of the iteration.
+        """
+        return _AsyncParallelCall(self, iterable)
+
+    def starmap(self, func, iterable):
+        """Call func on each tuple of arguments of iterable in parallel.
+
+        This is equivalent to ``self(delayed(func)(*args) for args in
+        iterable)`` but with a lower overhead per task: the function is
+        pickled once per batch instead of once per task and the arguments of
+        a batch are sent to the workers as one list per argument position.
+        It is therefore well suited for very large numbers of short tasks.
+
+        >>> from joblib import Parallel
+        >>> Parallel(n_jobs=2).starmap(pow, [(2, 5), (3, 2), (10, 3)])
+        [32, 9, 1000]
+
+        """
+        return self._map(func, iterable)
+
+    def _map(self, func, iterable, vectorize=None):
+        if self._jobs:
+            raise ValueError('This Parallel instance is already running')
+        self._map_func = func
+        self._map_vectorize = vectorize
+        try:
+            return self(iterable)
+        finally:
+            self._map_func = self._map_vectorize = None
+
+    def map(self, func, *iterables):
+        """Call func on the items of the iterables in parallel.
+
+        As for the builtin ``map`` function, func receives one argument from
+        each iterable and the iteration stops when the shortest iterable is
+        exhausted. See ``Parallel.starmap`` for details.
+
+        >>> from math import sqrt
+        >>> from joblib import Parallel
+        >>> Parallel(n_jobs=2).map(sqrt, [1, 4, 9])
+        [1.0, 2.0, 3.0]
+
+        """
+        return self.starmap(func, _zip(*iterables))
+
+    def map_batches(self, func, *iterables, **kwargs):
+        """Apply a vectorized function to batches of items of the iterables.
+
+        Instead of being called once per task, func is called once per batch
+        with one list per iterable holding the items of the batch, or one
+        numpy array stacking these items if ``stack=True``. It must return a
+        list or an array with one result per item. The batches are sized as
+        specified by ``batch_size``: with ``batch_size='auto'``, the size of
+        the batches is adjusted to the duration of the calls as for regular
+        tasks. The results are returned as a list with one item per task.
+
+        >>> from joblib import Parallel
+        >>> def add(xs, ys):
+        ...     return [x + y for x, y in zip(xs, ys)]
+        >>> Parallel(n_jobs=2, prefer='threads', batch_size=2).map_batches(
+        ...     add, range(5), range(5))
+        [0, 2, 4, 6, 8]
+
+        """
+        stack = kwargs.pop('stack', False)
+        if kwargs:
+            raise TypeError("map_batches() got unexpected keyword arguments "
+                            "%r" % sorted(kwargs))
+        if stack and np is None:
+            raise ImportError("stack=True requires numpy to be installed")
+        return self._map(func, _zip(*iterables),
+                         vectorize='stack' if stack else 'list')
+
     def __repr__(self):
         return '%s(n_jobs=%s)' % (self.__class__.__name__, self.n_jobs)
@@ -13,9 +13,15 @@ that uses a custom alternative to SimpleQueue.
 # Copyright: 2012, Olivier Grisel
 # License: BSD 3 clause
 
+import os
 import sys
+import mmap
+import struct
+import tempfile
 import warnings
+import threading
 from time import sleep
+from functools import partial
 
 try:
     WindowsError
@@ -24,18 +30,19 @@ except NameError:
 
 # Customizable pure Python pickler in Python 2
 # customizable C-optimized pickler under Python 3.3+
-from pickle import Pickler
+from pickle import Pickler, loads
 
 from pickle import HIGHEST_PROTOCOL
 from io import BytesIO
 
-from .disk import delete_folder
-from ._memmapping_reducer import get_memmapping_reducers
+from ._memmapping_reducer import get_memmapping_reducers, ArrayMemmapReducer
+from ._memmapping_reducer import delete_temp_folder, SYSTEM_SHARED_MEM_FS
 from ._multiprocessing_helpers import mp, assert_spawning
 
 # We need the class definition to derive from it, not the multiprocessing.Pool
 # factory function
 from multiprocessing.pool import Pool
+from multiprocessing import util
 
 try:
     import numpy as np
@@ -44,6 +51,10 @@ except ImportError:
 
 if sys.version_info[:2] > (2, 7):
     import copyreg
+    fast_loads = loads
+else:
+    # The unpickler of the pickle module is implemented in pure Python.
+    from cPickle import loads as fast_loads
 
 
 ###############################################################################
@@ -71,8 +82,13 @@ class CustomizablePickler(Pickler):
     # feature from http://bugs.python.org/issue14166 that makes it possible
     # to use the C implementation of the Pickler which is faster.
 
-    def __init__(self, writer, reducers=None, protocol=HIGHEST_PROTOCOL):
-        Pickler.__init__(self, writer, protocol=protocol)
+    def __init__(self, writer, reducers=None, protocol=HIGHEST_PROTOCOL,
+                 buffer_callback=None):
+        if buffer_callback is None:
+            Pickler.__init__(self, writer, protocol=protocol)
+        else:
+            Pickler.__init__(self, writer, protocol=protocol,
+                             buffer_callback=buffer_callback)
         if reducers is None:
             reducers = {}
         if hasattr(Pickler, 'dispatch'):
@@ -99,6 +115,158 @@ class CustomizablePickler(Pickler):
             self.dispatch_table[type] = reduce_func
 
 
+# Buffers sent out-of-band by the queues and marker of the messages
+# followed by such buffers, which cannot start a pickle stream.
+_PICKLE_BUFFERS = HIGHEST_PROTOCOL >= 5
+_OUT_OF_BAND_NBYTES = 64 * 1024
+_OUT_OF_BAND_MARKER = b'\x00'
+_SIZE = struct.Struct('<Q')
+
+
+def _out_of_band_reducers(reducers):
+    """Make the array reducers leave the buffers of the arrays that are not
+    memory mapped to the pickler, to send them out-of-band"""
+    reducers = dict(reducers or {})
+    for type_, reducer in reducers.items():
+        if isinstance(reducer, ArrayMemmapReducer):
+            reducers[type_] = partial(reducer, out_of_band=True)
+    return reducers
+
+
+# Layout of the ring buffers: a header holding the number of messages written
+# and read, followed by fixed size slots starting with the size of their
+# message. A slot of size _IN_PIPE tells that the message was too large for
+# the slot and was sent through the pipe instead.
+_RING_HEADER = struct.Struct('<QQ')
+_RING_COUNT = struct.Struct('<Q')
+_RING_SLOT_NBYTES = 4096
+_RING_SLOT_SIZE = struct.Struct('<I')
+_IN_PIPE = 0xffffffff
+
+
+def _unlink_ring_file(filename):
+    try:
+        os.unlink(filename)
+    except OSError:
+        pass
+
+
+class _RingBuffer(object):
+    """Shared memory slots holding the small messages of a queue.
+
+    The slots are written under the write lock of the queue and read under
+    its read lock: two semaphores count the free and the used slots.
+    """
+
+    def __init__(self, context, nbytes):
+        self.n_slots = max(int(nbytes) // _RING_SLOT_NBYTES, 1)
+        self.max_message_nbytes = _RING_SLOT_NBYTES - _RING_SLOT_SIZE.size
+        folder = None
+        if os.access(SYSTEM_SHARED_MEM_FS, os.W_OK):
+            folder = SYSTEM_SHARED_MEM_FS
+        fd, self.filename = tempfile.mkstemp(prefix='joblib_ring_',
+                                             dir=folder)
+        try:
+            os.ftruncate(fd, self._nbytes())
+            self._buffer = mmap.mmap(fd, self._nbytes())
+        finally:
+            os.close(fd)
+        self._free_slots = context.Semaphore(self.n_slots)
+        self._used_slots = context.Semaphore(0)
+        self._finalizer = util.Finalize(self, _unlink_ring_file,
+                                        args=(self.filename,),
+                                        exitpriority=0)
+
+    def _nbytes(self):
+        return _RING_HEADER.size + self.n_slots * _RING_SLOT_NBYTES
+
+    def __getstate__(self):
+        assert_spawning(self)
+        return (self.n_slots, self.max_message_nbytes, self.filename,
+                self._free_slots, self._used_slots)
+
+    def __setstate__(self, state):
+        (self.n_slots, self.max_message_nbytes, self.filename,
+         self._free_slots, self._used_slots) = state
+        with open(self.filename, 'r+b') as f:
+            self._buffer = mmap.mmap(f.fileno(), self._nbytes())
+        self._finalizer = None
+
+    def _slot_offset(self, index):
+        return _RING_HEADER.size + (index % self.n_slots) * _RING_SLOT_NBYTES
+
+    def push(self, message):
+        """Write message, or the marker of a message sent through the pipe
+        if message is None, to the next slot"""
+        self._free_slots.acquire()
+        buffer = self._buffer
+        n_written = _RING_COUNT.unpack_from(buffer, 0)[0]
+        offset = self._slot_offset(n_written)
+        if message is None:
+            _RING_SLOT_SIZE.pack_into(buffer, offset, _IN_PIPE)
+        else:
+            _RING_SLOT_SIZE.pack_into(buffer, offset, len(message))
+            start = offset + _RING_SLOT_SIZE.size
+            buffer[start:start + len(message)] = message
+        _RING_COUNT.pack_into(buffer, 0, n_written + 1)
+        self._used_slots.release()
+
+    def pop(self):
+        """Read the next message, or None if it was sent through the pipe"""
+        self._used_slots.acquire()
+        buffer = self._buffer
+        n_read = _RING_COUNT.unpack_from(buffer, _RING_COUNT.size)[0]
+        offset = self._slot_offset(n_read)
+        size = _RING_SLOT_SIZE.unpack_from(buffer, offset)[0]
+        message = None
+        if size != _IN_PIPE:
+            start = offset + _RING_SLOT_SIZE.size
+            message = buffer[start:start + size]
+        _RING_COUNT.pack_into(buffer, _RING_COUNT.size, n_read + 1)
+        self._free_slots.release()
+        return message
+
+    def pending(self):
+        n_written, n_read = _RING_HEADER.unpack_from(self._buffer, 0)
+        return n_written != n_read
+
+    def close(self):
+        """Remove the file of the ring buffer, in the process creating it"""
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+class _RingReader(object):
+    """Read end of a queue whose small messages go through a ring buffer.
+
+    It stands for the read end of the pipe of the queue, which is used by
+    multiprocessing.Pool to poll the queue and to drain it.
+    """
+
+    def __init__(self, conn, ring):
+        self._conn = conn
+        self._ring = ring
+
+    def recv_bytes(self):
+        message = self._ring.pop()
+        if message is None:
+            return self._conn.recv_bytes()
+        return message
+
+    def recv_bytes_into(self, buffer):
+        # Only used for the buffers sent out-of-band, through the pipe.
+        return self._conn.recv_bytes_into(buffer)
+
+    def poll(self, timeout=0.0):
+        return self._ring.pending() or self._conn.poll(timeout)
+
+    def fileno(self):
+        return self._conn.fileno()
+
+    def close(self):
+        self._conn.close()
+
+
 class CustomizablePicklingQueue(object):
     """Locked Pipe implementation that uses a customizable pickler.
 
@@ -114,9 +282,14 @@ class CustomizablePicklingQueue(object):
     return a `__reduce__` method.
 
     See the standard library documentation on pickling for more details.
+
+    If `ring_buffer_nbytes` is not None, the messages smaller than 4kB are
+    written to a ring buffer of about this size in shared memory instead of
+    the pipe, which only carries the larger messages. This is not supported
+    under Windows.
     """
 
-    def __init__(self, context, reducers=None):
+    def __init__(self, context, reducers=None, ring_buffer_nbytes=None):
         self._reducers = reducers
         self._reader, self._writer = context.Pipe(duplex=False)
         self._rlock = context.Lock()
@@ -124,23 +297,57 @@ class CustomizablePicklingQueue(object):
             self._wlock = None
         else:
             self._wlock = context.Lock()
+        self._ring = None
+        if ring_buffer_nbytes is not None and self._wlock is not None:
+            self._ring = _RingBuffer(context, ring_buffer_nbytes)
+            self._reader = _RingReader(self._reader, self._ring)
         self._make_methods()
 
     def __getstate__(self):
         assert_spawning(self)
         return (self._reader, self._writer, self._rlock, self._wlock,
-                self._reducers)
+                self._reducers, self._ring)
 
     def __setstate__(self, state):
         (self._reader, self._writer, self._rlock, self._wlock,
-         self._reducers) = state
+         self._reducers, self._ring) = state
         self._make_methods()
 
+    def close(self):
+        """Remove the ring buffer of the queue, if any"""
+        if self._ring is not None:
+            self._ring.close()
+
     def empty(self):
         return not self._reader.poll()
 
     def _make_methods(self):
-        self._recv = recv = self._reader.recv
+        # With the pickle protocol 5 of Python 3.8+, the large buffers, such
+        # as the data of the numpy arrays that are not memory mapped, are
+        # written to the pipe and read from it as separate messages instead
+        # of being copied in and out of the pickle stream. This requires the
+        # messages to be written under a lock.
+        out_of_band = _PICKLE_BUFFERS and self._wlock is not None
+        reader = self._reader
+        if out_of_band:
+            def recv():
+                message = reader.recv_bytes()
+                if message[:1] != _OUT_OF_BAND_MARKER:
+                    return loads(message)
+                n_buffers = _SIZE.unpack_from(message, 1)[0]
+                offset = 1 + _SIZE.size * (n_buffers + 1)
+                buffers = []
+                for i in range(n_buffers):
+                    size = _SIZE.unpack_from(message, 1 + _SIZE.size * (i + 1))
+                    buffers.append(bytearray(size[0]))
+                    reader.recv_bytes_into(buffers[-1])
+                return loads(memoryview(message)[offset:], buffers=buffers)
+        elif self._ring is not None:
+            def recv():
+                return fast_loads(reader.recv_bytes())
+        else:
+            recv = reader.recv
+        self._recv = recv
         racquire, rrelease = self._rlock.acquire, self._rlock.release
 
         def get():
@@ -152,11 +359,54 @@ class CustomizablePicklingQueue(object):
 
         self.get = get
 
-        if self._reducers:
+        ring = self._ring
+        if self._reducers or out_of_band or ring is not None:
+            # The pickler is reused for all the messages: creating it with
+            # its dispatch table costs more than pickling a small task.
+            buffer = BytesIO()
+            pickle_buffers = []
+            pickler_lock = threading.Lock()
+            if out_of_band:
+                def buffer_callback(pickle_buffer):
+                    if memoryview(pickle_buffer).nbytes < _OUT_OF_BAND_NBYTES:
+                        # Serialized in the pickle stream.
+                        return True
+                    pickle_buffers.append(pickle_buffer)
+
+                pickler = CustomizablePickler(
+                    buffer, _out_of_band_reducers(self._reducers),
+                    buffer_callback=buffer_callback)
+            else:
+                pickler = CustomizablePickler(buffer, self._reducers)
+
             def send(obj):
-                buffer = BytesIO()
-                CustomizablePickler(buffer, self._reducers).dump(obj)
-                self._writer.send_bytes(buffer.getvalue())
+                with pickler_lock:
+                    buffer.seek(0)
+                    buffer.truncate()
+                    pickler.clear_memo()
+                    try:
+                        pickler.dump(obj)
+                        message = buffer.getvalue()
+                        buffers = [b.raw() for b in pickle_buffers]
+                    finally:
+                        del pickle_buffers[:]
+                if ring is not None:
+                    if (not buffers and
+                            len(message) <= ring.max_message_nbytes):
+                        ring.push(message)
+                        return
+                    # The reader finds the message in the pipe.
+                    ring.push(None)
+                if not buffers:
+                    self._writer.send_bytes(message)
+                    return
+                sizes = [b.nbytes for b in buffers]
+                self._writer.send_bytes(
+                    _OUT_OF_BAND_MARKER +
+                    struct.pack('<%dQ' % (len(sizes) + 1), len(sizes),
+                                *sizes) + message)
+                for b in buffers:
+                    self._writer.send_bytes(b)
             self._send = send
         else:
             self._send = send = self._writer.send
@@ -192,29 +442,62 @@ class PicklingPool(Pool):
     pickled `tuple_of_objects` as would return a `__reduce__` method.
     See the standard library documentation about pickling for more details.
 
+    If `ring_buffer_nbytes` is not None, the small tasks and results are
+    sent through ring buffers of about this size in shared memory, instead of
+    pipes. This saves system calls for short tasks sent one at a time. It is
+    not supported under Windows.
+
     """
 
     def __init__(self, processes=None, forward_reducers=None,
-                 backward_reducers=None, **kwargs):
+                 backward_reducers=None, ring_buffer_nbytes=None, **kwargs):
         if forward_reducers is None:
             forward_reducers = dict()
         if backward_reducers is None:
             backward_reducers = dict()
         self._forward_reducers = forward_reducers
         self._backward_reducers = backward_reducers
+        self._ring_buffer_nbytes = ring_buffer_nbytes
         poolargs = dict(processes=processes)
         poolargs.update(kwargs)
         super(PicklingPool, self).__init__(**poolargs)
 
     def _setup_queues(self):
         context = getattr(self, '_ctx', mp)
-        self._inqueue = CustomizablePicklingQueue(context,
-                                                  self._forward_reducers)
-        self._outqueue = CustomizablePicklingQueue(context,
-                                                   self._backward_reducers)
+        self._inqueue = CustomizablePicklingQueue(
+            context, self._forward_reducers,
+            ring_buffer_nbytes=self._ring_buffer_nbytes)
+        self._outqueue = CustomizablePicklingQueue(
+            context, self._backward_reducers,
+            ring_buffer_nbytes=self._ring_buffer_nbytes)
         self._quick_put = self._inqueue._send
         self._quick_get = self._outqueue._recv
 
+    def terminate(self):
+        super(PicklingPool, self).terminate()
+        self._inqueue.close()
+        self._outqueue.close()
+
+    @staticmethod
+    def _wait_for_updates(sentinels, change_notifier, timeout=None):
+        # Under Python 3.8+, the worker handler of the pool waits for the
+        # results to arrive in the pipe of the result queue. The results sent
+        # through a ring buffer do not wake it up: poll instead, as the
+        # previous versions of Python did.
+        if timeout is None and any(isinstance(sentinel, _RingReader)
+                                   for sentinel in sentinels):
+            timeout = 0.1
+        Pool._wait_for_updates(sentinels, change_notifier, timeout=timeout)
+
+    @staticmethod
+    def _help_stuff_finish(inqueue, task_handler, size):
+        # Drain the messages without unpickling them: some are buffers sent
+        # out-of-band.
+        inqueue._rlock.acquire()
+        while task_handler.is_alive() and inqueue._reader.poll():
+            inqueue._reader.recv_bytes()
+            sleep(0)
+
 
 class MemmappingPool(PicklingPool):
     """Process pool that shares large arrays to avoid memory copy.
@@ -272,12 +555,26 @@ class MemmappingPool(PicklingPool):
         Make it possible to monitor how the communication of numpy arrays
         with the subprocess is handled (pickling or memmapping)
     prewarm: bool or str, optional, "auto" by default.
-        If True, force a read on newly memmapped array to make sure that OS
-        pre-cache it in memory. This can be useful to avoid concurrent disk
-        access when the same data array is passed to different worker
-        processes. If "auto" (by default), prewarm is set to True, unless the
-        Linux shared memory partition /dev/shm is available and used as temp
-        folder.
+        If True, make the OS pre-cache newly memmapped array in memory, with
+        a read ahead in the background where possible. This can be useful to
+        avoid concurrent disk access when the same data array is passed to
+        different worker processes. If "auto" (by default), prewarm is set to
+        True, unless the Linux shared memory partition /dev/shm is available
+        and used as temp folder.
+    results_max_nbytes int or None, optional, None by default
+        Threshold on the size of arrays returned by the workers above which
+        they are written to temp_folder by the workers and memory mapped by
+        the master process instead of being sent through pipes. Use None to
+        always send them through pipes. Not supported under Windows.
+    reuse_memmaps: bool, optional, False by default
+        If True, the files of the memmapped arrays are not deleted with the
+        pool temp folder: the next pools and Parallel calls of the process
+        reuse them for the same unchanged arrays, until these arrays are
+        garbage collected.
+    ring_buffer_nbytes: int or None, optional, None by default
+        Size of the ring buffers in shared memory through which the tasks
+        and results smaller than 4kB are sent instead of pipes. Use None to
+        send all of them through pipes. Not supported under Windows.
 
     `forward_reducers` and `backward_reducers` are expected to be
     dictionaries with key/values being `(type, callable)` pairs where
@@ -291,7 +588,8 @@ class MemmappingPool(PicklingPool):
 
     def __init__(self, processes=None, temp_folder=None, max_nbytes=1e6,
                  mmap_mode='r', forward_reducers=None, backward_reducers=None,
-                 verbose=0, context_id=None, prewarm=False, **kwargs):
+                 verbose=0, context_id=None, prewarm=False,
+                 results_max_nbytes=None, reuse_memmaps=False, **kwargs):
 
         if context_id is not None:
             warnings.warn('context_id is deprecated and ignored in joblib'
@@ -303,7 +601,8 @@ class MemmappingPool(PicklingPool):
                 id(self), temp_folder=temp_folder, max_nbytes=max_nbytes,
                 mmap_mode=mmap_mode, forward_reducers=forward_reducers,
                 backward_reducers=backward_reducers, verbose=verbose,
-                prewarm=prewarm)
+                prewarm=prewarm, results_max_nbytes=results_max_nbytes,
+                reuse_memmaps=reuse_memmaps)
 
         poolargs = dict(
             processes=processes,
@@ -326,4 +625,4 @@ class MemmappingPool(PicklingPool):
                     if i + 1 == n_retries:
                         warnings.warn("Failed to terminate worker processes in"
                                       " multiprocessing pool: %r" % e)
-        delete_folder(self._temp_folder)
+        delete_temp_folder(self._temp_folder)
@@ -0,0 +1,489 @@
+"""Pool of warm worker processes shared by the Parallel calls of processes.
+
+Running ``python -m joblib.pool_server /path/to/socket`` starts a daemon that
+keeps a loky executor alive and runs the batches of tasks sent over a Unix
+domain socket by the ``'pool_server'`` backend of any number of client
+processes::
+
+    with parallel_backend('pool_server', address='/path/to/socket'):
+        Parallel(n_jobs=-1)(delayed(func)(x) for x in data)
+
+All the clients share the ``max_workers`` workers of the daemon, so that the
+number of tasks running on the host stays bounded, and short lived scripts do
+not pay for starting the workers and importing the modules listed in
+``preload``. The batches are pickled by the clients and unpickled by the
+workers only: the daemon itself forwards bytes without looking into them.
+
+As the workers run any task they receive, the socket is only accessible to
+the owner of the daemon, and the clients must authenticate with a key that
+the daemon writes, readable by its owner only, to ``/path/to/socket.authkey``.
+"""
+# License: BSD 3 clause
+
+import os
+import sys
+import socket
+import argparse
+import itertools
+import functools
+import threading
+
+from ._multiprocessing_helpers import mp
+from ._compat import PY27
+from ._parallel_backends import ParallelBackendBase, SequentialBackend
+from ._parallel_backends import FallbackToBackend, LokyBackend, SafeFunction
+from .externals.cloudpickle import dumps, loads
+from .externals.loky._base import Future
+
+if mp is not None:
+    from multiprocessing.connection import Listener, Client
+    from multiprocessing.connection import answer_challenge
+    from multiprocessing.connection import deliver_challenge
+    from .externals.loky import cpu_count
+    from .externals.loky.reusable_executor import get_reusable_executor
+    from .externals.loky.process_executor import _ExceptionWithTraceback
+
+if PY27:
+    import Queue as queue
+else:
+    import queue
+
+
+def _shutdown(conn):
+    """Shut the socket of conn down, waking up the threads reading it"""
+    try:
+        sock = socket.fromfd(conn.fileno(), socket.AF_UNIX,
+                             socket.SOCK_STREAM)
+    except (IOError, OSError):
+        # The connection is already closed.
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except (IOError, OSError):
+        pass
+    finally:
+        sock.close()
+
+
+def _authkey_filename(address):
+    return address + '.authkey'
+
+
+def _write_authkey(address, authkey):
+    """Write authkey to a file of the owner only, next to the socket"""
+    filename = _authkey_filename(address)
+    try:
+        os.unlink(filename)
+    except OSError:
+        pass
+    # O_EXCL makes sure not to write to a file, or through a symlink, created
+    # by another user.
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(authkey)
+
+
+def _read_authkey(address):
+    """Key written by the pool server at address, or None"""
+    try:
+        with open(_authkey_filename(address), 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _preload_modules(modules):
+    """Initializer of the workers importing the modules to preload"""
+    for module in modules:
+        __import__(module)
+
+
+def _run_payload(payload):
+    """Run a pickled batch in a worker and return its pickled outcome.
+
+    The exceptions are pickled in the worker along with their traceback as
+    their class might not be importable in the daemon.
+    """
+    try:
+        return True, dumps(SafeFunction(loads(payload))())
+    except BaseException as e:
+        try:
+            exc = _ExceptionWithTraceback(e, sys.exc_info()[2])
+            return False, dumps(exc)
+        except Exception:
+            return False, dumps(RuntimeError(
+                'Failed to pickle the exception of a task: %r' % e))
+
+
+class PoolServer(object):
+    """Daemon serving a pool of workers to the clients of a Unix socket.
+
+    Parameters
+    ----------
+    address: str
+        Path of the Unix domain socket to listen on. Only the owner of the
+        daemon can connect to it.
+    max_workers: int or None
+        Number of workers, and thus maximum number of tasks of all the
+        clients running at the same time. Defaults to the number of CPUs.
+    preload: list of str
+        Names of the modules imported by the workers when they start.
+    authkey: bytes or None
+        Key the clients must use to connect. If None, a random key is
+        generated. In both cases, the key is written to the file
+        ``address + '.authkey'``, readable by the owner of the daemon only,
+        where the clients find it by default.
+    handshake_timeout: float
+        Number of seconds a client has to authenticate once connected. The
+        clients are authenticated by their own thread, so that a client slow
+        to authenticate does not prevent the others from connecting.
+    """
+
+    def __init__(self, address, max_workers=None, preload=(), authkey=None,
+                 handshake_timeout=10):
+        if mp is None:
+            raise ImportError('The pool server requires multiprocessing.')
+        self.address = address
+        self.max_workers = max_workers or cpu_count()
+        self.preload = tuple(preload)
+        self.handshake_timeout = handshake_timeout
+        if authkey is None:
+            authkey = os.urandom(32)
+        _write_authkey(address, authkey)
+        self._authkey = authkey
+        # Create the socket without any access for the group and the others,
+        # instead of restricting its permissions once it is listening. The
+        # listener does not authenticate the clients, _ClientConnection does.
+        umask = os.umask(0o177)
+        try:
+            self._listener = Listener(address, family='AF_UNIX')
+        finally:
+            os.umask(umask)
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _get_executor(self):
+        # The executor is started again if one of its workers crashed.
+        return get_reusable_executor(
+            self.max_workers, timeout=None, initializer=_preload_modules,
+            initargs=(self.preload,))
+
+    def serve_forever(self):
+        """Accept and serve the clients until ``close`` is called"""
+        # Start the workers and import the preloaded modules right away.
+        self._get_executor().submit(int).result()
+        while not self._closed:
+            try:
+                conn = self._listener.accept()
+            except (IOError, OSError, EOFError):
+                continue
+            with self._lock:
+                if self._closed:
+                    conn.close()
+                    break
+                client = _ClientConnection(self, conn)
+                self._clients.add(client)
+            client.start()
+
+    def submit(self, payload):
+        return self._get_executor().submit(_run_payload, payload)
+
+    def _client_closed(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def close(self):
+        """Stop accepting clients, disconnect the current ones and stop the
+        workers"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            clients = list(self._clients)
+        # Wake up serve_forever, blocked in accept.
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.address)
+        except (IOError, OSError):
+            pass
+        finally:
+            sock.close()
+        for client in clients:
+            client.close()
+        self._listener.close()
+        try:
+            os.unlink(_authkey_filename(self.address))
+        except OSError:
+            pass
+        self._get_executor().shutdown(kill_workers=True)
+
+
+class _ClientConnection(object):
+    """Tasks of a client of a PoolServer.
+
+    A thread receives the requests of the client and submits its tasks to the
+    executor while another one sends the results back, so that a client slow
+    to read its results does not block the executor.
+    """
+
+    def __init__(self, server, conn):
+        self.server = server
+        self.conn = conn
+        self._futures = dict()
+        self._lock = threading.Lock()
+        self._outbox = queue.Queue()
+
+    def start(self):
+        for target in (self._receive_requests, self._send_results):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def _authenticate(self):
+        """Run the handshake of multiprocessing.connection with the client.
+
+        The connection is shut down if the client does not complete it within
+        the handshake timeout of the server.
+        """
+        state = dict(authenticated=False)
+
+        def expire():
+            with self._lock:
+                if not state['authenticated']:
+                    _shutdown(self.conn)
+
+        timer = threading.Timer(self.server.handshake_timeout, expire)
+        timer.daemon = True
+        timer.start()
+        try:
+            deliver_challenge(self.conn, self.server._authkey)
+            answer_challenge(self.conn, self.server._authkey)
+        except (IOError, OSError, EOFError, mp.AuthenticationError):
+            return False
+        finally:
+            timer.cancel()
+        with self._lock:
+            state['authenticated'] = True
+        return True
+
+    def _receive_requests(self):
+        if not self._authenticate():
+            self.close()
+            self.conn.close()
+            return
+        while True:
+            try:
+                request = self.conn.recv()
+            except (IOError, OSError, EOFError):
+                break
+            if request[0] == 'info':
+                self._outbox.put(('info', self.server.max_workers))
+            elif request[0] == 'submit':
+                _, task_id, payload = request
+                future = self.server.submit(payload)
+                with self._lock:
+                    self._futures[task_id] = future
+                future.add_done_callback(
+                    functools.partial(self._task_done, task_id))
+            elif request[0] == 'cancel':
+                self._cancel(request[1])
+        # The client is gone: its pending tasks are not needed anymore.
+        with self._lock:
+            task_ids = list(self._futures)
+        self._cancel(task_ids)
+        self.close()
+        self.conn.close()
+
+    def _cancel(self, task_ids):
+        with self._lock:
+            futures = [self._futures.pop(task_id, None)
+                       for task_id in task_ids]
+        for future in futures:
+            if future is not None:
+                future.cancel()
+
+    def _task_done(self, task_id, future):
+        with self._lock:
+            if self._futures.pop(task_id, None) is None:
+                # The task was cancelled.
+                return
+        try:
+            success, data = future.result()
+        except BaseException as e:
+            # The executor failed, for instance because a worker crashed.
+            success, data = False, dumps(e)
+        self._outbox.put(('result', task_id, success, data))
+
+    def _send_results(self):
+        while True:
+            message = self._outbox.get()
+            if message is None:
+                break
+            try:
+                self.conn.send(message)
+            except (IOError, OSError):
+                break
+        _shutdown(self.conn)
+
+    def close(self):
+        self._outbox.put(None)
+        self.server._client_closed(self)
+
+
+class PoolServerBackend(ParallelBackendBase):
+    """Backend running the tasks in the workers of a PoolServer.
+
+    The daemon is reached at ``address`` or, if it is None, at the path
+    given by the JOBLIB_POOL_SERVER environment variable. If ``authkey`` is
+    None, the key written by the daemon next to its socket is used.
+    """
+
+    supports_timeout = True
+
+    def __init__(self, address=None, authkey=None, nesting_level=0):
+        super(PoolServerBackend, self).__init__(nesting_level=nesting_level)
+        if address is None:
+            address = os.environ.get('JOBLIB_POOL_SERVER')
+        if address is None:
+            raise ValueError('The pool_server backend requires the address '
+                             'of a running pool server: pass address=... or '
+                             'set the JOBLIB_POOL_SERVER environment '
+                             'variable.')
+        self.address = address
+        self.authkey = authkey
+        self._conn = None
+        self._futures = dict()
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._max_workers = None
+
+    def _connect(self):
+        with self._lock:
+            if self._conn is not None:
+                return
+            authkey = self.authkey
+            if authkey is None:
+                authkey = _read_authkey(self.address)
+            if authkey is None:
+                raise RuntimeError('No pool server key found at %r' %
+                                   _authkey_filename(self.address))
+            conn = Client(self.address, family='AF_UNIX', authkey=authkey)
+            conn.send(('info',))
+            _, self._max_workers = conn.recv()
+            # Each connection has its own tasks, failed if it is lost.
+            self._conn, self._futures = conn, dict()
+        thread = threading.Thread(target=self._receive_results,
+                                  args=(conn, self._futures))
+        thread.daemon = True
+        thread.start()
+
+    def effective_n_jobs(self, n_jobs):
+        if n_jobs == 0:
+            raise ValueError('n_jobs == 0 in Parallel has no meaning')
+        elif mp is None or n_jobs is None:
+            return 1
+        self._connect()
+        if n_jobs < 0:
+            n_jobs = max(self._max_workers + 1 + n_jobs, 1)
+        return min(n_jobs, self._max_workers)
+
+    def configure(self, n_jobs=1, parallel=None, **backend_args):
+        n_jobs = self.effective_n_jobs(n_jobs)
+        if n_jobs == 1:
+            raise FallbackToBackend(
+                SequentialBackend(nesting_level=self.nesting_level))
+        self.parallel = parallel
+        return n_jobs
+
+    def apply_async(self, func, callback=None):
+        future = Future()
+        future.get = functools.partial(LokyBackend.wrap_future_result, future)
+        if callback is not None:
+            future.add_done_callback(callback)
+        payload = dumps(func)
+        with self._lock:
+            if self._conn is None:
+                future.set_exception(self._connection_lost())
+                return future
+            task_id = next(self._task_ids)
+            self._futures[task_id] = future
+            self._conn.send(('submit', task_id, payload))
+        return future
+
+    def _connection_lost(self):
+        return RuntimeError('Lost the connection to the pool server at %r'
+                            % self.address)
+
+    def _receive_results(self, conn, futures):
+        while True:
+            try:
+                _, task_id, success, data = conn.recv()
+            except (IOError, OSError, EOFError):
+                break
+            with self._lock:
+                future = futures.pop(task_id, None)
+            if future is None:
+                continue
+            try:
+                outcome = loads(data)
+            except BaseException as e:
+                success, outcome = False, e
+            if success:
+                future.set_result(outcome)
+            else:
+                future.set_exception(outcome)
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+            lost_futures = list(futures.values())
+            futures.clear()
+        for future in lost_futures:
+            future.set_exception(self._connection_lost())
+        conn.close()
+
+    def abort_everything(self, ensure_ready=True):
+        """Cancel the tasks of this backend that did not complete yet"""
+        with self._lock:
+            task_ids = list(self._futures)
+            futures = [self._futures.pop(task_id) for task_id in task_ids]
+            if task_ids and self._conn is not None:
+                self._conn.send(('cancel', task_ids))
+        for future in futures:
+            future.cancel()
+
+    def terminate(self):
+        with self._lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            # The receiving thread closes the connection once it is shut
+            # down, and the server cancels the tasks still pending.
+            _shutdown(conn)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m joblib.pool_server',
+        description='Serve a pool of workers to the joblib Parallel calls '
+                    'of the processes using the pool_server backend.')
+    parser.add_argument('address', help='path of the Unix socket')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='number of workers, defaults to the number '
+                             'of CPUs')
+    parser.add_argument('--preload', action='append', default=[],
+                        metavar='MODULE',
+                        help='module imported by the workers when they '
+                             'start, can be repeated')
+    args = parser.parse_args(argv)
+    server = PoolServer(args.address, max_workers=args.max_workers,
+                        preload=args.preload)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""
+Test the runtime control of the thread pools of the C-libraries.
+"""
+
+# License: BSD 3 clause
+
+from joblib._clib_threads import get_libraries, get_thread_limits
+from joblib._clib_threads import limit_threads
+from joblib.test.common import np, with_numpy
+from joblib.testing import SkipTest
+
+
+@with_numpy
+def test_limit_threads():
+    libraries = get_libraries()
+    if not libraries:
+        raise SkipTest("numpy does not use a supported C-library")
+    assert all(lib.api in ('openblas', 'mkl', 'openmp') for lib in libraries)
+    original_limits = get_thread_limits()
+    with limit_threads(3):
+        assert set(get_thread_limits().values()) == set([3])
+        with limit_threads(2):
+            assert set(get_thread_limits().values()) == set([2])
+        assert set(get_thread_limits().values()) == set([3])
+    assert get_thread_limits() == original_limits
+    # numpy still works with the restored thread pools.
+    a = np.ones((100, 100))
+    np.testing.assert_array_equal(a.dot(a), 100 * a)
+
+
+def test_limit_threads_none():
+    original_limits = get_thread_limits()
+    with limit_threads(None):
+        assert get_thread_limits() == original_limits
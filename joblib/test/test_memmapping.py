@@ -3,7 +3,12 @@ import mmap
 import sys
 import platform
 import gc
+import threading
 import pickle
+import shutil
+import time
+
+import pytest
 
 from joblib.test.common import with_numpy, np
 from joblib.test.common import setup_autokill
@@ -12,12 +17,14 @@ from joblib.test.common import with_multiprocessing
 from joblib.test.common import with_dev_shm
 from joblib.testing import raises, parametrize, skipif
 from joblib.backports import make_memmap
-from joblib.parallel import Parallel, delayed
+from joblib.parallel import Parallel, delayed, mp, parallel_backend
 
-from joblib.pool import MemmappingPool
+from joblib.pool import MemmappingPool, CustomizablePicklingQueue
 from joblib.executor import _TestingMemmappingExecutor
 from joblib._memmapping_reducer import has_shareable_memory
 from joblib._memmapping_reducer import ArrayMemmapReducer
+from joblib._memmapping_reducer import ArrowBufferReducer
+from joblib._memmapping_reducer import delete_temp_folder
 from joblib._memmapping_reducer import reduce_memmap
 from joblib._memmapping_reducer import _strided_from_memmap
 from joblib._memmapping_reducer import _get_backing_memmap
@@ -45,6 +52,10 @@ def check_array(args):
     np.testing.assert_array_equal(data[position], expected)
 
 
+def _memmap_filename(a):
+    return a.filename
+
+
 def inplace_double(args):
     """Dummy helper function to be executed in subprocesses
 
@@ -207,6 +218,395 @@ def test__strided_from_memmap(tmpdir):
     assert _get_backing_memmap(memmap_backed_obj).offset == offset
 
 
+@with_numpy
+@parametrize("mmap_mode", ['r', 'r+', 'c'])
+def test_array_memmap_reducer_raw_files(tmpdir, mmap_mode):
+    reducer = ArrayMemmapReducer(40, tmpdir.strpath, mmap_mode, prewarm=True)
+    arrays = [np.arange(100, dtype=np.float64),
+              np.asfortranarray(np.arange(120).reshape(10, 12)),
+              np.arange(240, dtype='>i4').reshape(20, 12)[::2, 1::3],
+              np.zeros(10, dtype=[('a', np.int64), ('b', np.float32)])]
+    for i, a in enumerate(arrays):
+        func, args = reducer(a)
+        # The workers map the file without reading any header.
+        assert func is _strided_from_memmap
+        filename = args[0]
+        assert os.path.getsize(filename) == a.nbytes
+        b = func(*args)
+        assert isinstance(b, np.memmap)
+        assert b.mode == mmap_mode
+        assert b.dtype == a.dtype
+        assert np.isfortran(b) == np.isfortran(a)
+        np.testing.assert_array_equal(b, a)
+        # The same array is dumped only once.
+        assert reducer(a)[1][0] == filename
+        assert len(os.listdir(tmpdir.strpath)) == i + 1
+        del b
+
+
+@with_numpy
+def test_array_memmap_reducer_dump_in_chunks(tmpdir, monkeypatch):
+    monkeypatch.setattr(jmr, 'DUMP_CHUNK_NBYTES', 100)
+    monkeypatch.setattr(jmr, '_get_n_dump_threads', lambda: 4)
+    reducer = ArrayMemmapReducer(40, tmpdir.strpath, 'r', prewarm=True)
+    arrays = [np.arange(1000),
+              np.asfortranarray(np.arange(1200).reshape(10, 120)),
+              np.arange(2400).reshape(20, 120)[::2, 1::3],
+              # Not enough rows for the threads.
+              np.arange(1000).reshape(2, 500)]
+    for a in arrays:
+        func, args = reducer(a)
+        np.testing.assert_array_equal(func(*args), a)
+
+
+@with_numpy
+def test_fingerprint(monkeypatch):
+    monkeypatch.setattr(jmr, 'FINGERPRINT_N_BLOCKS', 3)
+    monkeypatch.setattr(jmr, 'FINGERPRINT_BLOCK_SIZE', 2)
+    a = np.arange(2400).reshape(20, 120)[::2, 1::3]
+    for b in [a, np.asfortranarray(a), np.float64(1), np.ones((3, 0))]:
+        order = 'F' if np.isfortran(b) else 'C'
+        assert jmr._fingerprint(b, order) == jmr._fingerprint(b.copy(), order)
+    # Only the first, middle and last pairs of items are sampled.
+    fingerprint = jmr._fingerprint(a, 'C')
+    b = a.copy()
+    b[0, 2] = b[9, 37] = -1
+    assert jmr._fingerprint(b, 'C') == fingerprint
+    for index in [(0, 1), (4, 39), (9, 38)]:
+        b = a.copy()
+        b[index] = -1
+        assert jmr._fingerprint(b, 'C') != fingerprint
+
+
+@with_numpy
+def test_array_memmap_reducer_registry(tmpdir, monkeypatch):
+    # Only 4 blocks of 10 items of the array are hashed.
+    monkeypatch.setattr(jmr, 'FINGERPRINT_N_BLOCKS', 4)
+    monkeypatch.setattr(jmr, 'FINGERPRINT_BLOCK_SIZE', 10)
+    fingerprints = []
+    fingerprint = jmr._fingerprint
+
+    def counting_fingerprint(*args):
+        fingerprints.append(None)
+        return fingerprint(*args)
+
+    monkeypatch.setattr(jmr, '_fingerprint', counting_fingerprint)
+    registry_folder = tmpdir.join('registry').strpath
+    pool_folders = [tmpdir.join(name).strpath for name in ['pool_1', 'pool_2']]
+    reducers = [ArrayMemmapReducer(40, folder, 'r',
+                                   registry_folder=registry_folder)
+                for folder in pool_folders]
+    a = np.asfortranarray(np.arange(1200, dtype=np.float64).reshape(10, 120))
+    a[0, 0] = np.nan
+
+    # The next reducers reuse the file of the unchanged array, checking its
+    # fingerprint once per call.
+    func, args = reducers[0](a)
+    filename = args[0]
+    assert os.path.dirname(filename) == registry_folder
+    for _ in range(3):
+        assert reducers[1](a)[1][0] == filename
+    assert len(fingerprints) == 2
+    np.testing.assert_array_equal(func(*args), a)
+
+    # The array is dumped again by the next call once modified in place.
+    a[:, 60:] = -1
+    assert reducers[0](a)[1][0] == filename
+    shutil.rmtree(pool_folders[0])
+    new_filename = reducers[0](a)[1][0]
+    assert new_filename != filename
+    assert not os.path.exists(filename)
+    np.testing.assert_array_equal(func(*reducers[0](a)[1]), a)
+    a.dtype = np.int64
+    assert reducers[0](a)[1][0] != new_filename
+
+    # The file is deleted along with the array.
+    filename = reducers[0](a)[1][0]
+    assert os.path.exists(filename)
+    del a
+    gc.collect()
+    assert not os.path.exists(filename)
+    assert not os.listdir(registry_folder)
+
+
+@with_numpy
+@with_multiprocessing
+@parametrize('backend', ['multiprocessing', 'loky'])
+def test_parallel_reuse_memmaps(backend):
+    a = np.arange(1000)
+    filenames = set()
+    for _ in range(2):
+        filenames.update(Parallel(n_jobs=2, backend=backend, max_nbytes='1K',
+                                  reuse_memmaps=True)(
+            delayed(_memmap_filename)(b) for b in [a] * 4))
+    # The file outlives the temporary folders of both calls.
+    assert len(filenames) == 1
+    filename = filenames.pop()
+    assert os.path.exists(filename)
+    del a
+    gc.collect()
+    assert not os.path.exists(filename)
+
+
+class _SparseLikeMatrix(object):
+    """Container of several numpy arrays, as a scipy.sparse matrix"""
+
+    def __init__(self, n):
+        self.data = np.ones(n)
+        self.indices = np.arange(n)
+        self.indptr = np.arange(3)
+
+
+def _shareable_buffers(m):
+    return [has_shareable_memory(getattr(m, name))
+            for name in ['data', 'indices', 'indptr']]
+
+
+def _shareable_columns(df):
+    return [has_shareable_memory(np.asarray(df[name])) for name in df.columns]
+
+
+@with_numpy
+@with_multiprocessing
+@parametrize('backend', ['multiprocessing', 'loky'])
+def test_memmapping_container_buffers(backend):
+    # The arrays of the containers are memmapped by the ndarray reducer.
+    m = _SparseLikeMatrix(1000)
+    results = Parallel(n_jobs=2, backend=backend, max_nbytes=100)(
+        delayed(_shareable_buffers)(m) for _ in range(2))
+    assert results == [[True, True, False]] * 2
+
+
+@with_numpy
+@with_multiprocessing
+def test_memmapping_sparse_matrix_and_dataframe():
+    sparse = pytest.importorskip('scipy.sparse')
+    pd = pytest.importorskip('pandas')
+    m = sparse.random(100, 100, density=0.5, format='csr')
+    results = Parallel(n_jobs=2, max_nbytes=100)(
+        delayed(_shareable_buffers)(m) for _ in range(2))
+    assert results == [[True, True, True]] * 2
+
+    df = pd.DataFrame({'a': np.arange(1000.), 'b': np.ones(1000)})
+    results = Parallel(n_jobs=2, max_nbytes=100)(
+        delayed(_shareable_columns)(df) for _ in range(2))
+    assert results == [[True, True]] * 2
+
+
+@with_numpy
+def test_arrow_buffer_reducer(tmpdir):
+    pa = pytest.importorskip('pyarrow')
+    forward_reducers, _, folder = jmr.get_memmapping_reducers(
+        0, temp_folder=tmpdir.strpath, max_nbytes=100)
+    reducer = forward_reducers[pa.Buffer]
+    assert isinstance(reducer, ArrowBufferReducer)
+
+    def dumped_files():
+        return [name for name in os.listdir(folder) if name.endswith('.mmap')]
+
+    a = pa.array(np.arange(1000))
+    func, args = reducer(a.buffers()[1])
+    assert func(*args).equals(a.buffers()[1])
+    # Each access to the buffers of a creates new buffer objects.
+    reducer(a.buffers()[1])
+    assert len(dumped_files()) == 1
+
+    func, args = reducer(pa.py_buffer(b'small'))
+    assert func(*args).to_pybytes() == b'small'
+    assert len(dumped_files()) == 1
+
+    # The buffers are released at the end of the call.
+    delete_temp_folder(folder)
+    assert not reducer._views
+    reducer(a.buffers()[1])
+    assert len(dumped_files()) == 1
+
+
+def _arrow_column_sum(table):
+    return sum(table.column('x').to_pylist())
+
+
+@with_numpy
+@with_multiprocessing
+def test_parallel_arrow_table():
+    pa = pytest.importorskip('pyarrow')
+    table = pa.Table.from_arrays([pa.array(np.arange(1000))], names=['x'])
+    results = Parallel(n_jobs=2, max_nbytes=100)(
+        delayed(_arrow_column_sum)(table) for _ in range(2))
+    assert results == [sum(range(1000))] * 2
+
+
+@with_numpy
+@skipif(not hasattr(os, 'mkfifo'), reason='Named pipes are not available')
+def test_temporary_memmap_reference_counting(tmpdir):
+    folder = tmpdir.join('pool').strpath
+    tracker = jmr._get_tracker(folder)
+    reducer = ArrayMemmapReducer(0, folder, 'r', tracker=tracker)
+    a = np.arange(10)
+
+    func, args = reducer(a)
+    filename = args[1]
+    b = func(*args)
+    # b sent back to the parent process by a worker.
+    func_view, args_view = reduce_memmap(b[2:])
+    assert func_view is func
+    assert args_view[1] == filename
+    del b
+    gc.collect()
+    assert os.path.exists(filename)
+    c = func_view(*args_view)
+    np.testing.assert_array_equal(c, a[2:])
+    del c
+    gc.collect()
+    # All the references were released.
+    assert not os.path.exists(filename)
+
+    # The file is dumped again when needed.
+    func, args = reducer(a)
+    assert args[1] == filename
+    assert os.path.exists(filename)
+
+    # The parent process owns the files of the results of the workers.
+    backward_reducer = ArrayMemmapReducer(0, folder, 'r+', backward=True)
+    func, args = backward_reducer(np.arange(10))
+    filename = args[0]
+    c = func(*args)
+    assert c.mode == 'r+'
+    del c
+    gc.collect()
+    assert not os.path.exists(filename)
+
+
+def _count_memmap_files(a):
+    time.sleep(0.01)
+    return sum(name.endswith('.mmap')
+               for name in os.listdir(os.path.dirname(a.filename)))
+
+
+@with_numpy
+@with_multiprocessing
+@skipif(not hasattr(os, 'mkfifo'), reason='Named pipes are not available')
+@parametrize('backend', ['multiprocessing', 'loky'])
+def test_memmap_files_deleted_during_call(backend, tmpdir):
+    # The files of the arrays of the completed tasks are deleted before the
+    # end of the call.
+    n_files = Parallel(n_jobs=2, max_nbytes=0, backend=backend, batch_size=1,
+                       temp_folder=tmpdir.strpath)(
+        delayed(_count_memmap_files)(np.full(100, i)) for i in range(40))
+    assert max(n_files) < 20
+
+
+def _reduce_complex(value):
+    return complex, (value.real + 1, value.imag)
+
+
+@with_multiprocessing
+def test_pickling_queue_messages():
+    # The pickler reused for successive messages applies the reducers and
+    # does not share its memo between the messages.
+    queue = CustomizablePicklingQueue(mp, reducers={complex: _reduce_complex})
+    shared = [1j, 'a']
+    for _ in range(3):
+        queue.put((shared, shared))
+    queue.put(list(range(1000)))
+    queue.put(shared)
+    for _ in range(3):
+        first, second = queue.get()
+        assert first == [1 + 1j, 'a']
+        assert first is second
+    assert queue.get() == list(range(1000))
+    assert queue.get() == [1 + 1j, 'a']
+
+
+@with_multiprocessing
+@skipif(sys.platform == 'win32', reason='Requires locked queues')
+def test_pickling_queue_ring_buffer():
+    # Two slots: the writer waits for the reader to free them.
+    queue = CustomizablePicklingQueue(mp, reducers={complex: _reduce_complex},
+                                      ring_buffer_nbytes=8192)
+    filename = queue._ring.filename
+    messages = [(i, 'x' * (10000 if i % 3 == 0 else 10)) for i in range(20)]
+    messages.append(1j)
+    thread = threading.Thread(target=lambda: [queue.put(message)
+                                              for message in messages])
+    thread.start()
+    # The small messages go through the ring buffer and the larger ones
+    # through the pipe, in order.
+    assert [queue.get() for _ in messages] == messages[:-1] + [1 + 1j]
+    thread.join()
+    assert queue.empty()
+    queue.close()
+    assert not os.path.exists(filename)
+
+
+def _square_and_pad(x, padding):
+    return x ** 2, len(padding)
+
+
+@with_multiprocessing
+@skipif(sys.platform == 'win32', reason='Requires locked queues')
+def test_pool_ring_buffer(tmpdir):
+    pool = MemmappingPool(2, temp_folder=tmpdir.strpath,
+                          ring_buffer_nbytes=16384)
+    filenames = [pool._inqueue._ring.filename, pool._outqueue._ring.filename]
+    try:
+        results = [pool.apply_async(_square_and_pad,
+                                    (x, 'x' * (x % 2) * 10000))
+                   for x in range(100)]
+        assert [r.get() for r in results] == [
+            (x ** 2, (x % 2) * 10000) for x in range(100)]
+    finally:
+        pool.terminate()
+    assert not any(os.path.exists(filename) for filename in filenames)
+
+    with parallel_backend('multiprocessing', ring_buffer_nbytes=16384):
+        assert Parallel(n_jobs=2)(
+            delayed(_square_and_pad)(x, '') for x in range(10)) == [
+                (x ** 2, 0) for x in range(10)]
+
+
+@with_multiprocessing
+@skipif(pickle.HIGHEST_PROTOCOL < 5 or sys.platform == 'win32',
+        reason='Requires the pickle protocol 5 and locked queues')
+def test_pickling_queue_out_of_band_buffers():
+    queue = CustomizablePicklingQueue(mp, reducers={complex: _reduce_complex})
+    large = bytearray(b'a' * 100000)
+
+    def put():
+        queue.put(([pickle.PickleBuffer(large),
+                    pickle.PickleBuffer(b'small')], 1j))
+        queue.put('next')
+
+    # The messages do not fit in the buffer of the pipe.
+    thread = threading.Thread(target=put)
+    thread.start()
+    (buffers, value) = queue.get()
+    # The large buffer was sent as a separate message, read in a writable
+    # bytearray, and the small one pickled in the stream.
+    assert isinstance(buffers[0], bytearray) and buffers[0] == large
+    assert bytes(buffers[1]) == b'small'
+    assert value == 1 + 1j
+    assert queue.get() == 'next'
+    thread.join()
+
+
+@with_numpy
+@with_multiprocessing
+@skipif(pickle.HIGHEST_PROTOCOL < 5, reason='Requires the pickle protocol 5')
+def test_pool_out_of_band_arrays(tmpdir):
+    # Arrays below max_nbytes are sent out-of-band and arrive writable.
+    pool = MemmappingPool(2, max_nbytes=10 * 1024 ** 2,
+                          temp_folder=tmpdir.strpath)
+    try:
+        a = np.arange(1e5)
+        b = pool.apply_async(np.multiply, (a, 2)).get()
+        np.testing.assert_array_equal(b, a * 2)
+        b[0] = 1
+        assert not os.listdir(tmpdir.strpath)
+    finally:
+        pool.terminate()
+
+
 @with_numpy
 @with_multiprocessing
 @parametrize("factory", [MemmappingPool, _TestingMemmappingExecutor],
@@ -333,8 +733,9 @@ def test_memmapping_pool_for_large_arrays(factory, tmpdir):
         # The data has been dumped in a temp folder for subprocess to share it
         # without per-child memory copies
         assert os.path.isdir(p._temp_folder)
-        dumped_filenames = os.listdir(p._temp_folder)
-        assert len(dumped_filenames) == 1
+        filenames = p.map(_memmap_filename, [large] * 10)
+        assert len(set(filenames)) == 1
+        assert os.path.dirname(filenames[0]) == p._temp_folder
 
         # Check that memory mapping is not triggered for arrays with
         # dtype='object'
@@ -401,19 +802,22 @@ def test_memmapping_on_large_enough_dev_shm(factory):
             # Try with a file larger than the memmap threshold of 10 bytes
             a = np.ones(100, dtype=np.float64)
             assert a.nbytes == 800
-            p.map(id, [a] * 10)
-            # a should have been memmapped to the pool temp folder: the joblib
-            # pickling procedure generate one .pkl file:
-            assert len(os.listdir(pool_temp_folder)) == 1
+            a_filenames = set(p.map(_memmap_filename, [a] * 10))
+            # a should have been memmapped to the pool temp folder: the raw
+            # buffer of the array is written to a single file:
+            assert len(a_filenames) == 1
+            assert os.path.dirname(next(iter(a_filenames))) == (
+                pool_temp_folder)
 
             # create a new array with content that is different from 'a' so
             # that it is mapped to a different file in the temporary folder of
             # the pool.
             b = np.ones(100, dtype=np.float64) * 2
             assert b.nbytes == 800
-            p.map(id, [b] * 10)
-            # A copy of both a and b are now stored in the shared memory folder
-            assert len(os.listdir(pool_temp_folder)) == 2
+            b_filenames = set(p.map(_memmap_filename, [b] * 10))
+            # b is stored in another file of the shared memory folder
+            assert len(b_filenames) == 1
+            assert b_filenames.isdisjoint(a_filenames)
         finally:
             # Cleanup open file descriptors
             p.terminate()
@@ -479,6 +883,44 @@ def test_memmapping_pool_for_large_arrays_in_return(factory, tmpdir):
         del p
 
 
+@with_numpy
+@with_multiprocessing
+@skipif(sys.platform == 'win32', reason='Not supported under Windows')
+@parametrize("factory", [MemmappingPool, _TestingMemmappingExecutor],
+             ids=["multiprocessing", "loky"])
+def test_memmapping_pool_for_large_arrays_in_return_memmapped(factory,
+                                                              tmpdir):
+    p = factory(3, max_nbytes=10, temp_folder=tmpdir.strpath,
+                results_max_nbytes=100)
+    try:
+        small = p.apply_async(np.ones, args=(10,)).get()
+        assert not has_shareable_memory(small)
+
+        large = p.apply_async(np.ones, args=(1000,)).get()
+        assert isinstance(large, np.memmap)
+        assert os.path.dirname(large.filename) == p._temp_folder
+        np.testing.assert_array_equal(large, np.ones(1000))
+        # The results are writable.
+        large[:] = 2
+    finally:
+        p.terminate()
+        del p
+
+
+@with_numpy
+@with_multiprocessing
+@skipif(sys.platform == 'win32', reason='Not supported under Windows')
+@parametrize('backend', ['multiprocessing', 'loky'])
+def test_parallel_memmapped_results(backend):
+    results = Parallel(n_jobs=2, backend=backend, results_max_nbytes='1K')(
+        delayed(np.full)(1000, i) for i in range(4))
+    # The results outlive the temporary folder of the call.
+    for i, a in enumerate(results):
+        assert has_shareable_memory(a)
+        assert not os.path.exists(a.filename)
+        np.testing.assert_array_equal(a, np.full(1000, i))
+
+
 def _worker_multiply(a, n_times):
     """Multiplication function to be executed by subprocess"""
     assert has_shareable_memory(a)
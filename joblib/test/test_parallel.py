@@ -7,6 +7,7 @@ Test the parallel module.
 # License: BSD Style, 3 clauses.
 
 import os
+import json
 import sys
 import time
 import mmap
@@ -66,7 +67,7 @@ from joblib._parallel_backends import ParallelBackendBase
 from joblib._parallel_backends import LokyBackend
 from joblib._parallel_backends import SafeFunction
 
-from joblib.parallel import Parallel, delayed
+from joblib.parallel import Parallel, delayed, shared
 from joblib.parallel import register_parallel_backend, parallel_backend
 from joblib.parallel import effective_n_jobs, cpu_count
 
@@ -860,6 +861,33 @@ def test_no_blas_crash_or_freeze_with_subprocesses(backend):
         delayed(np.dot)(a, a.T) for i in range(2))
 
 
+_reused_result = []
+
+
+def _fill_reused_result(value):
+    # Return the same array, modified in place, for all the tasks run by a
+    # worker.
+    if not _reused_result:
+        _reused_result.append(np.empty(1000))
+    _reused_result[0][:] = value
+    return _reused_result[0]
+
+
+@with_numpy
+@with_multiprocessing
+@skipif(sys.platform == 'win32', reason='Not supported under Windows')
+@parametrize('backend', PROCESS_BACKENDS)
+def test_memmapped_results_of_reused_array(backend):
+    results = Parallel(n_jobs=2, backend=backend, batch_size=1,
+                       results_max_nbytes='1K')(
+        delayed(_fill_reused_result)(i) for i in range(6))
+    for i, a in enumerate(results):
+        assert isinstance(a, np.memmap)
+        np.testing.assert_array_equal(a, np.full(1000, i))
+    # Each result has its own file.
+    assert len(set(a.filename for a in results)) == 6
+
+
 UNPICKLABLE_CALLABLE_SCRIPT_TEMPLATE_NO_MAIN = """\
 from joblib import Parallel, delayed
 
@@ -1434,6 +1462,848 @@ def test_parallel_thread_limit(backend):
     res = Parallel(n_jobs=2, backend=backend)(
         delayed(_run_parallel_sum)() for _ in range(2)
     )
+    # Each of the 2 workers gets half of the cores.
+    n_threads = max(cpu_count() // 2, 1)
     for value in res[0][0].values():
-        assert value == '1'
-    assert all([r[1] == 1 for r in res])
+        assert value == str(n_threads)
+    assert all([r[1] == n_threads for r in res])
+
+
+@parametrize('backend', ['sequential'] + PARALLEL_BACKENDS)
+@parametrize('pre_dispatch', ['all', '2 * n_jobs'])
+def test_parallel_callback_events(backend, pre_dispatch):
+    events = []
+    lock = threading.Lock()
+
+    def callback(event):
+        with lock:
+            events.append(event)
+
+    n_tasks = 10
+    results = Parallel(n_jobs=2, backend=backend, batch_size=2,
+                       pre_dispatch=pre_dispatch, callback=callback)(
+        delayed(square)(i) for i in range(n_tasks))
+    assert results == [square(i) for i in range(n_tasks)]
+
+    dispatched = [e for e in events if e['event'] == 'batch_dispatched']
+    completed = [e for e in events if e['event'] == 'batch_completed']
+    assert len(dispatched) == len(completed) == n_tasks // 2
+    assert (sorted(e['batch_index'] for e in completed) ==
+            list(range(n_tasks // 2)))
+    assert all(e['batch_size'] == 2 for e in events)
+    assert max(e['n_completed_tasks'] for e in completed) == n_tasks
+    assert all(e['queue_depth'] >= 0 for e in events)
+    assert all(e['duration'] >= 0 for e in completed)
+    if backend != 'sequential':
+        # Sequential runs do not report on the worker executing the batches.
+        assert all(e['worker_id'] is not None for e in completed)
+        assert all(e['compute_duration'] >= 0 for e in completed)
+    if backend in PROCESS_BACKENDS:
+        worker_pids = set(int(e['worker_id'].split('-')[0])
+                          for e in completed)
+        assert os.getpid() not in worker_pids
+    # The total number of tasks is only known once the input iterator has
+    # been fully consumed.
+    assert all(e['n_total_tasks'] in (None, n_tasks) for e in events)
+
+
+def test_invalid_parallel_callback():
+    with raises(ValueError, match="callback must be callable"):
+        Parallel(callback='not a callable')
+
+
+@parametrize('backend', ['sequential'] + PARALLEL_BACKENDS)
+def test_parallel_profile(backend, tmpdir):
+    p = Parallel(n_jobs=2, backend=backend, batch_size=2, profile=True)
+    assert p.last_profile is None
+    results = p(delayed(square)(i) for i in range(10))
+    assert results == [square(i) for i in range(10)]
+
+    summary = p.last_profile.summary()
+    assert summary['n_batches'] == 5
+    assert summary['n_tasks'] == 10
+    assert summary['wall_time'] > 0
+    assert 0 <= summary['overhead_ratio'] <= 1
+    phases = summary['phases']
+    for phase in ['dispatch', 'compute']:
+        assert phases[phase]['count'] == 5
+    if backend in PROCESS_BACKENDS:
+        for phase in ['pickle', 'transfer', 'unpickle', 'result_pickle',
+                      'result_transfer', 'result_unpickle']:
+            assert phases[phase]['count'] == 5
+    else:
+        assert 'pickle' not in phases
+    for stats in phases.values():
+        assert 0 <= stats['p50'] <= stats['p90'] <= stats['p99']
+        assert stats['p99'] <= stats['max'] <= stats['total']
+
+    filename = tmpdir.join('trace.json').strpath
+    trace = p.last_profile.to_chrome_trace(filename)
+    with open(filename) as f:
+        assert json.load(f) == trace
+    compute_events = [e for e in trace['traceEvents']
+                      if e['name'] == 'compute']
+    assert len(compute_events) == 5
+    if backend in PROCESS_BACKENDS:
+        assert all(e['pid'] != os.getpid() for e in compute_events)
+
+
+def test_profile_mark_pickling():
+    from joblib._profiling import ProfileMark
+    mark = ProfileMark()
+    received = pickle.loads(pickle.dumps(mark))
+    assert received.sent == mark.sent
+    assert received.received >= received.sent
+    # Delivered marks are sent back without being stamped again.
+    sent_back = pickle.loads(pickle.dumps(received))
+    assert sent_back.sent == received.sent
+    assert sent_back.received == received.received
+
+
+def _get_id_and_pid(obj, x):
+    return id(obj), os.getpid(), obj['value'] + x
+
+
+@parametrize('backend', ['sequential'] + PARALLEL_BACKENDS)
+def test_shared_argument(backend):
+    obj = {'value': 1}
+    results = Parallel(n_jobs=2, backend=backend, batch_size=1)(
+        delayed(_get_id_and_pid)(shared(obj), x=i) for i in range(10))
+    assert [r[2] for r in results] == [i + 1 for i in range(10)]
+    if backend in PROCESS_BACKENDS:
+        # The shared argument is loaded once in each worker and reused for
+        # the following batches.
+        ids_by_pid = {}
+        for obj_id, pid, _ in results:
+            ids_by_pid.setdefault(pid, set()).add(obj_id)
+        assert all(len(ids) == 1 for ids in ids_by_pid.values())
+    else:
+        assert all(r[0] == id(obj) for r in results)
+
+
+@with_multiprocessing
+@parametrize('backend', PROCESS_BACKENDS)
+def test_auto_share_common_arguments(backend, monkeypatch):
+    from joblib._memmapping_reducer import SharedArgumentReducer
+    n_dumps = []
+    original_call = SharedArgumentReducer.__call__
+
+    def counting_call(self, shared_argument):
+        if shared_argument not in n_dumps:
+            n_dumps.append(shared_argument)
+        return original_call(self, shared_argument)
+    monkeypatch.setattr(SharedArgumentReducer, '__call__', counting_call)
+
+    obj = {'value': 2}
+    p = Parallel(n_jobs=2, backend=backend, batch_size=1, auto_share=True)
+    results = p(delayed(_get_id_and_pid)(obj, i) for i in range(10))
+    assert [r[2] for r in results] == [i + 2 for i in range(10)]
+    # Only obj is reused across batches.
+    assert len(n_dumps) == 1
+    assert n_dumps[0].obj is obj
+
+
+def test_shared_is_idempotent():
+    obj = [1, 2]
+    wrapped = shared(obj)
+    assert shared(wrapped) is wrapped
+    assert wrapped.obj is obj
+
+
+@parametrize('backend', ['sequential'] + PARALLEL_BACKENDS)
+@parametrize('batch_size', [1, 3, 'auto'])
+def test_parallel_map(backend, batch_size):
+    p = Parallel(n_jobs=2, backend=backend, batch_size=batch_size)
+    assert p.map(square, range(10)) == [square(i) for i in range(10)]
+    assert (p.map(f, range(10), range(0, 20, 2)) ==
+            [f(x, y) for x, y in zip(range(10), range(0, 20, 2))])
+    assert p.starmap(f, [(1,), (2, 3), (4, 5, 6)]) == [1, 7, 27]
+    assert p.map(square, []) == []
+    assert len(p.starmap(os.getpid, [()] * 3)) == 3
+    # The regular call API is still usable after map.
+    assert p(delayed(square)(i) for i in range(3)) == [0, 1, 4]
+
+
+@with_multiprocessing
+@parametrize('backend', PROCESS_BACKENDS)
+def test_parallel_map_interactively_defined_function(backend):
+    def local_square(x):
+        return x ** 2
+
+    assert (Parallel(n_jobs=2, backend=backend).map(local_square, range(5)) ==
+            [square(i) for i in range(5)])
+    # Interactively defined functions as arguments.
+    assert (Parallel(n_jobs=2, backend=backend).starmap(
+        lambda func, x: func(x), [(local_square, i) for i in range(5)]) ==
+        [square(i) for i in range(5)])
+
+
+def test_parallel_map_exception():
+    with raises(ValueError):
+        Parallel(n_jobs=2, backend='threading').map(exception_raiser,
+                                                    range(10))
+
+
+def test_mapped_calls_pickling():
+    from joblib.parallel import MappedCalls
+    batch = MappedCalls(f, [(1, 2), (3, 4)], SequentialBackend())
+    assert batch.items == [(f, (1, 2), {}), (f, (3, 4), {})]
+    unpickled = pickle.loads(pickle.dumps(batch))
+    assert unpickled() == [f(1, 2), f(3, 4)]
+    assert len(unpickled) == 2
+
+    no_args = MappedCalls(os.getpid, [(), ()], SequentialBackend())
+    assert pickle.loads(pickle.dumps(no_args))() == [os.getpid()] * 2
+
+
+def _add_columns(xs, ys):
+    return [x + y for x, y in zip(xs, ys)]
+
+
+def _batch_norms(rows):
+    assert rows.ndim == 2
+    return np.sqrt((rows ** 2).sum(axis=1))
+
+
+@parametrize('backend', ['sequential'] + PARALLEL_BACKENDS)
+@parametrize('batch_size', [1, 4, 'auto'])
+def test_parallel_map_batches(backend, batch_size):
+    p = Parallel(n_jobs=2, backend=backend, batch_size=batch_size)
+    assert (p.map_batches(_add_columns, range(10), range(10)) ==
+            [2 * i for i in range(10)])
+    assert p.map_batches(_add_columns, [], []) == []
+
+
+@with_numpy
+@parametrize('backend', ['sequential'] + PARALLEL_BACKENDS)
+def test_parallel_map_batches_stack(backend):
+    rows = np.arange(30.).reshape(10, 3)
+    results = Parallel(n_jobs=2, backend=backend, batch_size=3).map_batches(
+        _batch_norms, rows, stack=True)
+    np.testing.assert_allclose(results, np.sqrt((rows ** 2).sum(axis=1)))
+
+
+def test_parallel_map_batches_errors():
+    p = Parallel(n_jobs=2, backend='threading', batch_size=2)
+    with raises(ValueError, match="returned 1 results for a batch of 2"):
+        p.map_batches(lambda xs: xs[:1], range(4))
+    with raises(TypeError, match="unexpected keyword arguments"):
+        p.map_batches(_add_columns, range(4), range(4), stak=True)
+
+
+def _run_in_new_loop(func):
+    import asyncio
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return func(loop)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+@skipif(not PY3_OR_LATER, reason='asyncio requires Python 3')
+@parametrize('backend', ['sequential'] + PARALLEL_BACKENDS)
+def test_parallel_acall(backend):
+    def run(loop):
+        p = Parallel(n_jobs=2, backend=backend, pre_dispatch='2 * n_jobs')
+        ticks = []
+
+        def tick():
+            ticks.append(None)
+            loop.call_later(0.01, tick)
+        loop.call_soon(tick)
+        results = loop.run_until_complete(
+            p.acall(delayed(square)(i) for i in range(20)))
+        assert results == [i ** 2 for i in range(20)]
+        assert loop.run_until_complete(p.acall([])) == []
+        return ticks
+
+    ticks = _run_in_new_loop(run)
+    assert len(ticks) > 0
+
+
+@skipif(not PY3_OR_LATER, reason='asyncio requires Python 3')
+@parametrize('backend', ['sequential'] + PARALLEL_BACKENDS)
+def test_parallel_aiter(backend):
+    def run(loop):
+        p = Parallel(n_jobs=2, backend=backend, batch_size=2)
+        iterator = p.aiter(delayed(square)(i) for i in range(7))
+        assert iterator.__aiter__() is iterator
+        results = []
+        while True:
+            try:
+                results.append(loop.run_until_complete(iterator.__anext__()))
+            except StopAsyncIteration:  # noqa: F821
+                return results
+
+    assert _run_in_new_loop(run) == [i ** 2 for i in range(7)]
+
+
+@skipif(not PY3_OR_LATER, reason='asyncio requires Python 3')
+@parametrize('backend', ['sequential'] + PARALLEL_BACKENDS)
+def test_parallel_acall_exception(backend):
+    def run(loop):
+        p = Parallel(n_jobs=2, backend=backend)
+        with raises(ZeroDivisionError):
+            loop.run_until_complete(
+                p.acall(delayed(division)(1, i) for i in range(-3, 3)))
+        # The instance can be used again after the failure.
+        assert loop.run_until_complete(
+            p.acall(delayed(square)(i) for i in range(3))) == [0, 1, 4]
+
+    _run_in_new_loop(run)
+
+
+@skipif(not PY3_OR_LATER, reason='asyncio requires Python 3')
+def test_parallel_acall_cancel():
+    def run(loop):
+        import asyncio
+        p = Parallel(n_jobs=2, backend='threading')
+        with raises(asyncio.TimeoutError):
+            loop.run_until_complete(asyncio.wait_for(
+                p.acall(delayed(sleep)(.1) for _ in range(100)), .2))
+        assert p._async_call is None
+        assert p.n_completed_tasks < 100
+
+    _run_in_new_loop(run)
+
+
+def _big_output(i, delay):
+    sleep(delay)
+    return b'x' * int(1e6)
+
+
+@parametrize('max_inflight_bytes', [None, '3M'])
+def test_max_inflight_bytes(max_inflight_bytes):
+    # The first task is slow: the results of the following ones cannot be
+    # retrieved before it completes.
+    peak = []
+
+    def callback(info):
+        peak.append(p._total_inflight_nbytes)
+
+    p = Parallel(n_jobs=2, backend='threading', batch_size=1,
+                 callback=callback, max_inflight_bytes=max_inflight_bytes)
+    results = p(delayed(_big_output)(i, .5 if i == 0 else 0)
+                for i in range(30))
+    assert len(results) == 30
+    if max_inflight_bytes is None:
+        assert max(peak) == 0
+    else:
+        # Without budget, the 29 fast results would pile up.
+        assert max(peak) < 6e6
+        assert p._total_inflight_nbytes == 0
+
+
+def test_max_inflight_bytes_estimates():
+    assert parallel._estimate_nbytes(b'x' * 1000) == 1000
+    assert parallel._estimate_nbytes([b'x' * 1000] * 3) > 3000
+    if np is not None:
+        assert parallel._estimate_nbytes(np.ones(100)) == 800
+
+
+@skipif(not PY3_OR_LATER, reason='asyncio requires Python 3')
+def test_max_inflight_bytes_aiter():
+    def run(loop):
+        p = Parallel(n_jobs=2, backend='threading', batch_size=1,
+                     max_inflight_bytes=int(2e6))
+        iterator = p.aiter(delayed(_big_output)(i, 0) for i in range(10))
+        n_results = 0
+        while True:
+            try:
+                loop.run_until_complete(iterator.__anext__())
+            except StopAsyncIteration:  # noqa: F821
+                return n_results
+            n_results += 1
+            assert p.n_dispatched_tasks - n_results <= 4
+
+    assert _run_in_new_loop(run) == 10
+
+
+def test_lookahead_dispatches_by_priority():
+    executed = []
+
+    def record(i):
+        executed.append(i)
+        return i ** 2
+
+    priorities = [1, 5, 3, 0, 4, 2]
+    results = Parallel(n_jobs=1, batch_size=1, lookahead=3)(
+        delayed(record, priority=p)(i) for i, p in enumerate(priorities))
+    assert results == [i ** 2 for i in range(6)]
+    assert executed == [1, 2, 4, 5, 0, 3]
+
+
+@parametrize('backend', PARALLEL_BACKENDS)
+@parametrize('batch_size', [1, 3, 'auto'])
+def test_lookahead_preserves_results_order(backend, batch_size):
+    p = Parallel(n_jobs=2, backend=backend, batch_size=batch_size,
+                 lookahead=7)
+    results = p(delayed(square, priority=(i * 7) % 11)(i) for i in range(50))
+    assert results == [i ** 2 for i in range(50)]
+    # Tasks without priority are dispatched in order.
+    assert p(delayed(square)(i) for i in range(10)) == [
+        i ** 2 for i in range(10)]
+
+
+def test_invalid_lookahead():
+    for lookahead in [0, -1, 'auto']:
+        with raises(ValueError, match='lookahead must be'):
+            Parallel(lookahead=lookahead)
+
+
+def test_prioritized_task_pickling():
+    task = delayed(square, priority=3)(2)
+    assert task == (square, (2,), {}) and task.priority == 3
+    assert type(pickle.loads(pickle.dumps(task))) is tuple
+
+
+def _fail_first_attempt(x, flag_folder, failure='raise'):
+    flag = os.path.join(flag_folder, str(x))
+    if not os.path.exists(flag):
+        open(flag, 'w').close()
+        if failure == 'raise':
+            raise ValueError('transient failure')
+        elif failure == 'crash':
+            os._exit(1)
+        else:
+            sleep(failure)
+    return x ** 2
+
+
+@parametrize('backend', PARALLEL_BACKENDS)
+def test_retries(tmpdir, backend):
+    # The retries are counted by batch: use one task per batch.
+    p = Parallel(n_jobs=2, backend=backend, batch_size=1, retries=1,
+                 retry_backoff=0)
+    results = p(delayed(_fail_first_attempt)(i, tmpdir.strpath)
+                for i in range(6))
+    assert results == [i ** 2 for i in range(6)]
+
+    flag_folder = tmpdir.mkdir('no_retries').strpath
+    p = Parallel(n_jobs=2, backend=backend, retries=0)
+    with raises(ValueError, match='transient failure'):
+        p(delayed(_fail_first_attempt)(i, flag_folder) for i in range(6))
+
+
+@with_multiprocessing
+def test_retries_after_worker_crash(tmpdir):
+    p = Parallel(n_jobs=2, backend='loky', batch_size=1, retries=3,
+                 retry_backoff=0)
+    results = p(delayed(_fail_first_attempt)(i, tmpdir.strpath, 'crash')
+                for i in range(3))
+    assert results == [0, 1, 4]
+
+
+def test_task_timeout(tmpdir):
+    p = Parallel(n_jobs=2, backend='threading', batch_size=1,
+                 task_timeout=.3, retries=1, retry_backoff=0)
+    # Only the first task is late: the other worker can run it again.
+    results = p(delayed(_fail_first_attempt)(i, tmpdir.strpath,
+                                             2 if i == 0 else 0)
+                for i in range(2))
+    assert results == [0, 1]
+
+    p = Parallel(n_jobs=2, backend='threading', batch_size=1,
+                 task_timeout=.3)
+    with raises(TimeoutError):
+        p(delayed(sleep)(1) for _ in range(2))
+
+
+def test_speculative_execution(tmpdir):
+    p = Parallel(n_jobs=2, backend='threading', batch_size=1,
+                 speculative=True)
+    t0 = time.time()
+    results = p(delayed(_fail_first_attempt)(i, tmpdir.strpath,
+                                             5 if i == 7 else 0)
+                for i in range(8))
+    assert results == [i ** 2 for i in range(8)]
+    assert time.time() - t0 < 4
+
+
+def test_invalid_retries():
+    with raises(ValueError, match='retries must be'):
+        Parallel(retries=-1)
+
+
+def _crash_on(x, crashing):
+    if x == crashing:
+        os._exit(1)
+    return x
+
+
+@parametrize('backend', ['sequential'] + PARALLEL_BACKENDS)
+def test_on_error_collect(backend):
+    from joblib.parallel import TaskFailure
+    p = Parallel(n_jobs=2, backend=backend, on_error='collect')
+    results = p(delayed(division)(1, x) for x in range(-3, 4))
+    assert [r for r in results if not isinstance(r, TaskFailure)] == [
+        1 / x for x in range(-3, 4) if x != 0]
+    failure = results[3]
+    assert isinstance(failure, TaskFailure)
+    assert isinstance(failure.exception, ZeroDivisionError)
+    assert 'ZeroDivisionError' in failure.traceback
+    assert p.last_failures == [failure] and failure.index == 3
+
+    results = p.map(division, [1, 1], [0, 2])
+    assert isinstance(results[0], TaskFailure) and results[1] == .5
+    assert p(delayed(square)(x) for x in range(3)) == [0, 1, 4]
+    assert p.last_failures == []
+
+
+@with_multiprocessing
+def test_on_error_collect_worker_crash():
+    from joblib.parallel import TaskFailure
+    p = Parallel(n_jobs=2, backend='loky', batch_size=1, on_error='collect')
+    results = p(delayed(_crash_on)(x, 3) for x in range(30))
+    assert len(results) == 30
+    assert isinstance(results[3], TaskFailure)
+    assert all(r == i for i, r in enumerate(results)
+               if not isinstance(r, TaskFailure))
+    # The workers were restarted for the remaining tasks. The ones running
+    # when the crash was detected may also have failed.
+    assert results[-1] == 29
+
+
+def test_invalid_on_error():
+    with raises(ValueError, match="on_error must be"):
+        Parallel(on_error='ignore')
+
+
+def _count_call(x, folder):
+    calls_folder = os.path.join(folder, 'calls')
+    with open(os.path.join(calls_folder, '%d-%d' % (
+            x, len(os.listdir(calls_folder)))), 'w'):
+        pass
+    if os.path.exists(os.path.join(folder, 'fail-%d' % x)):
+        raise ValueError(x)
+    return x ** 2
+
+
+def _calls(folder, start=0):
+    names = os.listdir(os.path.join(folder, 'calls'))
+    return [int(name.split('-')[0]) for name in names
+            if int(name.split('-')[1]) >= start]
+
+
+@parametrize('backend', ['sequential'] + PARALLEL_BACKENDS)
+def test_checkpoint(tmpdir, backend):
+    from joblib import Memory
+    folder = tmpdir.strpath
+    tmpdir.mkdir('calls')
+    tmpdir.join('fail-7').write('')
+    memory = Memory(tmpdir.join('checkpoint').strpath, verbose=0)
+    p = Parallel(n_jobs=2, backend=backend, batch_size=1, checkpoint=memory)
+    with raises(ValueError):
+        p(delayed(_count_call)(x, folder) for x in range(10))
+    n_calls = len(_calls(folder))
+    assert p.n_checkpointed_tasks == 0
+
+    # Only the tasks that were not completed are computed again.
+    tmpdir.join('fail-7').remove()
+    results = p(delayed(_count_call)(x, folder) for x in range(10))
+    assert results == [x ** 2 for x in range(10)]
+    recomputed = _calls(folder, start=n_calls)
+    assert 7 in recomputed
+    assert p.n_checkpointed_tasks == 10 - len(recomputed)
+    assert p.n_checkpointed_tasks >= 1
+
+    # Everything is loaded from the checkpoint, including when the tasks
+    # are passed as the arguments of map.
+    n_calls = len(_calls(folder))
+    results = p(delayed(_count_call)(x, folder) for x in range(10))
+    assert results == [x ** 2 for x in range(10)]
+    assert p.n_checkpointed_tasks == 10
+    results = p.map(_count_call, range(12), [folder] * 12)
+    assert results == [x ** 2 for x in range(12)]
+    assert p.n_checkpointed_tasks == 10
+    assert sorted(_calls(folder, start=n_calls)) == [10, 11]
+
+
+@parametrize('backend', PARALLEL_BACKENDS)
+def test_checkpoint_with_retries(tmpdir, backend):
+    from joblib import Memory
+    folder = tmpdir.strpath
+    tmpdir.mkdir('calls')
+    memory = Memory(tmpdir.join('checkpoint').strpath, verbose=0)
+    events = []
+    p = Parallel(n_jobs=2, backend=backend, batch_size=1, retries=1,
+                 retry_backoff=0, checkpoint=memory, callback=events.append)
+    results = p(delayed(_fail_first_attempt)(x, folder) for x in range(6))
+    assert results == [x ** 2 for x in range(6)]
+    # Each batch is completed once, by the attempt that succeeded.
+    completed = [e['batch_index'] for e in events
+                 if e['event'] == 'batch_completed']
+    assert sorted(completed) == list(range(6))
+    assert p.n_completed_tasks == 6
+
+    results = p(delayed(_fail_first_attempt)(x, folder) for x in range(6))
+    assert results == [x ** 2 for x in range(6)]
+    assert p.n_checkpointed_tasks == 6
+
+
+def _function_to_checkpoint(a, b):
+    # Placeholder whose code is replaced by the tests
+    pass
+
+
+def _sum(a, b):
+    return a + b
+
+
+def _product(a, b):
+    return a * b
+
+
+def test_checkpoint_function_code_change(tmpdir):
+    from joblib import Memory
+    memory = Memory(tmpdir.strpath, verbose=0)
+    _function_to_checkpoint.__code__ = _sum.__code__
+    p = Parallel(n_jobs=2, backend='threading', checkpoint=memory)
+    results = p(delayed(_function_to_checkpoint)(x, 3) for x in range(4))
+    assert results == [3, 4, 5, 6]
+    results = p(delayed(_function_to_checkpoint)(x, 3) for x in range(4))
+    assert p.n_checkpointed_tasks == 4
+
+    # The results of the previous code of the function are invalidated.
+    _function_to_checkpoint.__code__ = _product.__code__
+    results = p(delayed(_function_to_checkpoint)(x, 3) for x in range(4))
+    assert results == [0, 3, 6, 9]
+    assert p.n_checkpointed_tasks == 0
+
+
+def test_checkpoint_shared_with_memory(tmpdir):
+    from joblib import Memory
+    folder = tmpdir.strpath
+    tmpdir.mkdir('calls')
+    tmpdir.join('fail-2').write('')
+    location = tmpdir.join('checkpoint').strpath
+    # The location of the checkpoint can be given as a string.
+    results = Parallel(n_jobs=2, checkpoint=location, on_error='collect')(
+        delayed(_count_call)(x, folder) for x in range(4))
+    assert results[:2] + results[3:] == [0, 1, 9]
+    assert len(_calls(folder)) == 4
+
+    # The results are stored as the ones of Memory.cache, failures excepted.
+    cached = Memory(location, verbose=0).cache(_count_call)
+    assert cached(3, folder) == 9
+    assert len(_calls(folder)) == 4
+    with raises(ValueError):
+        cached(2, folder)
+    assert len(_calls(folder)) == 5
+
+
+def test_invalid_checkpoint():
+    from joblib import Memory
+    with raises(ValueError, match="checkpoint must be"):
+        Parallel(checkpoint=Memory(None))
+
+
+def _barrier(folder, name, n_tasks=2):
+    """Wait for n_tasks tasks to reach the barrier of the given name"""
+    task_id = '%d-%d' % (os.getpid(), threading.current_thread().ident)
+    with open(os.path.join(folder, name + task_id), 'w'):
+        pass
+    deadline = time.time() + 10
+    while time.time() < deadline and n_tasks > len(
+            [f for f in os.listdir(folder) if f.startswith(name)]):
+        sleep(0.01)
+
+
+def _nested_n_jobs(n_jobs, barrier_folder, wait_for_cores=None):
+    # Make sure that the 2 tasks of the outer call are running.
+    _barrier(barrier_folder, 'start')
+    if wait_for_cores is None:
+        n_jobs = Parallel(n_jobs=n_jobs)._initialize_backend()
+        _barrier(barrier_folder, 'end')
+        return n_jobs
+    backend, _ = parallel.get_active_backend()
+    deadline = time.time() + 10
+    while (time.time() < deadline and
+           backend.available_cores() < wait_for_cores):
+        sleep(0.01)
+    return Parallel(n_jobs=n_jobs)._initialize_backend()
+
+
+@parametrize('backend', ['threading', 'loky'])
+def test_nested_parallel_core_budget(tmpdir, monkeypatch, backend):
+    monkeypatch.setattr('joblib._parallel_backends._cpu_count', lambda: 8)
+    # The nested calls share the cores evenly, even when asking for more.
+    for n_jobs in [-1, 8]:
+        barrier_folder = tmpdir.mkdir('n_jobs_%d' % n_jobs).strpath
+        results = Parallel(n_jobs=2, backend=backend)(
+            delayed(_nested_n_jobs)(n_jobs, barrier_folder)
+            for _ in range(2))
+        assert results == [4, 4]
+
+    # The share of the cores grows as the outer tasks complete.
+    barrier_folder = tmpdir.mkdir('adaptive').strpath
+    results = Parallel(n_jobs=2, backend=backend)(
+        delayed(_nested_n_jobs)(-1, barrier_folder, wait_for_cores=n_cores)
+        for n_cores in [1, 8])
+    assert results == [4, 8]
+
+
+def test_core_budget():
+    from joblib._core_budget import CoreBudget
+    budget = CoreBudget(8, 4, shared=True)
+    for _ in range(4):
+        budget.task_started()
+    assert budget.share() == 2
+    # The workers see the number of running tasks of the parent.
+    worker_budget = pickle.loads(pickle.dumps(budget))
+    assert worker_budget.share() == 2
+    budget.task_completed()
+    budget.task_completed()
+    assert budget.share() == worker_budget.share() == 4
+    budget.close()
+    assert worker_budget.share() == 2
+
+    # The counter file is reused by the next calls.
+    other_budget = CoreBudget(8, 4, shared=True)
+    assert other_budget._path == worker_budget._path
+    assert other_budget.n_running() == 0
+    other_budget.close()
+
+
+def _get_thread_limits(array):
+    from joblib._clib_threads import get_thread_limits
+    return get_thread_limits()
+
+
+@with_numpy
+@with_multiprocessing
+@parametrize('backend', ['loky', 'multiprocessing'])
+def test_inner_max_num_threads(monkeypatch, backend):
+    from joblib._clib_threads import get_libraries
+    if not get_libraries():
+        raise SkipTest("numpy does not use a supported C-library")
+    # The array argument makes sure numpy is loaded before the batch starts.
+    # The thread pools of the reused loky workers are resized.
+    for n_threads in [3, 2]:
+        limits = Parallel(n_jobs=2, backend=backend,
+                          inner_max_num_threads=n_threads)(
+            delayed(_get_thread_limits)(np.ones(1)) for _ in range(4))
+        assert all(set(limit.values()) == set([n_threads])
+                   for limit in limits)
+
+    # With 'auto', each task gets its share of the cores.
+    monkeypatch.setattr('joblib._parallel_backends._cpu_count', lambda: 8)
+    limits = Parallel(n_jobs=2, backend=backend, batch_size=1,
+                      inner_max_num_threads='auto')(
+        delayed(_get_thread_limits)(np.ones(1)) for _ in range(4))
+    assert all(set(limit.values()) <= set([4, 8]) for limit in limits)
+
+
+def test_invalid_inner_max_num_threads():
+    for value in [0, 'all', 1.5]:
+        with raises(ValueError, match="inner_max_num_threads must be"):
+            Parallel(inner_max_num_threads=value)
+
+
+def test_function_payload_cache(monkeypatch):
+    from joblib.externals.cloudpickle import dumps
+    pickled = []
+
+    def recording_dumps(obj, *args, **kwargs):
+        pickled.append(obj)
+        return dumps(obj, *args, **kwargs)
+
+    monkeypatch.setattr('joblib.parallel.dumps', recording_dumps)
+    offset = 1
+    data = [1]
+    func = lambda x: x + offset  # noqa: E731
+    mutable_func = lambda x: x + data[0]  # noqa: E731
+    for _ in range(2):
+        assert Parallel(n_jobs=2)(delayed(func)(x) for x in range(3)) == [
+            1, 2, 3]
+        assert Parallel(n_jobs=2)(
+            delayed(mutable_func)(x) for x in range(3)) == [
+                x + data[0] for x in range(3)]
+        data[0] += 1
+    # The payload of func is reused by the second call while mutable_func,
+    # which references a list, is pickled again.
+    assert len([obj for obj in pickled if obj is func]) == 1
+    assert len([obj for obj in pickled if obj is mutable_func]) == 2
+
+
+@with_multiprocessing
+def test_unpickled_functions_cache():
+    from joblib.parallel import _load_cached_function, _BoundedCache
+    from joblib.externals.cloudpickle import dumps
+    double = lambda x: 2 * x  # noqa: E731
+    payload = dumps(double)
+    func = _load_cached_function('call-1', 'double-key', payload)
+    assert func(2) == 4
+    assert _load_cached_function('call-1', 'double-key', b'') is func
+    # Another call unpickles the function again.
+    other_func = _load_cached_function('call-2', 'double-key', payload)
+    assert other_func is not func
+
+    # The state kept by a function in the workers is reset at each call.
+    def count_calls(x):
+        count_calls.n_calls += 1
+        return count_calls.n_calls
+
+    count_calls.n_calls = 0
+    for _ in range(2):
+        results = Parallel(n_jobs=2, batch_size=1)(
+            delayed(count_calls)(x) for x in range(4))
+        assert results[0] == 1
+
+    cache = _BoundedCache(max_nbytes=10)
+    cache.put('a', 1, 4)
+    cache.put('b', 2, 4)
+    cache.get('a')
+    cache.put('c', 3, 4)
+    # The least recently used entry is evicted.
+    assert [cache.get(key) for key in 'abc'] == [1, None, 3]
+    cache.put('d', 4, 11)
+    assert cache.get('d') is None
+
+
+def test_need_pickle_wrapping_cached_decisions():
+    from functools import partial
+    from joblib.parallel import _need_pickle_wrapping
+
+    def nested(x):
+        return x
+
+    for _ in range(2):
+        for obj in [None, 1, 1.5, 'a', b'a', [1], {'a': 1}, square, abs]:
+            assert not _need_pickle_wrapping(obj)
+        assert _need_pickle_wrapping(lambda x: x)
+        assert _need_pickle_wrapping(nested)
+        assert _need_pickle_wrapping([nested])
+        assert _need_pickle_wrapping(partial(nested, 1))
+
+    # Changing the module of a function invalidates its cached decision.
+    def func(x):
+        return x
+    func.__code__ = square.__code__
+    assert not _need_pickle_wrapping(func)
+    func.__module__ = '__main__'
+    assert _need_pickle_wrapping(func)
+
+    # Instances of the same class share a decision.
+    interactive_class = type('InteractiveClass', (object,),
+                             {'__module__': '__main__'})
+    assert _need_pickle_wrapping(interactive_class())
+    assert _need_pickle_wrapping(interactive_class())
+    assert not _need_pickle_wrapping(ThreadingBackend())
+
+
+def _preloaded_info(module):
+    return module in sys.modules, os.getppid()
+
+
+@with_multiprocessing
+def test_loky_preload():
+    with parallel_backend('loky', preload=['colorsys']):
+        results = Parallel(n_jobs=2)(
+            delayed(_preloaded_info)('colorsys') for _ in range(4))
+    assert all(preloaded for preloaded, _ in results)
+    if sys.platform != 'win32' and PY3_OR_LATER:
+        # The workers are forked from the forkserver process.
+        assert all(parent != os.getpid() for _, parent in results)
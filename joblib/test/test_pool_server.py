@@ -0,0 +1,171 @@
+import os
+import sys
+import stat
+import socket
+import time
+import threading
+import multiprocessing
+
+from joblib.test.common import with_multiprocessing
+from joblib.testing import raises, fixture, skipif, check_subprocess_call
+from joblib.parallel import Parallel, delayed, parallel_backend
+from joblib.parallel import SequentialBackend
+from joblib.pool_server import PoolServer, PoolServerBackend
+
+
+pytestmark = skipif(sys.platform == 'win32',
+                    reason='Unix domain sockets are not available')
+
+
+@fixture
+def server(tmpdir):
+    server = PoolServer(tmpdir.join('socket').strpath, max_workers=2,
+                        preload=['json'])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.close()
+    thread.join()
+
+
+@with_multiprocessing
+def test_pool_server_access(tmpdir):
+    address = tmpdir.join('private').strpath
+    # The socket is not accessible to the others even with a permissive umask.
+    umask = os.umask(0)
+    try:
+        server = PoolServer(address, max_workers=1)
+    finally:
+        os.umask(umask)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        for filename in [address, address + '.authkey']:
+            assert stat.S_IMODE(os.stat(filename).st_mode) == 0o600
+        backend = PoolServerBackend(address, authkey=b'wrong key')
+        with raises(multiprocessing.AuthenticationError):
+            backend.effective_n_jobs(1)
+        # The clients use the key written by the server by default.
+        backend = PoolServerBackend(address)
+        assert backend.effective_n_jobs(-1) == 1
+        backend.terminate()
+    finally:
+        server.close()
+        thread.join()
+    assert not os.path.exists(address + '.authkey')
+
+
+@with_multiprocessing
+def test_pool_server_handshake_timeout(tmpdir):
+    address = tmpdir.join('socket').strpath
+    server = PoolServer(address, max_workers=1, handshake_timeout=0.5)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    silent_client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        silent_client.connect(address)
+        # A client that does not authenticate does not block the others.
+        backend = PoolServerBackend(address)
+        assert backend.effective_n_jobs(-1) == 1
+        backend.terminate()
+        # It is disconnected once the handshake timed out.
+        silent_client.settimeout(10)
+        while silent_client.recv(1024):
+            pass
+    finally:
+        silent_client.close()
+        server.close()
+        thread.join()
+
+
+def _worker_info(x):
+    return x, 'json' in sys.modules, os.getpid()
+
+
+def _check_positive(x):
+    if x < 0:
+        raise ValueError('negative value: %d' % x)
+    time.sleep(0.01)
+    return x
+
+
+@with_multiprocessing
+def test_pool_server(server):
+    pids = set()
+    for _ in range(2):
+        with parallel_backend('pool_server', address=server.address):
+            results = Parallel(n_jobs=-1)(
+                delayed(_worker_info)(x) for x in range(10))
+        assert [x for x, _, _ in results] == list(range(10))
+        assert all(preloaded for _, preloaded, _ in results)
+        pids.update(pid for _, _, pid in results)
+    # Both calls ran in the warm workers of the server.
+    assert len(pids) <= 2
+    assert os.getpid() not in pids
+
+
+@with_multiprocessing
+def test_pool_server_shared_by_clients(server):
+    # Concurrent clients are limited by the workers of the server.
+    backend = PoolServerBackend(address=server.address)
+    assert backend.effective_n_jobs(-1) == 2
+    assert backend.effective_n_jobs(8) == 2
+    results = []
+
+    def run_client():
+        with parallel_backend(PoolServerBackend(address=server.address)):
+            results.append(Parallel(n_jobs=2)(
+                delayed(_check_positive)(x) for x in range(20)))
+
+    threads = [threading.Thread(target=run_client) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [list(range(20))] * 3
+    backend.terminate()
+
+
+@with_multiprocessing
+def test_pool_server_errors(server):
+    with parallel_backend('pool_server', address=server.address):
+        with raises(ValueError, match='negative value: -1'):
+            Parallel(n_jobs=2)(delayed(_check_positive)(x)
+                               for x in [1, 2, -1] + list(range(20)))
+        # The server is still usable after the failure.
+        assert Parallel(n_jobs=2)(
+            delayed(_check_positive)(x) for x in range(5)) == list(range(5))
+
+    backend = PoolServerBackend(address=server.address)
+    backend.configure(n_jobs=2)
+    server.close()
+    job = backend.apply_async(lambda: 1)
+    with raises(RuntimeError, match='Lost the connection'):
+        job.get(timeout=10)
+
+
+def test_pool_server_backend_configuration(tmpdir, monkeypatch):
+    monkeypatch.delenv('JOBLIB_POOL_SERVER', raising=False)
+    with raises(ValueError, match='requires the address'):
+        PoolServerBackend()
+    monkeypatch.setenv('JOBLIB_POOL_SERVER', tmpdir.join('socket').strpath)
+    backend = PoolServerBackend()
+    assert backend.address == tmpdir.join('socket').strpath
+    assert backend.effective_n_jobs(None) == 1
+
+
+@with_multiprocessing
+def test_pool_server_sequential_fallback(server):
+    with parallel_backend('pool_server', address=server.address):
+        p = Parallel(n_jobs=1)
+        assert p(delayed(_worker_info)(x) for x in range(2))[0][2] == (
+            os.getpid())
+        assert isinstance(p._backend, SequentialBackend)
+
+
+def test_pool_server_command_line():
+    check_subprocess_call([sys.executable, '-m', 'joblib.pool_server',
+                           '--help'], stdout_regex=r'--max-workers')